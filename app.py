@@ -1,13 +1,40 @@
-from flask import Flask, request, jsonify
-from sshtunnel import SSHTunnelForwarder
+from flask import Flask, request, jsonify, g
 import pymysql
 from dbutils.pooled_db import PooledDB
 import time
 import atexit
 import csv
 import os
+import threading
+import re
+import signal
+import queue
+import hashlib
+import struct
+import decimal
+import uuid
+import dataclasses
+import functools
+from array import array
+from datetime import date, datetime, timedelta
+from collections import OrderedDict, deque, namedtuple
+from types import MappingProxyType
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
 from waitress import serve
 from flask_cors import CORS
+import metrics
+import poll_rates
+import prefork
+import reqlog
+import shmcache
+from ssh_tunnel import TunnelSupervisor
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用 Flask 默认序列化
+    orjson = None
 
 app = Flask(__name__)
 
@@ -28,6 +55,52 @@ else:
     ]
     CORS(app, resources={r"/*": {"origins": PRIVATE_ORIGINS, "methods": ["GET", "POST", "OPTIONS"]}})
 
+# 配置 JSON 序列化：通过环境变量 JSON_BACKEND 控制：'orjson'（已安装时默认）或 'flask'
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson' if orjson else 'flask').lower()
+
+
+# 快照中的行每次请求都会重新序列化，同一时间值的 HTTP 日期格式化结果缓存复用
+cached_http_date = functools.lru_cache(maxsize=4096)(http_date)
+
+
+def json_default(o):
+    """orjson 不直接处理的类型，转换规则与 Flask 默认序列化一致"""
+    if isinstance(o, date):
+        return cached_http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if isinstance(o, timedelta):
+        # MySQL TIME 字段（Flask 默认序列化不支持）
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """基于 orjson 的序列化：直接生成 UTF-8 bytes 作为响应体
+
+    键排序、Decimal / datetime 的转换与 Flask 默认一致，只是中文不再转义为 \\uXXXX。
+    """
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=json_default, option=self.options).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        """序列化为带换行的 bytes（与 jsonify 的响应体格式一致）"""
+        return orjson.dumps(obj, default=json_default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+if JSON_BACKEND == 'orjson':
+    if orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson 需要先安装 orjson：pip install orjson")
+    app.json = OrjsonProvider(app)
+
 # SSH 和数据库信息
 SSH_CONFIG = {
     'host': '192.168.0.196',
@@ -54,602 +127,2835 @@ DB_CONFIG_SCADA_MES = {
     'database': 'ute_mes_qms_new'  
 }
 
-# 全局 SSH 隧道和连接池 - 
-tunnel_scada = None
-db_pool_scada = None
+# 数据库目标：'production'（默认，经 SSH 隧道访问生产库）或 'local'（直连 gen_dataset.py 生成的模拟库，用于离线压测）
+# local 时库名不变，地址与账号取 LOCAL_DB_HOST / LOCAL_DB_PORT / LOCAL_DB_USER / LOCAL_DB_PASSWORD
+DB_TARGET = os.getenv('DB_TARGET', 'production').lower()
+if DB_TARGET == 'local':
+    for db_config in (DB_CONFIG_SCADA, DB_CONFIG_SCADA_MES):
+        db_config.update(
+            host=os.getenv('LOCAL_DB_HOST', '127.0.0.1'),
+            port=int(os.getenv('LOCAL_DB_PORT', '3306')),
+            user=os.getenv('LOCAL_DB_USER', 'root'),
+            password=os.getenv('LOCAL_DB_PASSWORD', '')
+        )
+# 是否经 SSH 隧道访问数据库：production 默认 '1'，local 默认 '0'
+SSH_ENABLED = os.getenv('SSH_ENABLED', '0' if DB_TARGET == 'local' else '1') == '1'
+
+# 连接池名称 → 数据库配置（表族通过名称选择连接池）
+POOL_CONFIGS = {
+    'scada': DB_CONFIG_SCADA,
+    'mes': DB_CONFIG_SCADA_MES
+}
+
+# 只读副本：每个逻辑库可配置多个副本（逗号分隔的 host[:port]，账号与库名同主库），如 SCADA_REPLICAS=10.0.0.2,10.0.0.3:3307
+# 最新行、历史与趋势查询发往在线、复制延迟达标且测得往返延迟最低的副本，没有可用副本时发往主库；
+# 主库被判定为故障时，映射、表目录等其余查询也改用副本
+DB_REPLICAS = {
+    'scada': os.getenv('SCADA_REPLICAS', ''),
+    'mes': os.getenv('MES_REPLICAS', '')
+}
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', '5'))  # 健康检查间隔（秒）
+REPLICA_CHECK_TIMEOUT = int(os.getenv('REPLICA_CHECK_TIMEOUT', '3'))      # 健康检查的连接与读写超时（秒）
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '10'))               # 复制延迟超过该值（秒）或无法确定时不发往该副本
+REPLICA_LAG_SQL = os.getenv('REPLICA_LAG_SQL')  # 查询复制延迟（秒）的 SQL（取第一行第一列），未设置时读取 SHOW REPLICA STATUS
+REPLICA_FAILURE_THRESHOLD = int(os.getenv('REPLICA_FAILURE_THRESHOLD', '3'))  # 取连接连续失败该次数（非连接层错误）后判定端点故障
+REPLICA_LATENCY_WEIGHT = 0.3                    # 往返延迟指数加权平均中新样本的权重
+CONNECT_ERRORS = (2003, 2006, 2013)             # 连接层错误（无法连接、连接已断开、查询中连接丢失），出现即判定端点故障
+
+
+def parse_addresses(value, default_port=3306):
+    """解析 'host[:port],host[:port]' 形式的地址列表"""
+    addresses = []
+    for item in value.split(','):
+        host, _, port = item.strip().partition(':')
+        if host:
+            addresses.append((host, int(port) if port else default_port))
+    return addresses
+
+
+def build_endpoints():
+    """数据库端点：端点名称 → {'pool', 'role', 'host', 'port'}；主库端点名称即逻辑库名称，副本为 '{逻辑库}-r{序号}'"""
+    endpoints = {}
+    for name, db_config in POOL_CONFIGS.items():
+        endpoints[name] = {'pool': name, 'role': 'primary', 'host': db_config['host'], 'port': db_config['port']}
+        for i, (host, port) in enumerate(parse_addresses(DB_REPLICAS[name], db_config['port']), 1):
+            endpoints[f"{name}-r{i}"] = {'pool': name, 'role': 'replica', 'host': host, 'port': port}
+    return endpoints
+
 
-tunnel_mes = None
+DB_ENDPOINTS = build_endpoints()
+REPLICAS_BY_POOL = {
+    name: [endpoint for endpoint, info in DB_ENDPOINTS.items() if info['pool'] == name and info['role'] == 'replica']
+    for name in POOL_CONFIGS
+}
+
+# 连接池大小：mincached 启动时建立的空闲连接数，maxcached 空闲连接上限，maxconnections 连接总数上限
+POOL_SIZES = {
+    'scada': {'mincached': 10, 'maxcached': 24, 'maxconnections': 30},
+    'mes': {'mincached': 2, 'maxcached': 8, 'maxconnections': 10}
+}
+POOL_WAIT_WINDOW = int(os.getenv('POOL_WAIT_WINDOW', '1024'))  # 取连接等待时间统计窗口（最近 N 次）
+
+# 空闲连接数自动调整：根据取连接等待时间与连接新建/关闭次数，在 [mincached, maxconnections] 内调整 maxcached
+# 通过环境变量 POOL_TUNE_ENABLED 控制：'0'（默认）关闭，'1' 开启
+POOL_TUNE_ENABLED = os.getenv('POOL_TUNE_ENABLED', '0') == '1'
+POOL_TUNE_INTERVAL = float(os.getenv('POOL_TUNE_INTERVAL', '30'))  # 调整间隔（秒）
+POOL_TUNE_WAIT_MS = float(os.getenv('POOL_TUNE_WAIT_MS', '5'))     # 等待时间 P95 超过该值（毫秒）时增大空闲上限
+POOL_TUNE_STEP = int(os.getenv('POOL_TUNE_STEP', '2'))             # 每次调整的连接数
+
+# 全局 SSH 隧道和连接池 - 两个数据库共用一条 SSH 连接（见 ssh_tunnel.py）
+ssh_tunnel = None
+db_pool_scada = None
 db_pool_mes = None
-variable_name_map = {}
-code_name_map = {}  # Code → Name 映射
+replica_pools = {}  # 副本端点名称 → 连接池
+# 参数映射：每次加载都构建新的只读映射，在 mapping_plan_lock 下与版本号一起整体替换
+variable_name_map = MappingProxyType({})
+code_name_map = MappingProxyType({})  # Code → Name 映射
+mapping_version = 0      # 映射版本号，每次加载映射后递增，用于使映射计划、快照映射结果与 ETag 失效
+mapping_checksum = None  # dms_device_parameter 的校验和，未变化时跳过重新加载
+mapping_digest = ''      # 映射内容的摘要：与加载次数无关，各进程加载到相同映射时相同，用于 ETag
+mapping_loaded_at = None
+MAPPING_REFRESH_INTERVAL = float(os.getenv('MAPPING_REFRESH_INTERVAL', '60'))  # 映射检查间隔（秒）
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')  # 管理接口令牌（请求头 X-Admin-Token），未设置时不校验
+
+# 映射计划：每张表的字段 → 显示名解析一次，缓存为有序 (字段, 输出名) 元组，按 LRU 淘汰
+MAPPING_PLAN_CACHE_SIZE = int(os.getenv('MAPPING_PLAN_CACHE_SIZE', '1024'))
+mapping_plans = OrderedDict()  # (table_name, keep_unmapped) → (mapping_version, 字段元组, 映射计划)
+mapping_plan_lock = threading.Lock()
+
+# 最新行快照：后台线程按固定间隔刷新已知设备表的最新一行，接口直接从内存读取
+# 通过环境变量 SNAPSHOT_ENABLED 控制：'1'（默认）开启，'0' 关闭（每次请求直接查库）
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', '1') == '1'
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '1'))     # 刷新间隔（秒）
+SNAPSHOT_IDLE_TTL = float(os.getenv('SNAPSHOT_IDLE_TTL', '300'))   # 超过该时长无人读取则不再刷新（秒）
+# 快照超过 SNAPSHOT_MAX_AGE 秒仍直接返回，同时后台刷新一次；超过 SNAPSHOT_MAX_STALE 秒则同步查库
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', '2'))
+SNAPSHOT_MAX_STALE = float(os.getenv('SNAPSHOT_MAX_STALE', '30'))
 
+snapshot_store = {}  # (pool, table_name) → {'row', 'mapped', 'updated_at', 'last_read'}，mapped 在行 ID 不变时沿用
+snapshot_lock = threading.Lock()
 
-def load_variable_name_map():
-    """从数据库读取 dms_device_parameter 表，加载映射到内存"""
+# 后台线程（快照刷新、表目录刷新等）统一通过 background_stop 停止
+background_stop = threading.Event()
+background_threads = {}  # name → Thread
+
+# 请求合并：同一张表同时只有一个查库请求在执行，其余请求等待并共享其结果
+inflight = {}         # (pool, table_name) → Future
+revalidating = set()  # 已提交后台刷新、尚未完成的 (pool, table_name)
+inflight_lock = threading.Lock()
+revalidate_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='snapshot-revalidate')
+
+# 推送订阅：快照中某张表出现新的 ID 时，推送给订阅该表的所有 SSE 连接
+# 每个 SSE 连接占用一个 waitress 线程，STREAM_MAX_CLIENTS 需小于 waitress 线程数
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', '16'))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))  # 心跳间隔（秒）
+stream_subscribers = {}  # (pool, table_name) → {queue.Queue}
+stream_clients = 0
+stream_lock = threading.Lock()
+
+# 表目录：从 information_schema.TABLES 加载的设备表名，请求先按目录校验，不存在的表直接返回 404
+# 目录中没有的表查一次库确认，确认不存在后在 CATALOG_MISS_TTL 秒内不再查库
+CODE_PATTERN = re.compile(r'^[0-9A-Za-z_\-]{1,64}$')  # code 只允许字母、数字、下划线、连字符
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', '300'))  # 目录刷新间隔（秒）
+CATALOG_MISS_TTL = float(os.getenv('CATALOG_MISS_TTL', '60'))                   # 不存在的表的缓存时长（秒）
+CATALOG_MISS_MAX = 10000                                                       # 不存在的表最多缓存条数
+table_catalog = {}              # pool → frozenset(表名)
+catalog_misses = OrderedDict()  # (pool, table_name) → 过期时间
+catalog_lock = threading.Lock()
+
+
+MAPPING_CHECKSUM_SQL = "CHECKSUM TABLE iplantute.dms_device_parameter"
+MAPPING_SQL = "SELECT Code, VariableName, Name FROM iplantute.dms_device_parameter"
+
+
+def install_name_maps(rows, checksum):
+    """由 dms_device_parameter 的行构建新的只读映射，与版本号一起整体替换"""
+    global code_name_map, variable_name_map, mapping_version, mapping_checksum, mapping_digest, mapping_loaded_at
+    new_code_map = {}
+    new_variable_map = {}
+    
+    for row in rows:
+        code = row.get('Code')
+        var_name = row.get('VariableName')
+        name = row.get('Name')
+        
+        # Code → Name（Code 是唯一的）
+        if code and name:
+            new_code_map[str(code)] = str(name)
+        
+        # VariableName → Name（允许重复）
+        if var_name and name:
+            new_variable_map[str(var_name)] = str(name)
+
+    digest = hashlib.sha1(repr((sorted(new_code_map.items()), sorted(new_variable_map.items()))).encode('utf-8')).hexdigest()[:16]
+
+    # 整体替换映射，已编译的映射计划全部失效
+    with mapping_plan_lock:
+        code_name_map = MappingProxyType(new_code_map)
+        variable_name_map = MappingProxyType(new_variable_map)
+        mapping_version += 1
+        mapping_checksum = checksum
+        mapping_digest = digest
+        mapping_loaded_at = time.time()
+        mapping_plans.clear()
+    
+    print(f"已从数据库加载参数映射 (版本 {mapping_version}):")
+    print(f"  Code 映射数: {len(new_code_map)}")
+    print(f"  VariableName 映射数: {len(new_variable_map)} (去重后)")
+
+
+def load_variable_name_map(force=False):
+    """从数据库读取 dms_device_parameter 表，构建新的映射并整体替换
+
+    先查询表校验和，未变化且非强制时跳过；返回是否重新加载。
+    """
     if not db_pool_scada:
         print("错误：连接池未初始化")
-        return
+        return False
     
     try:
-        connection = db_pool_scada.connection()
-        with connection.cursor() as cursor:
-            # 查询设备参数表
-            sql = "SELECT Code, VariableName, Name FROM iplantute.dms_device_parameter"
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            
-            var_count = 0
-            code_count = 0
-            
-            for row in rows:
-                code = row.get('Code')
-                var_name = row.get('VariableName')
-                name = row.get('Name')
-                
-                # Code → Name（Code 是唯一的）
-                if code and name:
-                    code_name_map[str(code)] = str(name)
-                    code_count += 1
-                
-                # VariableName → Name（允许重复）
-                if var_name and name:
-                    if var_name not in variable_name_map:
-                        var_count += 1
-                    variable_name_map[str(var_name)] = str(name)
-            
-            print(f"已从数据库加载参数映射:")
-            print(f"  Code 映射数: {code_count}")
-            print(f"  VariableName 映射数: {var_count} (去重后)")
-            
-        connection.close()
+        connection = get_pool('scada').connection()
+        try:
+            with connection.cursor() as cursor:
+                # 表校验和：不支持时为 None，每次都重新加载
+                try:
+                    cursor.execute(MAPPING_CHECKSUM_SQL)
+                    checksum = (cursor.fetchone() or {}).get('Checksum')
+                except Exception:
+                    checksum = None
+                if not force and checksum is not None and checksum == mapping_checksum:
+                    return False
+
+                # 查询设备参数表
+                cursor.execute(MAPPING_SQL)
+                rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        install_name_maps(rows, checksum)
+        return True
         
     except Exception as e:
         print(f"加载映射失败: {str(e)}")
+        return False
 
-def init_connection_pool():
-    """初始化 SSH 隧道和数据库连接池（两个数据库）"""
-    global tunnel_scada, db_pool_scada, tunnel_mes, db_pool_mes
-    
-    print("=" * 60)
-    
-    # ========== SCADA系统 ==========
-    print("正在建立 SSH 隧道 → 192.168.10.251...")
-    tunnel_scada = SSHTunnelForwarder(
-        (SSH_CONFIG['host'], SSH_CONFIG['port']),
-        ssh_username=SSH_CONFIG['user'],
-        ssh_password=SSH_CONFIG['password'],
-        remote_bind_address=(DB_CONFIG_SCADA['host'], DB_CONFIG_SCADA['port']),
-        local_bind_address=('127.0.0.1', 0)
-    )
-    tunnel_scada.start()
-    print(f"SSH 隧道已建立 (SCADA)，本地端口: {tunnel_scada.local_bind_port}")
-    
-    print("正在创建数据库连接池 (SCADA)...")
-    db_pool_scada = PooledDB(
-        creator=pymysql,
-        maxconnections=30,
-        mincached=10,
-        maxcached=24,
-        maxshared=0,
-        blocking=True,
-        maxusage=0,
-        setsession=[],
-        ping=1,
-        host='127.0.0.1',
-        port=tunnel_scada.local_bind_port,
-        user=DB_CONFIG_SCADA['user'],
-        password=DB_CONFIG_SCADA['password'],
-        database=DB_CONFIG_SCADA['database'],
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    print(f"连接池已创建 (SCADA) [初始连接: 10, 最大连接: 30]")
-    
-    # ========== MES系统 ==========
-    print("-" * 60)
-    print("正在建立 SSH 隧道 → 192.168.0.225...")
-    tunnel_mes = SSHTunnelForwarder(
-        (SSH_CONFIG['host'], SSH_CONFIG['port']),
-        ssh_username=SSH_CONFIG['user'],
-        ssh_password=SSH_CONFIG['password'],
-        remote_bind_address=(DB_CONFIG_SCADA_MES['host'], DB_CONFIG_SCADA_MES['port']),
-        local_bind_address=('127.0.0.1', 0)
-    )
-    tunnel_mes.start()
-    print(f"SSH 隧道已建立 (MES)，本地端口: {tunnel_mes.local_bind_port}")
-    
-    print("正在创建数据库连接池 (MES)...")
-    db_pool_mes = PooledDB(
-        creator=pymysql,
-        maxconnections=10,
-        mincached=2,
-        maxcached=8,
-        maxshared=0,
-        blocking=True,
-        maxusage=0,
-        setsession=[],
-        ping=1,
-        host='127.0.0.1',
-        port=tunnel_mes.local_bind_port,
-        user=DB_CONFIG_SCADA_MES['user'],
-        password=DB_CONFIG_SCADA_MES['password'],
-        database=DB_CONFIG_SCADA_MES['database'],
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
+
+def start_mapping_worker():
+    """启动映射刷新线程：每 MAPPING_REFRESH_INTERVAL 秒检查一次 dms_device_parameter 是否变化"""
+    start_periodic('mapping-worker', MAPPING_REFRESH_INTERVAL, load_variable_name_map)
+
+
+def compile_mapping_plan(columns, keep_unmapped=False, code_map=None, variable_map=None):
+    """将字段列表编译为映射计划：优先用 Code，其次用 VariableName，都失败则跳过（keep_unmapped=True 时保留原key）"""
+    code_map = code_name_map if code_map is None else code_map
+    variable_map = variable_name_map if variable_map is None else variable_map
+    plan = []
+    for k in columns:
+        # 先尝试 Code 映射
+        mapped_key = code_map.get(str(k))
+        if mapped_key is None:
+            # 再尝试 VariableName 映射
+            mapped_key = variable_map.get(str(k))
+
+        if mapped_key is None and keep_unmapped:
+            mapped_key = k
+        if mapped_key is not None:
+            plan.append((k, mapped_key))
+    return tuple(plan)
+
+
+def get_mapping_plan(table_name, columns, keep_unmapped=False):
+    """获取表的映射计划：映射版本或表字段变化时重新编译，缓存超过 MAPPING_PLAN_CACHE_SIZE 时淘汰最久未用的"""
+    key = (table_name, keep_unmapped)
+    with mapping_plan_lock:
+        cached = mapping_plans.get(key)
+        if cached is not None and cached[0] == mapping_version and cached[1] == columns:
+            mapping_plans.move_to_end(key)
+            return cached[2]
+        # 同一把锁下取版本号与映射，保证编译时使用同一版本的两张映射
+        version, code_map, variable_map = mapping_version, code_name_map, variable_name_map
+
+    plan = compile_mapping_plan(columns, keep_unmapped, code_map, variable_map)
+    with mapping_plan_lock:
+        # 编译期间映射被重新加载时不写入缓存，避免旧计划覆盖
+        if version == mapping_version:
+            mapping_plans[key] = (version, columns, plan)
+            mapping_plans.move_to_end(key)
+            while len(mapping_plans) > MAPPING_PLAN_CACHE_SIZE:
+                mapping_plans.popitem(last=False)
+    return plan
+
+
+def map_row(table_name, row, keep_unmapped=False):
+    """按表的映射计划映射一行数据"""
+    plan = get_mapping_plan(table_name, tuple(row), keep_unmapped)
+    return {mapped_key: row[k] for k, mapped_key in plan}
+
+
+def primary_pool(pool):
+    """逻辑库的主库连接池：'scada' 或 'mes'"""
+    return db_pool_scada if pool == 'scada' else db_pool_mes
+
+
+def endpoint_pool(endpoint):
+    """端点的连接池（主库或副本）"""
+    if DB_ENDPOINTS[endpoint]['role'] == 'primary':
+        return primary_pool(endpoint)
+    return replica_pools.get(endpoint)
+
+
+def endpoint_pools():
+    """已创建的所有连接池：[(端点名称, 连接池)]"""
+    pools = [(endpoint, endpoint_pool(endpoint)) for endpoint in DB_ENDPOINTS]
+    return [(endpoint, pool) for endpoint, pool in pools if pool]
+
+
+def get_pool(pool):
+    """按名称获取连接池：'scada' 或 'mes'（主库被判定为故障时为在线的副本，见 choose_endpoint）"""
+    return endpoint_pool(choose_endpoint(pool))
+
+
+def read_pool(pool):
+    """只读查询（最新行、历史、趋势）的连接池：优先为延迟最低的可用副本"""
+    return endpoint_pool(choose_endpoint(pool, replica=True))
+
+
+def latest_row_sql(pool, table_name):
+    """查询设备表最新一行的 SQL（table_name 须已通过 resolve_table 校验）"""
+    database = POOL_CONFIGS[pool]['database']
+    return f"SELECT * FROM `{database}`.`{table_name}` ORDER BY ID DESC LIMIT 1"
+
+
+def table_columns_query(pool, table_names):
+    """查询多张表字段结构的 (sql, 参数)"""
+    placeholders = ', '.join(['%s'] * len(table_names))
+    sql = (
+        "SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, COLUMN_TYPE AS column_type "
+        "FROM information_schema.COLUMNS "
+        f"WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({placeholders}) "
+        "ORDER BY TABLE_NAME, ORDINAL_POSITION"
     )
-    print(f"连接池已创建 (MES) [初始连接: 2, 最大连接: 10]")
-    print("=" * 60)
+    return sql, [POOL_CONFIGS[pool]['database'], *table_names]
 
-def cleanup():
-    """关闭连接池和 SSH 隧道"""
-    global tunnel_scada, db_pool_scada, tunnel_mes, db_pool_mes
-    print("\n正在关闭连接池和 SSH 隧道...")
-    
-    # 关闭 SCADA系统 资源
-    if db_pool_scada:
-        db_pool_scada.close()
-    if tunnel_scada:
-        tunnel_scada.stop()
-    
-    # 关闭 MES系统 资源
-    if db_pool_mes:
-        db_pool_mes.close()
-    if tunnel_mes:
-        tunnel_mes.stop()
-    
-    print("资源已释放")
 
-# 注册退出时的清理函数
-atexit.register(cleanup)
+def plan_latest_union(pool, table_names, column_rows):
+    """按字段结构（字段名 + 类型）分组生成 UNION ALL 语句
 
+    返回 ([(sql, 该组表名列表)], {不存在的表: LookupError})。
+    """
+    database = POOL_CONFIGS[pool]['database']
+    columns = {}
+    for row in column_rows:
+        columns.setdefault(row['table_name'], []).append((row['column_name'], row['column_type']))
 
-# 工艺数据
-@app.route('/api/process_data', methods=['GET', 'POST'])
-def process_data():
-    start_time = time.time()
-    connection = None
-    
+    missing = {}
+    groups = {}
+    for table_name in table_names:
+        if table_name not in columns:
+            missing[table_name] = LookupError(f"表不存在: {table_name}")
+            continue
+        groups.setdefault(tuple(columns[table_name]), []).append(table_name)
+
+    statements = []
+    for signature, tables in groups.items():
+        column_sql = ', '.join(f"`{name}`" for name, _ in signature)
+        sql = " UNION ALL ".join(
+            f"SELECT * FROM (SELECT %s AS `__table`, {column_sql} "
+            f"FROM `{database}`.`{table_name}` ORDER BY ID DESC LIMIT 1) AS t{i}"
+            for i, table_name in enumerate(tables)
+        )
+        statements.append((sql, tables))
+    return statements, missing
+
+
+def union_rows_by_table(tables, rows):
+    """将 UNION ALL 结果按表名拆分，没有数据的表为 None"""
+    results = dict.fromkeys(tables)
+    for row in rows:
+        results[row.pop('__table')] = row
+    return results
+
+
+def query_latest_row(table_name, connection=None, pool='scada'):
+    """直接查询设备表的最新一行（不传 connection 时从 pool 对应的连接池获取）"""
+    own_connection = connection is None
+    if own_connection:
+        connection = read_pool(pool).connection()
     try:
-        # 获取 code 参数
-        if request.method == 'POST':
-            code = request.json.get('code')
-        else:
-            code = request.args.get('code')
-        
-        if not code:
-            elapsed = (time.time() - start_time) * 1000
-            print(f"[请求失败] 耗时: {elapsed:.2f}ms - 缺少 code 参数")
-            return jsonify({
-                'success': False,
-                'error': '缺少 code 参数'
-            }), 400
-        
-        # 从连接池获取连接
-        connection = db_pool_scada.connection()
-        
         with connection.cursor() as cursor:
-            # 执行查询
-            table_name = f"dms_device_technology_{code}"
-            sql = f"SELECT * FROM iplantute.`{table_name}` ORDER BY ID DESC LIMIT 1"
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            
-            elapsed = (time.time() - start_time) * 1000
-            
-            if result:
-                # 尝试映射：优先用 Code，其次用 VariableName，都失败则跳过
-                mapped = {}
-                for k, v in result.items():
-                    # 先尝试 Code 映射
-                    mapped_key = code_name_map.get(str(k))
-                    if mapped_key is None:
-                        # 再尝试 VariableName 映射
-                        mapped_key = variable_name_map.get(str(k))
-                    
-                    if mapped_key is not None:
-                        mapped[mapped_key] = v
-
-                print(f"[查询成功] code={code}, 耗时: {elapsed:.2f}ms, 原始字段数={len(result)}, 映射字段数={len(mapped)}")
-                return jsonify({
-                    'success': True,
-                    'data': mapped,
-                    'elapsed_ms': round(elapsed, 2)
-                })
-            else:
-                print(f"[无数据] code={code}, 耗时: {elapsed:.2f}ms")
-                return jsonify({
-                    'success': True,
-                    'data': None,
-                    'message': '未查询到数据',
-                    'elapsed_ms': round(elapsed, 2)
-                })
-                
-    except Exception as e:
-        elapsed = (time.time() - start_time) * 1000
-        print(f"[查询异常] 耗时: {elapsed:.2f}ms - 错误: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'elapsed_ms': round(elapsed, 2)
-        }), 500
-    
+            cursor.execute(latest_row_sql(pool, table_name))
+            return cursor.fetchone()
     finally:
-        # 归还连接到连接池
-        if connection:
+        if own_connection:
             connection.close()
 
-# 效率数据
-@app.route('/api/efficiency_data', methods=['GET', 'POST'])
-def efficiency_data():
-    start_time = time.time()
-    connection = None
-    
+
+def fetch_latest_rows(table_names, connection=None, pool='scada'):
+    """批量查询多张设备表的最新一行，返回 {table_name: 行 | None | 异常}
+
+    先从 information_schema 读取各表字段，字段结构相同的表合并为一条 UNION ALL 语句，
+    N 张表只需 1 + 结构种类数 次往返；不存在的表以 LookupError 返回，不影响其他表。
+    """
+    table_names = list(dict.fromkeys(table_names))
+    if not table_names:
+        return {}
+
+    own_connection = connection is None
+    if own_connection:
+        connection = read_pool(pool).connection()
     try:
-        # 获取 code 参数
-        if request.method == 'POST':
-            code = request.json.get('code')
-        else:
-            code = request.args.get('code')
-        
-        if not code:
-            elapsed = (time.time() - start_time) * 1000
-            print(f"[请求失败] 耗时: {elapsed:.2f}ms - 缺少 code 参数")
-            return jsonify({
-                'success': False,
-                'error': '缺少 code 参数'
-            }), 400
-        
-        # 从连接池获取连接
-        connection = db_pool_scada.connection()
-        
         with connection.cursor() as cursor:
-            # 执行查询
-            table_name = f"dms_device_workparams_{code}"
-            sql = f"SELECT * FROM iplantute.`{table_name}` ORDER BY ID DESC LIMIT 1"
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            
-            elapsed = (time.time() - start_time) * 1000
-            
-            if result:
-                # 尝试映射：优先用 Code，其次用 VariableName，都失败则跳过
-                mapped = {}
-                for k, v in result.items():
-                    # 先尝试 Code 映射
-                    mapped_key = code_name_map.get(str(k))
-                    if mapped_key is None:
-                        # 再尝试 VariableName 映射
-                        mapped_key = variable_name_map.get(str(k))
-                    
-                    if mapped_key is not None:
-                        mapped[mapped_key] = v
-
-                print(f"[查询成功] code={code}, 耗时: {elapsed:.2f}ms, 原始字段数={len(result)}, 映射字段数={len(mapped)}")
-                return jsonify({
-                    'success': True,
-                    'data': mapped,
-                    'elapsed_ms': round(elapsed, 2)
-                })
-            else:
-                print(f"[无数据] code={code}, 耗时: {elapsed:.2f}ms")
-                return jsonify({
-                    'success': True,
-                    'data': None,
-                    'message': '未查询到数据',
-                    'elapsed_ms': round(elapsed, 2)
-                })
-                
-    except Exception as e:
-        elapsed = (time.time() - start_time) * 1000
-        print(f"[查询异常] 耗时: {elapsed:.2f}ms - 错误: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'elapsed_ms': round(elapsed, 2)
-        }), 500
-    
+            cursor.execute(*table_columns_query(pool, table_names))
+            statements, results = plan_latest_union(pool, table_names, cursor.fetchall())
+
+            for sql, tables in statements:
+                try:
+                    cursor.execute(sql, tables)
+                    rows = cursor.fetchall()
+                except Exception as e:
+                    results.update(dict.fromkeys(tables, e))
+                    continue
+                results.update(union_rows_by_table(tables, rows))
     finally:
-        # 归还连接到连接池
-        if connection:
+        if own_connection:
             connection.close()
+    return results
 
-# 详细在线检验数据  
-@app.route('/api/detailed_online_inspection', methods=['GET', 'POST'])
-def detailed_online_inspection():
-    start_time = time.time()
-    connection = None
-    
-    try:
-        # 获取 code 参数
-        if request.method == 'POST':
-            code = request.json.get('code')
+
+def _new_snapshot_entry(row, last_read):
+    return {'row': row, 'mapped': {}, 'updated_at': time.time(), 'last_read': last_read}
+
+
+def _snapshot_result(table_name, entry, keep_unmapped, aggregate=None):
+    """从快照条目取出 (原始行, 映射结果, 快照时间)，映射结果按 keep_unmapped、汇总函数与映射版本分别缓存
+
+    aggregate 不为空时第二项为 aggregate(table_name, row, keep_unmapped) 的汇总结果。
+    """
+    row = entry['row']
+    if row is None:
+        return None, None, entry['updated_at']
+
+    key = (keep_unmapped, mapping_version, aggregate)
+    mapped = entry['mapped'].get(key)
+    if mapped is None:
+        started = time.perf_counter()
+        mapped = aggregate(table_name, row, keep_unmapped) if aggregate else map_row(table_name, row, keep_unmapped)
+        entry['mapped'][key] = mapped
+        metrics.add_phase('map', time.perf_counter() - started)
+    return row, mapped, entry['updated_at']
+
+
+def single_flight_many(keys, fn):
+    """请求合并：已在执行中的 key 等待其结果，其余 key 由本次调用执行 fn(keys) 一次性获取
+
+    fn 返回 {key: 结果}；fn 抛出异常时，本次负责的所有 key 的等待者都收到同一异常。
+    """
+    futures = {}
+    leading = []
+    with inflight_lock:
+        for key in dict.fromkeys(keys):
+            future = inflight.get(key)
+            if future is None:
+                future = Future()
+                inflight[key] = future
+                leading.append(key)
+            futures[key] = future
+
+    if leading:
+        try:
+            results = fn(leading)
+        except BaseException as e:
+            for key in leading:
+                futures[key].set_exception(e)
+            raise
         else:
-            code = request.args.get('code')
-        
-        if not code:
-            elapsed = (time.time() - start_time) * 1000
-            print(f"[请求失败-225] 耗时: {elapsed:.2f}ms - 缺少 code 参数")
-            return jsonify({
-                'success': False,
-                'error': '缺少 code 参数'
-            }), 400
-        
-        # 从连接池获取连接
-        connection = db_pool_scada.connection()
-        
-        with connection.cursor() as cursor:
-            # 执行查询
-            table_name = f"dms_device_qualityparams_{code}"
-            sql = f"SELECT * FROM `{table_name}` ORDER BY ID DESC LIMIT 1"
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            
-            elapsed = (time.time() - start_time) * 1000
-            
-            if result:
-                # 尝试映射：优先用 Code，其次用 VariableName，都失败则跳过
-                mapped = {}
-                for k, v in result.items():
-                    # 先尝试 Code 映射
-                    mapped_key = code_name_map.get(str(k))
-                    if mapped_key is None:
-                        # 再尝试 VariableName 映射
-                        mapped_key = variable_name_map.get(str(k))
-                    
-                    if mapped_key is not None:
-                        mapped[mapped_key] = v
-
-                print(f"[查询成功] code={code}, 耗时: {elapsed:.2f}ms, 原始字段数={len(result)}, 映射字段数={len(mapped)}")
-                return jsonify({
-                    'success': True,
-                    'data': mapped,
-                    'elapsed_ms': round(elapsed, 2)
-                })
+            for key in leading:
+                futures[key].set_result(results.get(key))
+        finally:
+            with inflight_lock:
+                for key in leading:
+                    inflight.pop(key, None)
+
+    return {key: future.result() for key, future in futures.items()}
+
+
+def single_flight(key, fn):
+    """单个 key 的请求合并，返回 fn() 的结果"""
+    return single_flight_many([key], lambda keys: {key: fn()})[key]
+
+
+def _store_snapshot(pool, table_name, row, insert=True):
+    """写入快照条目（保留原有的最后读取时间），返回新条目；insert=False 时只更新已存在的条目
+
+    行 ID 变化时推送给该表的订阅者。
+    """
+    key = (pool, table_name)
+    entry = _new_snapshot_entry(row, time.time())
+    old = None
+    if SNAPSHOT_ENABLED:
+        with snapshot_lock:
+            old = snapshot_store.get(key)
+            if old is not None:
+                entry['last_read'] = old['last_read']
+            elif not insert:
+                return None
+            snapshot_store[key] = entry
+
+    if old is None or (old['row'] or {}).get('ID') != (row or {}).get('ID'):
+        publish_snapshot(key, entry)
+    elif row is not None:
+        # 行 ID 未变化：沿用已算好的映射与汇总结果，轮询不再重复映射
+        entry['mapped'] = old['mapped']
+    return entry
+
+
+def publish_snapshot(key, entry):
+    """推送快照变化给订阅者；队列已满的慢客户端跳过本次推送"""
+    with stream_lock:
+        queues = list(stream_subscribers.get(key, ()))
+    for q in queues:
+        try:
+            q.put_nowait((key, entry))
+        except queue.Full:
+            pass
+
+
+def load_snapshot(pool, table_name):
+    """查库刷新单张表的快照条目，同一张表的并发刷新合并为一次查询"""
+    return single_flight(
+        (pool, table_name),
+        lambda: _store_snapshot(pool, table_name, query_latest_row(table_name, pool=pool))
+    )
+
+
+def load_snapshots(pool, table_names):
+    """批量查库刷新快照条目，返回 {table_name: 条目 | 异常}；与 load_snapshot 共享请求合并"""
+    def load(keys):
+        results = {}
+        for table_name, row in fetch_latest_rows([key[1] for key in keys], pool=pool).items():
+            if isinstance(row, Exception):
+                results[(pool, table_name)] = row
             else:
-                print(f"[无数据] code={code}, 耗时: {elapsed:.2f}ms")
-                return jsonify({
-                    'success': True,
-                    'data': None,
-                    'message': '未查询到数据',
-                    'elapsed_ms': round(elapsed, 2)
-                })
-                
+                results[(pool, table_name)] = _store_snapshot(pool, table_name, row)
+        return results
+
+    loaded = single_flight_many([(pool, table_name) for table_name in table_names], load)
+    return {key[1]: entry for key, entry in loaded.items()}
+
+
+def revalidate_async(pool, table_names):
+    """后台刷新陈旧快照（stale-while-revalidate），同一张表同时只提交一次"""
+    with inflight_lock:
+        keys = [(pool, t) for t in table_names if (pool, t) not in revalidating]
+        revalidating.update(keys)
+    if keys:
+        revalidate_executor.submit(_revalidate, pool, keys)
+
+
+def _revalidate(pool, keys):
+    try:
+        for table_name, entry in load_snapshots(pool, [key[1] for key in keys]).items():
+            if isinstance(entry, Exception):
+                reqlog.error(f"[快照刷新失败] table={table_name} - 错误: {str(entry)}", event='snapshot_refresh', pool=pool, table=table_name, error=str(entry))
     except Exception as e:
-        elapsed = (time.time() - start_time) * 1000
-        print(f"[查询异常-225] 耗时: {elapsed:.2f}ms - 错误: {str(e)}")
+        reqlog.error(f"[快照刷新异常] 错误: {str(e)}", event='snapshot_refresh', error=str(e))
+    finally:
+        with inflight_lock:
+            revalidating.difference_update(keys)
+
+
+def snapshot_lookup(pool, table_names):
+    """按快照状态划分表：返回 ({table_name: 可直接使用的条目}, 需同步查库的表, 需后台刷新的表)
+
+    快照中没有或超过 SNAPSHOT_MAX_STALE 的表需同步查库；超过 SNAPSHOT_MAX_AGE 的表先返回旧条目，同时后台刷新。
+    """
+    now = time.time()
+    entries = {}
+    missing = []
+    stale = []
+    with snapshot_lock:
+        for table_name in dict.fromkeys(table_names):
+            entry = snapshot_store.get((pool, table_name)) if SNAPSHOT_ENABLED else None
+            if entry is None or now - entry['updated_at'] > SNAPSHOT_MAX_STALE:
+                missing.append(table_name)
+                continue
+            entry['last_read'] = now
+            entries[table_name] = entry
+            if now - entry['updated_at'] > SNAPSHOT_MAX_AGE:
+                stale.append(table_name)
+    return entries, missing, stale
+
+
+def get_latest_mapped(table_name, keep_unmapped=False, pool='scada', aggregate=None):
+    """读取设备表最新一行及映射结果（aggregate 不为空时为汇总结果），返回 (原始行, 映射结果, 快照时间)
+
+    已在快照中的表直接返回内存数据；首次出现或过于陈旧的表查库（并发请求合并为一次），
+    并登记到快照由后台线程刷新；略微陈旧的快照先返回，同时后台刷新。
+    """
+    entries, missing, stale = snapshot_lookup(pool, [table_name])
+    if missing:
+        entry = load_snapshot(pool, table_name)
+    else:
+        entry = entries[table_name]
+        if stale:
+            revalidate_async(pool, stale)
+
+    return _snapshot_result(table_name, entry, keep_unmapped, aggregate)
+
+
+def get_latest_mapped_many(table_names, keep_unmapped=False, pool='scada', aggregate=None):
+    """批量版 get_latest_mapped，返回 {table_name: (原始行, 映射结果, 快照时间) | 异常}
+
+    快照中已有的表不查库，其余表通过 fetch_latest_rows 一次性查询并登记到快照，
+    陈旧规则与请求合并同 get_latest_mapped。
+    """
+    entries, missing, stale = snapshot_lookup(pool, table_names)
+    if missing:
+        entries.update(load_snapshots(pool, missing))
+    if stale:
+        revalidate_async(pool, stale)
+
+    return {
+        table_name: entry if isinstance(entry, Exception) else _snapshot_result(table_name, entry, keep_unmapped, aggregate)
+        for table_name, entry in entries.items()
+    }
+
+
+def snapshot_refresh_targets():
+    """淘汰长时间无人读取的快照（有推送订阅者的表除外），返回需要刷新的 {pool: [table_name]}"""
+    now = time.time()
+    tables_by_pool = {}
+    with snapshot_lock:
+        for key, entry in list(snapshot_store.items()):
+            if now - entry['last_read'] > SNAPSHOT_IDLE_TTL and key not in stream_subscribers:
+                del snapshot_store[key]
+            else:
+                tables_by_pool.setdefault(key[0], []).append(key[1])
+    return tables_by_pool
+
+
+def refresh_snapshots():
+    """刷新一轮快照：淘汰长时间无人读取的表，其余表按连接池分组批量查询最新行"""
+    for pool, tables in snapshot_refresh_targets().items():
+        for table_name, row in fetch_latest_rows(tables, pool=pool).items():
+            if isinstance(row, Exception):
+                # 单表失败不影响其他表，保留旧快照（updated_at 不变，可据此判断陈旧程度）
+                reqlog.error(f"[快照刷新失败] table={table_name} - 错误: {str(row)}", event='snapshot_refresh', pool=pool, table=table_name, error=str(row))
+                continue
+            _store_snapshot(pool, table_name, row, insert=False)
+
+
+def start_periodic(name, interval, fn):
+    """启动后台线程，每 interval 秒执行一次 fn（首次在 interval 秒后执行，单次异常不影响后续执行），重复启动时忽略"""
+    if name in background_threads:
+        return
+
+    def worker():
+        delay = interval
+        while not background_stop.wait(delay):
+            started = time.time()
+            try:
+                fn()
+            except Exception as e:
+                print(f"[后台任务异常] {name} - 错误: {str(e)}")
+            delay = max(0.0, interval - (time.time() - started))
+
+    thread = threading.Thread(target=worker, name=name, daemon=True)
+    background_threads[name] = thread
+    thread.start()
+
+
+def start_snapshot_worker():
+    """启动后台快照线程：每 SNAPSHOT_INTERVAL 秒刷新一次"""
+    if not SNAPSHOT_ENABLED:
+        return
+    start_periodic('snapshot-worker', SNAPSHOT_INTERVAL, refresh_snapshots)
+    print(f"快照线程已启动 [刷新间隔: {SNAPSHOT_INTERVAL}s, 闲置淘汰: {SNAPSHOT_IDLE_TTL}s]")
+
+
+def snapshot_fields(updated_at):
+    """响应中的快照时间字段：snapshot_at（Unix 时间戳）与 snapshot_age_ms（数据陈旧程度）"""
+    return {
+        'snapshot_at': round(updated_at, 3),
+        'snapshot_age_ms': round((time.time() - updated_at) * 1000, 2)
+    }
+
+# ========== 表目录 ==========
+class TableNotFound(LookupError):
+    """设备表不存在"""
+
+
+def catalog_query(pool):
+    """查询设备表目录的 (sql, 参数)"""
+    return (
+        "SELECT TABLE_NAME AS table_name FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = %s AND TABLE_NAME LIKE %s",
+        [POOL_CONFIGS[pool]['database'], 'dms_device_%']
+    )
+
+
+def probe_table_query(pool, table_name):
+    """确认单张表是否存在的 (sql, 参数)"""
+    return (
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+        [POOL_CONFIGS[pool]['database'], table_name]
+    )
+
+
+def install_table_catalog(pool, tables):
+    """替换连接池的设备表目录，并清空该连接池的不存在缓存与表结构缓存（新增字段在下次刷新后可用）"""
+    tables = frozenset(tables)
+    with catalog_lock:
+        table_catalog[pool] = tables
+        for key in [key for key in catalog_misses if key[0] == pool]:
+            del catalog_misses[key]
+    clear_table_schemas(pool)
+    print(f"[表目录] pool={pool}, 设备表数={len(tables)}")
+
+
+def load_table_catalog():
+    """从 information_schema.TABLES 加载各表族所用连接池的设备表目录"""
+    pools = {family['pool'] for family in TABLE_FAMILIES.values()}
+    for pool in pools:
+        try:
+            connection = get_pool(pool).connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(*catalog_query(pool))
+                    tables = [row['table_name'] for row in cursor.fetchall()]
+            finally:
+                connection.close()
+        except Exception as e:
+            # 加载失败时保留旧目录（首次失败则不拦截请求）
+            print(f"加载表目录失败: pool={pool} - {str(e)}")
+            continue
+        install_table_catalog(pool, tables)
+
+
+def _probe_table(pool, table_name):
+    """查库确认单张表是否存在"""
+    connection = get_pool(pool).connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(*probe_table_query(pool, table_name))
+            return cursor.fetchone() is not None
+    finally:
+        connection.close()
+
+
+def catalog_lookup(pool, table_name):
+    """仅按内存判断表是否存在：True / False，需要查库确认时返回 None（目录未加载时视为存在）"""
+    with catalog_lock:
+        catalog = table_catalog.get(pool)
+        if catalog is None or table_name in catalog:
+            return True
+        expires = catalog_misses.get((pool, table_name))
+        if expires is not None and expires > time.time():
+            return False
+    return None
+
+
+def record_table_probe(pool, table_name, exists):
+    """记录查库确认结果：存在则加入目录，不存在则在 CATALOG_MISS_TTL 内缓存"""
+    key = (pool, table_name)
+    with catalog_lock:
+        if exists:
+            table_catalog[pool] = table_catalog.get(pool, frozenset()) | {table_name}
+            catalog_misses.pop(key, None)
+        else:
+            catalog_misses[key] = time.time() + CATALOG_MISS_TTL
+            catalog_misses.move_to_end(key)
+            while len(catalog_misses) > CATALOG_MISS_MAX:
+                catalog_misses.popitem(last=False)
+
+
+def table_exists(pool, table_name):
+    """按表目录判断表是否存在（目录未加载时不拦截）
+
+    目录中没有的表查一次库确认（并发合并），确认不存在的表在 CATALOG_MISS_TTL 内直接判定不存在。
+    """
+    exists = catalog_lookup(pool, table_name)
+    if exists is None:
+        exists = single_flight(('catalog', pool, table_name), lambda: _probe_table(pool, table_name))
+        record_table_probe(pool, table_name, exists)
+    return exists
+
+
+def table_name_for(family, code):
+    """校验 code 格式并返回完整表名，格式非法抛出 ValueError"""
+    code = str(code)
+    if not CODE_PATTERN.match(code):
+        raise ValueError(f"code 格式非法: {code}")
+    return f"{family['table_prefix']}{code}"
+
+
+def resolve_table(family, code):
+    """校验 code 并返回完整表名：code 格式非法抛出 ValueError，表不存在抛出 TableNotFound"""
+    table_name = table_name_for(family, code)
+    if not table_exists(family['pool'], table_name):
+        raise TableNotFound(f"表不存在: {table_name}")
+    return table_name
+
+
+def start_catalog_worker():
+    """启动表目录刷新线程：每 CATALOG_REFRESH_INTERVAL 秒重新加载一次"""
+    start_periodic('catalog-worker', CATALOG_REFRESH_INTERVAL, load_table_catalog)
+
+
+def open_ssh_tunnel(endpoints=None):
+    """建立 SSH 隧道：一条 SSH 连接转发 endpoints（默认 DB_ENDPOINTS 中的所有数据库，含副本），返回已启动的 TunnelSupervisor"""
+    supervisor = TunnelSupervisor(SSH_CONFIG, {
+        name: (DB_ENDPOINTS[name]['host'], DB_ENDPOINTS[name]['port'])
+        for name in (DB_ENDPOINTS if endpoints is None else endpoints)
+    })
+    supervisor.start()
+    return supervisor
+
+
+def db_address(name):
+    """数据库端点 name 的连接地址：经 SSH 隧道时为本机转发端口，否则直连 DB_ENDPOINTS 中的地址"""
+    if SSH_ENABLED:
+        return '127.0.0.1', ssh_tunnel.port(name)
+    return DB_ENDPOINTS[name]['host'], DB_ENDPOINTS[name]['port']
+
+
+class WaitWindow:
+    """最近 N 次取连接等待时间（秒），用于计算分位数"""
+
+    def __init__(self, size=POOL_WAIT_WINDOW):
+        self.samples = deque(maxlen=size)
+        self.total = 0  # 累计样本数
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.total += 1
+
+    def percentiles(self, last=None):
+        """返回最近 last 个样本（默认整个窗口）的 {'p50', 'p95', 'p99', 'max'}（毫秒），无样本时为 None"""
+        with self.lock:
+            samples = list(self.samples)
+        if last is not None:
+            samples = samples[len(samples) - min(last, len(samples)):]
+        samples.sort()
+        if not samples:
+            return None
+        last = len(samples) - 1
+        result = {f'p{p}': round(samples[min(last, int(round(p / 100 * last)))] * 1000, 3) for p in (50, 95, 99)}
+        result['max'] = round(samples[-1] * 1000, 3)
+        return result
+
+
+class MeteredPooledDB(PooledDB):
+    """带运行统计的连接池：记录使用中/空闲/等待中的连接数、新建与关闭次数、取连接等待时间，
+    连接上的游标记录执行耗时与返回行数（见 metrics.py）；resize() 供自动调整空闲连接上限"""
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.generation = 0   # SSH 隧道重建后递增，之前建立的连接归还时直接关闭
+        self.waiting = 0      # 因连接数达到上限而阻塞的线程数
+        self.created = 0      # 累计新建连接数
+        self.closed = 0       # 累计关闭连接数（空闲已满或调小空闲上限）
+        self.checkouts = 0    # 累计取连接次数
+        self.failures = 0     # 连续取连接失败次数（非连接层错误），见 REPLICA_FAILURE_THRESHOLD
+        self.peak_in_use = 0  # 本轮调整周期内同时使用中的最大连接数
+        self.waits = WaitWindow()
+        kwargs['cursorclass'] = metrics.metered_cursor(kwargs.get('cursorclass', pymysql.cursors.Cursor), name)
+        super().__init__(*args, **kwargs)
+
+    def steady_connection(self):
+        connection = super().steady_connection()
+        connection.pool_generation = self.generation
+        self.created += 1
+        return connection
+
+    def connection(self, shareable=True):
+        started = time.perf_counter()
+        try:
+            connection = super().connection(shareable)
+        except pymysql.err.OperationalError as e:
+            # 连接层错误立即判定端点故障，不等下一次健康检查；其他错误（如 1040 连接数已满）可能是暂时的，连续多次才判定
+            self.failures += 1
+            if e.args and e.args[0] in CONNECT_ERRORS or self.failures >= REPLICA_FAILURE_THRESHOLD:
+                endpoint_failed(self.name, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.POOL_WAIT.observe(elapsed, pool=self.name)
+            metrics.add_phase('pool_wait', elapsed)
+            self.waits.add(elapsed)
+        self.failures = 0
+        with self._lock:
+            self.checkouts += 1
+            self.peak_in_use = max(self.peak_in_use, self._connections)
+        return connection
+
+    def _wait_lock(self):
+        self.waiting += 1
+        try:
+            super()._wait_lock()
+        finally:
+            self.waiting -= 1
+
+    def cache(self, con):
+        with self._lock:
+            if getattr(con, 'pool_generation', self.generation) != self.generation:
+                # 隧道重建前建立的连接：不放回空闲队列
+                self._close_connections([con])
+                self._connections -= 1
+                self._lock.notify()
+                return
+            if self._maxcached and len(self._idle_cache) >= self._maxcached:
+                self.closed += 1
+            super().cache(con)
+
+    def _close_connections(self, connections):
+        self.closed += len(connections)
+        for con in connections:
+            try:
+                con.close()
+            except Exception:
+                pass
+
+    def resize(self, maxcached):
+        """调整空闲连接上限；调小时立即关闭多余的空闲连接"""
+        with self._lock:
+            self._maxcached = maxcached
+            excess = self._idle_cache[maxcached:]
+            del self._idle_cache[maxcached:]
+            self._close_connections(excess)
+
+    def invalidate(self):
+        """SSH 隧道重建后调用：关闭全部空闲连接，使用中的连接归还时关闭，之后按需新建"""
+        with self._lock:
+            self.generation += 1
+            idle = self._idle_cache[:]
+            del self._idle_cache[:]
+            self._close_connections(idle)
+
+    def stats(self):
+        """连接池当前状态"""
+        with self._lock:
+            stats = {
+                'in_use': self._connections,
+                'idle': len(self._idle_cache),
+                'waiting': self.waiting,
+                'maxcached': self._maxcached,
+                'maxconnections': self._maxconnections,
+                'created': self.created,
+                'closed': self.closed,
+                'checkouts': self.checkouts,
+                'generation': self.generation
+            }
+        stats['wait_ms'] = self.waits.percentiles()
+        return stats
+
+
+def tune_pool(pool, sizes, last):
+    """根据上一周期的统计调整一个连接池的空闲上限，返回本周期统计供下次比较
+
+    等待时间 P95 超过 POOL_TUNE_WAIT_MS，或同一周期内既新建又因空闲已满关闭连接（连接反复开关），
+    说明空闲上限偏小，增大 POOL_TUNE_STEP；周期内无等待、无开关且空闲连接多于峰值使用数，则减小
+    """
+    stats = pool.stats()
+    stats['wait_total'] = pool.waits.total
+    with pool._lock:
+        peak = pool.peak_in_use
+        pool.peak_in_use = pool._connections
+    if last is None:
+        return stats
+
+    created = stats['created'] - last['created']
+    closed = stats['closed'] - last['closed']
+    # 只看本周期内的等待时间
+    recent = pool.waits.percentiles(stats['wait_total'] - last['wait_total']) if stats['wait_total'] > last['wait_total'] else None
+    wait_p95 = (recent or {}).get('p95', 0)
+    maxcached = stats['maxcached']
+    lower, upper = sizes['mincached'], sizes['maxconnections']
+
+    if (wait_p95 > POOL_TUNE_WAIT_MS or (created and closed)) and maxcached < upper:
+        target = min(upper, maxcached + POOL_TUNE_STEP)
+    elif not created and not closed and stats['idle'] > peak + POOL_TUNE_STEP and maxcached > lower:
+        target = max(lower, peak + POOL_TUNE_STEP, maxcached - POOL_TUNE_STEP)
+    else:
+        return stats
+
+    if target != maxcached:
+        pool.resize(target)
+        print(f"[连接池调整] pool={pool.name}, maxcached: {maxcached} → {target}, "
+              f"等待P95: {wait_p95:.2f}ms, 新建: {created}, 关闭: {closed}, 峰值使用: {peak}")
+        stats = pool.stats()
+        stats['wait_total'] = pool.waits.total
+    return stats
+
+
+def start_pool_tuner():
+    """启动连接池调整线程：每 POOL_TUNE_INTERVAL 秒检查一次"""
+    if not POOL_TUNE_ENABLED:
+        return
+    last = {}
+
+    def tune():
+        for name, pool in (('scada', db_pool_scada), ('mes', db_pool_mes)):
+            if pool:
+                last[name] = tune_pool(pool, POOL_SIZES[name], last.get(name))
+
+    start_periodic('pool-tuner', POOL_TUNE_INTERVAL, tune)
+
+
+def open_endpoint_pool(endpoint, sizes):
+    """创建数据库端点的连接池（账号与库名取所属逻辑库的配置）"""
+    db_config = POOL_CONFIGS[DB_ENDPOINTS[endpoint]['pool']]
+    host, port = db_address(endpoint)
+    return MeteredPooledDB(
+        endpoint,
+        creator=pymysql,
+        **sizes,
+        maxshared=0,
+        blocking=True,
+        maxusage=0,
+        setsession=[],
+        ping=1,
+        host=host,
+        port=port,
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def init_connection_pool():
+    """初始化 SSH 隧道和数据库连接池（两个数据库及其只读副本）"""
+    global ssh_tunnel, db_pool_scada, db_pool_mes
+    
+    print("=" * 60)
+    
+    if SSH_ENABLED and ssh_tunnel is not None:
+        # 多进程模式：隧道由主进程建立
+        print(f"使用主进程的 SSH 隧道，本地端口: SCADA {ssh_tunnel.port('scada')}, MES {ssh_tunnel.port('mes')}")
+    elif SSH_ENABLED:
+        print(f"正在建立 SSH 隧道 → {SSH_CONFIG['host']}（转发 {DB_CONFIG_SCADA['host']}、{DB_CONFIG_SCADA_MES['host']}）...")
+        ssh_tunnel = open_ssh_tunnel()
+        ssh_tunnel.on_restart(invalidate_pools)
+        print(f"SSH 隧道已建立，本地端口: SCADA {ssh_tunnel.port('scada')}, MES {ssh_tunnel.port('mes')}")
+    else:
+        print(f"不使用 SSH 隧道，直连数据库 (DB_TARGET={DB_TARGET}): SCADA {DB_CONFIG_SCADA['host']}:{DB_CONFIG_SCADA['port']}, "
+              f"MES {DB_CONFIG_SCADA_MES['host']}:{DB_CONFIG_SCADA_MES['port']}")
+    
+    # ========== SCADA系统 ==========
+    print("-" * 60)
+    print("正在创建数据库连接池 (SCADA)...")
+    db_pool_scada = open_endpoint_pool('scada', POOL_SIZES['scada'])
+    print(f"连接池已创建 (SCADA) [初始连接: {POOL_SIZES['scada']['mincached']}, 最大连接: {POOL_SIZES['scada']['maxconnections']}]")
+    
+    # ========== MES系统 ==========
+    print("-" * 60)
+    print("正在创建数据库连接池 (MES)...")
+    db_pool_mes = open_endpoint_pool('mes', POOL_SIZES['mes'])
+    print(f"连接池已创建 (MES) [初始连接: {POOL_SIZES['mes']['mincached']}, 最大连接: {POOL_SIZES['mes']['maxconnections']}]")
+
+    # ========== 只读副本 ==========
+    for endpoint, info in DB_ENDPOINTS.items():
+        if info['role'] == 'replica':
+            # 副本不预先建立连接：副本不可用时不影响启动，健康检查通过后才会被选用
+            replica_pools[endpoint] = open_endpoint_pool(endpoint, {**POOL_SIZES[info['pool']], 'mincached': 0})
+            print(f"连接池已创建 (副本 {endpoint} → {info['host']}:{info['port']}) [最大连接: {POOL_SIZES[info['pool']]['maxconnections']}]")
+    print("=" * 60)
+
+
+def invalidate_pools(generation):
+    """SSH 隧道重建后丢弃旧连接（隧道断开前建立的连接已不可用）"""
+    for _, pool in endpoint_pools():
+        pool.invalidate()
+    close_monitor_connections()
+    print(f"[SSH 隧道] 第 {generation} 次重建，已丢弃旧的数据库连接")
+
+
+cleanup_lock = threading.Lock()
+cleaned_up = False
+
+
+def cleanup():
+    """关闭连接池和 SSH 隧道（只执行一次：退出时既有显式调用，也有 atexit）"""
+    global cleaned_up
+    with cleanup_lock:
+        if cleaned_up:
+            return
+        cleaned_up = True
+    print("\n正在关闭连接池和 SSH 隧道...")
+
+    # 先停止后台线程与后台刷新，避免关闭连接池后继续查库
+    background_stop.set()
+    revalidate_executor.shutdown(wait=False)
+    
+    # 关闭连接池，最后关闭 SSH 隧道
+    for _, pool in endpoint_pools():
+        pool.close()
+    close_monitor_connections()
+    if ssh_tunnel:
+        ssh_tunnel.stop()
+    
+    print("资源已释放")
+
+# 注册退出时的清理函数
+atexit.register(cleanup)
+
+
+# ========== 只读副本与故障切换 ==========
+# 健康检查线程每 REPLICA_CHECK_INTERVAL 秒用专用连接检查每个端点：SELECT 1 的往返延迟（指数加权平均），
+# 副本同时读取复制延迟；检查失败或连接池新建连接失败的端点判定为故障，恢复后重新启用
+endpoint_health = {}      # 端点名称 → {'up', 'latency_ms', 'lag_s', 'lag_ok', 'checked_at', 'error'}，每次整体替换
+monitor_connections = {}  # 端点名称 → 健康检查专用连接（不占用连接池）
+
+
+def endpoint_state(endpoint):
+    """端点的最近一次检查结果；尚未检查时 up 为 None（主库视为可用，副本不选用）"""
+    return endpoint_health.get(endpoint) or {'up': None, 'latency_ms': None, 'lag_s': None, 'lag_ok': False, 'checked_at': None, 'error': None}
+
+
+def choose_endpoint(pool, replica=False):
+    """选择逻辑库 pool 的端点
+
+    replica=True（只读查询）：在线且复制延迟达标的副本中往返延迟最低的，没有则为主库；
+    主库被判定为故障时改用在线的副本（复制延迟达标的优先），没有在线副本时仍为主库。
+    """
+    replicas = [endpoint for endpoint in REPLICAS_BY_POOL[pool] if endpoint_state(endpoint)['up']]
+    fresh = [endpoint for endpoint in replicas if endpoint_state(endpoint)['lag_ok']]
+    latency = lambda endpoint: endpoint_state(endpoint)['latency_ms']
+    if replica and fresh:
+        return min(fresh, key=latency)
+    if endpoint_state(pool)['up'] is False and replicas:
+        return min(fresh or replicas, key=latency)
+    return pool
+
+
+def monitor_connection(endpoint):
+    """健康检查专用连接，断开后重新建立；连接与读写都有超时"""
+    connection = monitor_connections.get(endpoint)
+    if connection is None:
+        db_config = POOL_CONFIGS[DB_ENDPOINTS[endpoint]['pool']]
+        host, port = db_address(endpoint)
+        connection = pymysql.connect(
+            host=host,
+            port=port,
+            user=db_config['user'],
+            password=db_config['password'],
+            database=db_config['database'],
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            connect_timeout=REPLICA_CHECK_TIMEOUT,
+            read_timeout=REPLICA_CHECK_TIMEOUT,
+            write_timeout=REPLICA_CHECK_TIMEOUT
+        )
+        monitor_connections[endpoint] = connection
+    return connection
+
+
+def close_monitor_connections():
+    for endpoint in list(monitor_connections):
+        connection = monitor_connections.pop(endpoint, None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def replication_lag(cursor):
+    """副本的复制延迟（秒）；复制已停止、无权限或不是副本时为 None"""
+    if REPLICA_LAG_SQL:
+        cursor.execute(REPLICA_LAG_SQL)
+        row = cursor.fetchone()
+        lag = next(iter(row.values()), None) if row else None
+        return None if lag is None else float(lag)
+    # MySQL 8.0.22+ 为 SHOW REPLICA STATUS / Seconds_Behind_Source，更早的版本与 MariaDB 为 SHOW SLAVE STATUS / Seconds_Behind_Master
+    for sql in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+        try:
+            cursor.execute(sql)
+        except pymysql.err.MySQLError:
+            continue
+        row = cursor.fetchone() or {}
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return None if lag is None else float(lag)
+    return None
+
+
+def check_endpoint(endpoint):
+    """检查一个端点，返回新的状态：测量 SELECT 1 的往返延迟，副本同时读取复制延迟"""
+    old = endpoint_state(endpoint)
+    replica = DB_ENDPOINTS[endpoint]['role'] == 'replica'
+    try:
+        connection = monitor_connection(endpoint)
+        with connection.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            latency = (time.perf_counter() - started) * 1000
+            try:
+                lag = replication_lag(cursor) if replica else None
+            except pymysql.err.MySQLError:
+                lag = None  # 延迟查询失败不影响在线判定，但该副本不再被选用
+    except Exception as e:
+        monitor_connections.pop(endpoint, None)
+        return {**old, 'up': False, 'checked_at': time.time(), 'error': str(e)}
+
+    if old['up'] and old['latency_ms'] is not None:
+        latency = old['latency_ms'] + REPLICA_LATENCY_WEIGHT * (latency - old['latency_ms'])
+    return {
+        'up': True,
+        'latency_ms': round(latency, 3),
+        'lag_s': lag,
+        'lag_ok': not replica or (lag is not None and lag <= REPLICA_MAX_LAG),
+        'checked_at': time.time(),
+        'error': None
+    }
+
+
+def set_endpoint_state(endpoint, state):
+    """更新端点状态；故障、恢复与复制延迟达标状态变化时记录日志"""
+    old = endpoint_state(endpoint)
+    endpoint_health[endpoint] = state
+    info = DB_ENDPOINTS[endpoint]
+    replica = info['role'] == 'replica'
+    if state['up'] is False and old['up'] is not False:
+        target = choose_endpoint(info['pool'], replica=replica)
+        reqlog.warning(f"[数据库故障] endpoint={endpoint} ({info['host']}:{info['port']}) - 错误: {state['error']}，{info['pool']} 的{'只读' if replica else ''}查询改用 {target}",
+                       event='db_endpoint', endpoint=endpoint, pool=info['pool'], up=False, target=target, error=state['error'])
+    elif state['up'] and old['up'] is False:
+        reqlog.warning(f"[数据库恢复] endpoint={endpoint} ({info['host']}:{info['port']})，往返延迟: {state['latency_ms']}ms",
+                       event='db_endpoint', endpoint=endpoint, pool=info['pool'], up=True, latency_ms=state['latency_ms'])
+    elif replica and state['up'] and old['up'] and state['lag_ok'] != old['lag_ok']:
+        lag = '未知' if state['lag_s'] is None else f"{state['lag_s']}s"
+        reqlog.warning(f"[复制延迟] endpoint={endpoint}，延迟: {lag}，{'恢复选用' if state['lag_ok'] else f'超过 {REPLICA_MAX_LAG}s 或无法确定，暂停选用'}",
+                       event='replica_lag', endpoint=endpoint, pool=info['pool'], lag_s=state['lag_s'], fresh=state['lag_ok'])
+
+
+def endpoint_failed(endpoint, error):
+    """连接池取连接失败（连接层错误或连续 REPLICA_FAILURE_THRESHOLD 次失败）：立即判定端点故障（健康检查未运行时忽略）"""
+    if 'endpoint-monitor' in background_threads and endpoint in DB_ENDPOINTS:
+        set_endpoint_state(endpoint, {**endpoint_state(endpoint), 'up': False, 'checked_at': time.time(), 'error': str(error)})
+
+
+def check_endpoints():
+    for endpoint in DB_ENDPOINTS:
+        set_endpoint_state(endpoint, check_endpoint(endpoint))
+
+
+def start_endpoint_monitor():
+    """启动健康检查线程：启动时先同步检查一次，之后每 REPLICA_CHECK_INTERVAL 秒检查一次（未配置副本时不启动）"""
+    if not any(REPLICAS_BY_POOL.values()):
+        return
+    check_endpoints()
+    start_periodic('endpoint-monitor', REPLICA_CHECK_INTERVAL, check_endpoints)
+    print(f"数据库健康检查线程已启动 [检查间隔: {REPLICA_CHECK_INTERVAL}s, 副本: {', '.join(e for e in DB_ENDPOINTS if e not in POOL_CONFIGS)}]")
+
+
+def endpoint_status():
+    """各端点的角色、地址与最近一次检查结果，以及只读查询当前选用的端点"""
+    return {
+        'read_from': {name: choose_endpoint(name, replica=True) for name in POOL_CONFIGS},
+        'endpoints': {
+            endpoint: {
+                'pool': info['pool'],
+                'role': info['role'],
+                'address': f"{info['host']}:{info['port']}",
+                **endpoint_state(endpoint)
+            }
+            for endpoint, info in DB_ENDPOINTS.items()
+        }
+    }
+
+
+# ========== 请求频率限制 ==========
+# 文档约定的请求频率在服务端按 (客户端, 接口, code) 令牌桶执行；超限的请求不报错，而是返回该 (接口, code)
+# 最近一次的成功响应（响应头 X-Rate-Limited: 1，Age 为缓存时长），查库次数只与接口数 × code 数有关，与看板数量无关
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '2'))           # 每个客户端每个 (接口, code) 允许的突发请求数，也是缓存响应的最长时效（轮询间隔数）
+RATE_LIMIT_CLIENT_HEADER = os.getenv('RATE_LIMIT_CLIENT_HEADER')        # 识别客户端的请求头（如经反向代理时设为 X-Forwarded-For），未设置时按来源 IP
+RATE_LIMIT_CACHE_SIZE = int(os.getenv('RATE_LIMIT_CACHE_SIZE', '4096'))  # 缓存的 (接口, code) 响应数上限
+RATE_LIMIT_CACHE_BYTES = int(os.getenv('RATE_LIMIT_CACHE_BYTES', str(64 * 1024 * 1024)))  # 缓存响应体的总字节数上限，单个响应体超过该值时不缓存
+RATE_LIMIT_PRUNE_INTERVAL = 60                                          # 清理闲置令牌桶的间隔（秒）
+
+POLL_RATES = {}  # 接口地址 → 每个客户端的请求频率（次/秒），由 register_family 与 MES 接口登记（约定值见 poll_rates.py）
+
+
+def rate_limit_client(remote_addr, headers):
+    """客户端标识：RATE_LIMIT_CLIENT_HEADER 的第一个值，未设置或请求中没有时为来源 IP"""
+    if RATE_LIMIT_CLIENT_HEADER:
+        value = headers.get(RATE_LIMIT_CLIENT_HEADER)
+        if value:
+            return value.split(',')[0].strip()
+    return remote_addr
+
+
+class PollLimiter:
+    """按 (客户端, 接口, code) 的令牌桶与按 (接口, code) 的最近成功响应（Flask 与异步服务模式共用）
+
+    批量接口的 code 为排序后逗号连接的 code 列表（见 batch_poll_key），即同一组 code 一个令牌桶，与顺序无关。
+    缓存响应同时受条数（RATE_LIMIT_CACHE_SIZE）与总字节数（RATE_LIMIT_CACHE_BYTES）限制，超出时淘汰最久未使用的。
+    多进程模式下令牌桶与缓存响应都在各工作进程内，同一客户端实际允许的频率最多为 PREFORK_WORKERS × 约定频率。
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, cache_size=RATE_LIMIT_CACHE_SIZE, cache_bytes=RATE_LIMIT_CACHE_BYTES):
+        self.burst = burst
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.buckets = {}              # (客户端, 接口, code) → reqlog.TokenBucket
+        self.responses = OrderedDict()  # (接口, code) → (响应体, ETag, Cache-Control, 缓存时间)
+        self.stored_bytes = 0           # responses 中响应体的总字节数
+        self.lock = threading.Lock()
+        self.pruned_at = time.monotonic()
+
+    def allow(self, client, route, code):
+        """该客户端本次对该 code 的请求是否在频率之内"""
+        now = time.monotonic()
+        key = (client, route, code)
+        with self.lock:
+            if now - self.pruned_at > RATE_LIMIT_PRUNE_INTERVAL:
+                self._prune(now)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = reqlog.TokenBucket(POLL_RATES[route], max(self.burst, 1))
+        return bucket.take()
+
+    def _prune(self, now):
+        """删除已经攒满的令牌桶（与新建的桶等价）与已过期的缓存响应，客户端与 code 组合数量不会无限增长"""
+        for key, bucket in list(self.buckets.items()):
+            if (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self.buckets[key]
+        wall = time.time()
+        for key, entry in list(self.responses.items()):
+            if wall - entry[3] > self._max_age(key[0]):
+                self._drop(key)
+        self.pruned_at = now
+
+    def _max_age(self, route):
+        """缓存响应的最长时效：RATE_LIMIT_BURST 个轮询间隔"""
+        return max(self.burst, 1) / POLL_RATES[route]
+
+    def _drop(self, key):
+        body = self.responses.pop(key)[0]
+        self.stored_bytes -= len(body)
+
+    def cached(self, route, code):
+        """最近一次的成功响应；缓存超过 RATE_LIMIT_BURST 个轮询间隔的视为过期，删除并返回 None（照常查询）"""
+        with self.lock:
+            entry = self.responses.get((route, code))
+            if entry is None:
+                return None
+            if time.time() - entry[3] > self._max_age(route):
+                self._drop((route, code))
+                return None
+            self.responses.move_to_end((route, code))
+            return entry
+
+    def store(self, route, code, body, etag, cache_control):
+        """记录成功响应；响应体超过 RATE_LIMIT_CACHE_BYTES 时不缓存（同时删除该 (接口, code) 的旧响应）"""
+        key = (route, code)
+        with self.lock:
+            if key in self.responses:
+                self._drop(key)
+            if len(body) > self.cache_bytes:
+                return
+            self.responses[key] = (body, etag, cache_control, time.time())
+            self.stored_bytes += len(body)
+            while len(self.responses) > self.cache_size or self.stored_bytes > self.cache_bytes:
+                self._drop(next(iter(self.responses)))
+
+
+poll_limiter = PollLimiter()
+
+
+def batch_poll_key(codes):
+    """批量接口的令牌桶与缓存键：codes 已去重（normalize_codes），排序后逗号连接，调换 code 顺序不会另占令牌桶与缓存
+    （批量响应的 data 按 code 为键，ETag 也按 code 排序计算，同一组 code 的响应相同）"""
+    return ','.join(sorted(codes))
+
+
+def rate_limited_headers(entry):
+    """缓存响应的响应头"""
+    _, etag, cache_control, stored_at = entry
+    headers = {'X-Rate-Limited': '1', 'Age': str(int(time.time() - stored_at))}
+    if etag:
+        headers['ETag'] = f'W/"{etag}"'
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    return headers
+
+
+# ========== 表族 ==========
+# 表族：一类 dms_device_*_{code} 设备表的声明（表前缀、连接池、映射策略、汇总函数）
+# 注册一次即获得单设备接口、批量接口（{route}/batch）与快照缓存，所有表族共用同一套执行流程
+TABLE_FAMILIES = {}  # name → family
+
+
+def register_family(name, route, table_prefix, pool='scada', keep_unmapped=False, aggregate=None, max_age=None, tag=''):
+    """注册表族并挂载其接口
+
+    name: 表族名称（唯一）
+    route: 单设备接口地址，批量接口为 f"{route}/batch"
+    table_prefix: 表名前缀，完整表名为 f"{table_prefix}{code}"
+    pool: 连接池名称，见 POOL_CONFIGS
+    keep_unmapped: 映射失败的字段是否保留原key
+    aggregate: 可选的汇总函数 aggregate(table_name, row, keep_unmapped)，由原始行直接生成返回数据，结果随快照按行 ID 缓存
+    max_age: 响应的 Cache-Control max-age（秒），默认取 poll_rates.py 中该接口的约定频率（未登记时为 1 秒）
+    tag: 日志标签后缀
+    """
+    if max_age is None:
+        rate = poll_rates.poll_rate(route)
+        max_age = round(1 / rate) if rate else 1
+    family = {
+        'name': name,
+        'route': route,
+        'table_prefix': table_prefix,
+        'pool': pool,
+        'keep_unmapped': keep_unmapped,
+        'aggregate': aggregate,
+        'max_age': max_age,
+        'tag': tag
+    }
+    TABLE_FAMILIES[name] = family
+    POLL_RATES[route] = POLL_RATES[f"{route}/batch"] = 1 / max_age
+    app.add_url_rule(route, endpoint=name, view_func=lambda: serve_latest(family), methods=['GET', 'POST'])
+    app.add_url_rule(f"{route}/batch", endpoint=f"{name}_batch", view_func=lambda: batch_latest(family), methods=['GET', 'POST'])
+    return family
+
+
+def dump_json(payload):
+    """序列化响应体为 bytes，与 jsonify 输出一致（供非 Flask 的服务模式使用）"""
+    if isinstance(app.json, OrjsonProvider):
+        return app.json.dumps_bytes(payload)
+    return f"{app.json.dumps(payload, separators=(',', ':'))}\n".encode('utf-8')
+
+
+def make_etag(*parts, mapping=None):
+    """由表族、表名、行 ID 与映射内容摘要生成 ETag（数据未变化时保持不变，各进程一致）
+
+    mapping 为生成数据时的映射摘要（共享快照中的数据可能由其他进程映射），默认为本进程当前的 mapping_digest。
+    """
+    raw = '|'.join(str(p) for p in (*parts, mapping_digest if mapping is None else mapping))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def cache_headers(response, etag, max_age):
+    """设置弱 ETag 与 Cache-Control（响应体含 elapsed_ms 等时间字段，因此使用弱校验）"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.max_age = max_age
+    return response
+
+
+def not_modified(etag, max_age):
+    """客户端缓存仍有效：返回空的 304 响应"""
+    return cache_headers(app.response_class(status=304), etag, max_age)
+
+
+def latest_etag(family, table_name, result):
+    """单设备响应的 ETag"""
+    return make_etag(family['name'], table_name, result.get('ID') if result else None)
+
+
+def latest_data(result, mapped):
+    """单设备响应体中与快照时间无关的部分"""
+    if result:
+        return {
+            'success': True,
+            'data': mapped
+        }
+    return {
+        'success': True,
+        'data': None,
+        'message': '未查询到数据'
+    }
+
+
+def latest_body(family, result, mapped, updated_at):
+    """单设备响应体（不含 elapsed_ms）：mapped 为映射结果或表族汇总函数的结果"""
+    return {
+        **latest_data(result, mapped),
+        **snapshot_fields(updated_at)
+    }
+
+
+def serve_latest(family):
+    """单设备接口：返回某个 code 的最新一行（映射并汇总后）"""
+    start_time = time.time()
+    tag = family['tag']
+    
+    try:
+        # 获取 code 参数
+        if request.method == 'POST':
+            code = request.json.get('code')
+        else:
+            code = request.args.get('code')
+        
+        if not code:
+            elapsed = (time.time() - start_time) * 1000
+            reqlog.warning(f"[请求失败{tag}] 耗时: {elapsed:.2f}ms - 缺少 code 参数", event='latest', route=family['route'], status=400, elapsed_ms=round(elapsed, 2), error='缺少 code 参数')
+            return jsonify({
+                'success': False,
+                'error': '缺少 code 参数'
+            }), 400
+        
+        # 按表目录校验 code，不存在的表不查库
+        try:
+            table_name = resolve_table(family, code)
+        except (ValueError, TableNotFound) as e:
+            elapsed = (time.time() - start_time) * 1000
+            reqlog.warning(f"[请求失败{tag}] code={code}, 耗时: {elapsed:.2f}ms - {str(e)}", event='latest', route=family['route'], code=code, status=404 if isinstance(e, TableNotFound) else 400, elapsed_ms=round(elapsed, 2), error=str(e))
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'elapsed_ms': round(elapsed, 2)
+            }), 404 if isinstance(e, TableNotFound) else 400
+        
+        # 读取最新行：多进程模式优先读取共享快照（已序列化），否则读取进程内快照（首次出现的 code 直接查库）
+        shared = shared_latest_many(family, {code: table_name}).get(code) if shared_snapshots else None
+        if isinstance(shared, Exception):
+            raise shared
+        if shared is not None:
+            etag = make_etag(family['name'], table_name, shared.row_id, mapping=shared.mapping)
+            raw_fields, mapped_fields = shared.raw_fields, shared.mapped_fields
+        else:
+            result, mapped, updated_at = get_latest_mapped(table_name, family['keep_unmapped'], family['pool'], family['aggregate'])
+            etag = latest_etag(family, table_name, result)
+            raw_fields, mapped_fields = len(result or ()), len(mapped or ())
+        
+        # 客户端已有相同 ID 的数据：不再序列化响应体
+        if request.if_none_match.contains_weak(etag):
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = log_phases()
+            reqlog.info(f"[未变化{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}", event='latest', route=family['route'], code=code, status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+            return not_modified(etag, family['max_age'])
+        
+        elapsed = (time.time() - start_time) * 1000
+        
+        # 响应体含 elapsed_ms，序列化耗时只计入日志
+        serialize_started = time.perf_counter()
+        if shared is not None:
+            response = app.response_class(shared_body(shared, elapsed_ms=round(elapsed, 2)) + b'\n', mimetype='application/json')
+        else:
+            response = jsonify({
+                **latest_body(family, result, mapped, updated_at),
+                'elapsed_ms': round(elapsed, 2)
+            })
+        metrics.add_phase('serialize', time.perf_counter() - serialize_started)
+        phases, phase_fields = log_phases()
+        if raw_fields:
+            reqlog.info(f"[查询成功{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}, 原始字段数={raw_fields}, 映射字段数={mapped_fields}", event='latest', route=family['route'], code=code, status=200, elapsed_ms=round(elapsed, 2), raw_fields=raw_fields, mapped_fields=mapped_fields, **phase_fields)
+        else:
+            reqlog.info(f"[无数据{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}", event='latest', route=family['route'], code=code, status=200, elapsed_ms=round(elapsed, 2), raw_fields=0, **phase_fields)
+        return cache_headers(response, etag, family['max_age'])
+                
+    except Exception as e:
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = log_phases()
+        reqlog.error(f"[查询异常{tag}] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='latest', route=family['route'], status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'elapsed_ms': round(elapsed, 2)
+        }), 500
+
+
+BATCH_MAX_CODES = int(os.getenv('BATCH_MAX_CODES', '200'))  # 单次批量请求最多 code 数
+
+
+def normalize_codes(values):
+    """整理 code 列表：逗号分隔的字符串拆开，去空白、去重并保持顺序"""
+    codes = []
+    for value in values:
+        codes.extend(value.split(',') if isinstance(value, str) else [value])
+    return list(dict.fromkeys(str(c).strip() for c in codes if str(c).strip()))
+
+
+def get_batch_codes():
+    """获取批量请求的 code 列表：POST {"codes": [...]}，GET ?codes=a,b 或 ?code=a&code=b"""
+    if request.method == 'POST':
+        codes = (request.json or {}).get('codes') or []
+        return normalize_codes([codes] if isinstance(codes, str) else codes)
+    return normalize_codes(request.args.getlist('code') + request.args.getlist('codes'))
+
+
+def batch_etag(family, codes, items):
+    """批量 ETag 由每个 code 的行 ID（或错误）与映射摘要组合而成，任一 code 变化即失效；按 code 排序，与请求顺序无关"""
+    etag_parts = []
+    for code in sorted(codes):
+        item = items[code]
+        if isinstance(item, SharedLatest):
+            row_id, mapping = item.row_id, item.mapping
+        else:
+            row_id, mapping = 'error' if isinstance(item, Exception) else (item[0] or {}).get('ID'), mapping_digest
+        etag_parts.append(f"{code}={row_id}@{mapping}")
+    return make_etag(family['name'], *etag_parts, mapping='')
+
+
+def batch_body(family, codes, items):
+    """批量响应的 data 部分，返回 (data, 失败数)；items 为 code → (原始行, 映射结果, 快照时间) | 异常"""
+    data = {}
+    failed = 0
+    for code in codes:
+        item = items[code]
+        if isinstance(item, Exception):
+            failed += 1
+            data[code] = {'success': False, 'error': str(item)}
+        else:
+            data[code] = latest_body(family, *item)
+    return data, failed
+
+
+def batch_body_bytes(family, codes, items):
+    """共享快照模式的 batch_body：返回 (已序列化的 data, 失败数)，共享快照中的 code 直接拼接已序列化的片段
+
+    与 jsonify 一致按 code 排序输出。
+    """
+    parts = []
+    failed = 0
+    for code in sorted(codes, key=str):
+        item = items[code]
+        if isinstance(item, SharedLatest):
+            body = shared_body(item)
+        elif isinstance(item, Exception):
+            failed += 1
+            body = dump_json({'success': False, 'error': str(item)}).rstrip()
+        else:
+            body = dump_json(latest_body(family, *item)).rstrip()
+        parts.append(dump_json(str(code)).rstrip() + b':' + body)
+    return b'{' + b','.join(parts) + b'}', failed
+
+
+def batch_latest(family):
+    """批量接口：按 code 返回多个设备的最新行，单个 code 出错只在该 code 下报告"""
+    start_time = time.time()
+    tag = family['tag']
+
+    try:
+        codes = get_batch_codes()
+        if not codes:
+            elapsed = (time.time() - start_time) * 1000
+            reqlog.warning(f"[请求失败{tag}] 耗时: {elapsed:.2f}ms - 缺少 codes 参数", event='batch', route=f"{family['route']}/batch", status=400, elapsed_ms=round(elapsed, 2), error='缺少 codes 参数')
+            return jsonify({
+                'success': False,
+                'error': '缺少 codes 参数'
+            }), 400
+        if len(codes) > BATCH_MAX_CODES:
+            return jsonify({
+                'success': False,
+                'error': f'codes 数量超过上限 {BATCH_MAX_CODES}'
+            }), 400
+
+        # 按表目录校验 code，非法或不存在的 code 直接记为错误，不查库
+        tables = {}
+        items = {}  # code → (原始行, 映射结果, 快照时间) | SharedLatest | 异常
+        for code in codes:
+            try:
+                tables[code] = resolve_table(family, code)
+            except (ValueError, TableNotFound) as e:
+                items[code] = e
+        # 多进程模式优先读取共享快照，其余 code 读取进程内快照
+        if shared_snapshots:
+            items.update(shared_latest_many(family, tables))
+        local = {code: table_name for code, table_name in tables.items() if code not in items}
+        results = get_latest_mapped_many(local.values(), family['keep_unmapped'], family['pool'], family['aggregate'])
+        for code, table_name in local.items():
+            items[code] = results[table_name]
+
+        etag = batch_etag(family, codes, items)
+        if request.if_none_match.contains_weak(etag):
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = log_phases()
+            reqlog.info(f"[未变化{tag}] family={family['name']}, code数={len(codes)}, 耗时: {elapsed:.2f}ms{phases}", event='batch', route=f"{family['route']}/batch", codes=len(codes), status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+            return not_modified(etag, family['max_age'])
+
+        serialize_started = time.perf_counter()
+        if shared_snapshots:
+            data, failed = batch_body_bytes(family, codes, items)
+        else:
+            data, failed = batch_body(family, codes, items)
+
+        elapsed = (time.time() - start_time) * 1000
+        if shared_snapshots:
+            response = app.response_class(splice_json(b'{"data":' + data, {
+                'elapsed_ms': round(elapsed, 2),
+                'success': True
+            }) + b'\n', mimetype='application/json')
+        else:
+            response = jsonify({
+                'success': True,
+                'data': data,
+                'elapsed_ms': round(elapsed, 2)
+            })
+        metrics.add_phase('serialize', time.perf_counter() - serialize_started)
+        phases, phase_fields = log_phases()
+        reqlog.info(f"[批量查询{tag}] family={family['name']}, code数={len(codes)}, 失败数={failed}, 耗时: {elapsed:.2f}ms{phases}", event='batch', route=f"{family['route']}/batch", codes=len(codes), failed=failed, status=200, elapsed_ms=round(elapsed, 2), **phase_fields)
+        return cache_headers(response, etag, family['max_age'])
+
+    except Exception as e:
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = log_phases()
+        reqlog.error(f"[批量查询异常{tag}] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='batch', route=f"{family['route']}/batch", status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'elapsed_ms': round(elapsed, 2)
+        }), 500
+
+
+# 在线检验汇总：输出项 → 直接读取的映射字段（不存在则为 0）
+INSPECTION_SUMMARY_FIELDS = (
+    ("测量总数量", "内径测量总数量"),
+    ("合格总数量", "内径合格总数量"),
+    ("内径合格率", "内径合格率"),
+    ("预检不合格数", "预检不合格数量"),
+    ("尺寸报废总数量", "尺寸报废总数量"),
+    ("尺寸返工总数量", "尺寸返工总数量"),
+    ("圆度返工总数量", "圆度返工总数量"),
+    ("锥度返工总数量", "锥度返工总数量"),
+)
+
+
+@functools.lru_cache(maxsize=MAPPING_PLAN_CACHE_SIZE)
+def inspection_summary_plan(plan):
+    """由映射计划解析出汇总所需的原始字段：(“结果”字段元组, ((输出项, 原始字段 | None), ...))
+
+    同一结构的表映射计划相同，只解析一次；映射版本变化后映射计划随之变化，自动重新解析。
+    """
+    columns = {}  # 映射名 → 原始字段（多个字段映射到同一名称时后者生效，与 map_row 一致）
+    for k, mapped_key in plan:
+        columns[mapped_key] = k
+    result_columns = tuple(k for mapped_key, k in columns.items() if str(mapped_key).endswith("结果"))
+    fields = tuple((label, columns.get(name)) for label, name in INSPECTION_SUMMARY_FIELDS)
+    return result_columns, fields
+
+
+def summarize_inspection(table_name, row, keep_unmapped=True):
+    """在线检验汇总：统计各“结果”字段的合格/不合格数，并读取累计统计项（直接读原始行，不映射整行）"""
+    result_columns, fields = inspection_summary_plan(get_mapping_plan(table_name, tuple(row), keep_unmapped))
+
+    # 1. “结果”字段的合格/不合格数
+    result_values = [row[k] for k in result_columns if isinstance(row[k], str)]
+    sample_count = len(result_values)
+    qualified_count = sum(1 for v in result_values if v == "合格")
+
+    # 2. 直接读取的统计项（不存在则默认 0）
+    data = {
+        "抽检数": sample_count,
+        "合格数": qualified_count,
+        "不合格数": sample_count - qualified_count,
+    }
+    for label, k in fields:
+        data[label] = row[k] if k is not None else 0
+    return data
+
+
+# 工艺数据
+register_family('technology', '/api/process_data', 'dms_device_technology_')
+# 效率数据
+register_family('workparams', '/api/efficiency_data', 'dms_device_workparams_')
+# 详细在线检验数据
+register_family('quality', '/api/detailed_online_inspection', 'dms_device_qualityparams_', tag='-225')
+# 首页在线检验数据（映射失败的字段保留原key，再做合格/不合格汇总）
+register_family('quality_summary', '/api/home_online_inspection', 'dms_device_qualityparams_',
+                keep_unmapped=True, aggregate=summarize_inspection, tag='-home_online')
+
+
+# ========== 历史数据 ==========
+# 按 ID 升序的 keyset 分页：每次最多返回 limit 行，客户端以结束标记中的 next_after_id 作为下一次的 after_id 继续读取
+# 使用非缓冲的服务端游标（SSDictCursor）逐批读取并输出，内存占用与查询范围无关
+HISTORY_DEFAULT_LIMIT = int(os.getenv('HISTORY_DEFAULT_LIMIT', '1000'))
+HISTORY_MAX_LIMIT = int(os.getenv('HISTORY_MAX_LIMIT', '100000'))
+HISTORY_FETCH_SIZE = 500                           # 每批从游标读取的行数
+HISTORY_TIME_COLUMN = os.getenv('HISTORY_TIME_COLUMN')  # 按时间查询所用字段，未设置时取表中第一个 datetime/timestamp 字段
+TABLE_SCHEMA_CACHE_SIZE = int(os.getenv('TABLE_SCHEMA_CACHE_SIZE', '1024'))  # 缓存的表结构数上限，随表目录刷新清空
+table_schemas = OrderedDict()  # (pool, table_name) → 字段列表（information_schema.COLUMNS 的行），按最近使用排序
+table_schema_lock = threading.Lock()
+
+
+def int_arg(args, name):
+    """读取整数查询参数，未传时为 None，非法时抛出 ValueError"""
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} 必须是整数: {value}") from None
+
+
+def time_arg(args, name):
+    """读取时间查询参数：Unix 时间戳（秒）或 ISO 8601 格式（如 2024-07-31T10:00:00）"""
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} 时间格式非法: {value}") from None
+
+
+def parse_history_args(args):
+    """解析历史数据查询参数（args 为查询参数映射），参数非法抛出 ValueError"""
+    limit = int_arg(args, 'limit')
+    if limit is None:
+        limit = HISTORY_DEFAULT_LIMIT
+    if not 0 < limit <= HISTORY_MAX_LIMIT:
+        raise ValueError(f"limit 取值范围为 1~{HISTORY_MAX_LIMIT}")
+    output = (args.get('format') or 'ndjson').lower()
+    if output not in ('ndjson', 'json'):
+        raise ValueError(f"format 只支持 ndjson 或 json: {output}")
+    return {
+        'after_id': int_arg(args, 'after_id'),
+        'from_id': int_arg(args, 'from_id'),
+        'to_id': int_arg(args, 'to_id'),
+        'from_ts': time_arg(args, 'from_ts'),
+        'to_ts': time_arg(args, 'to_ts'),
+        'limit': limit,
+        'format': output
+    }
+
+
+def pick_time_column(column_rows):
+    """从表字段中选出按时间查询所用的字段"""
+    names = [row['column_name'] for row in column_rows]
+    if HISTORY_TIME_COLUMN:
+        return HISTORY_TIME_COLUMN if HISTORY_TIME_COLUMN in names else None
+    for row in column_rows:
+        if row['column_type'].lower().startswith(('datetime', 'timestamp')):
+            return row['column_name']
+    return None
+
+
+def table_schema(pool, table_name):
+    """表的字段列表（按表缓存，每次刷新表目录时清空，表结构变化最迟 CATALOG_REFRESH_INTERVAL 秒后生效）"""
+    key = (pool, table_name)
+    column_rows = cached_table_schema(key)
+    if column_rows is not None:
+        return column_rows
+
+    connection = get_pool(pool).connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(*table_columns_query(pool, [table_name]))
+            column_rows = list(cursor.fetchall())
+    finally:
+        connection.close()
+
+    store_table_schema(key, column_rows)
+    return column_rows
+
+
+def cached_table_schema(key):
+    with table_schema_lock:
+        column_rows = table_schemas.get(key)
+        if column_rows is not None:
+            table_schemas.move_to_end(key)
+        return column_rows
+
+
+def store_table_schema(key, column_rows):
+    """缓存表结构，超过 TABLE_SCHEMA_CACHE_SIZE 时淘汰最久未使用的"""
+    with table_schema_lock:
+        table_schemas[key] = column_rows
+        table_schemas.move_to_end(key)
+        while len(table_schemas) > TABLE_SCHEMA_CACHE_SIZE:
+            table_schemas.popitem(last=False)
+
+
+def clear_table_schemas(pool):
+    """删除该连接池的表结构缓存"""
+    with table_schema_lock:
+        for key in [key for key in table_schemas if key[0] == pool]:
+            del table_schemas[key]
+
+
+def history_query(pool, table_name, params, time_column=None):
+    """历史数据的 (sql, 参数)：多取一行用于判断是否还有后续数据"""
+    database = POOL_CONFIGS[pool]['database']
+    conditions = []
+    args = []
+    if params['after_id'] is not None:
+        conditions.append("ID > %s")
+        args.append(params['after_id'])
+    elif params['from_id'] is not None:
+        conditions.append("ID >= %s")
+        args.append(params['from_id'])
+    if params['to_id'] is not None:
+        conditions.append("ID <= %s")
+        args.append(params['to_id'])
+    if params['from_ts'] is not None:
+        conditions.append(f"`{time_column}` >= %s")
+        args.append(params['from_ts'])
+    if params['to_ts'] is not None:
+        conditions.append(f"`{time_column}` <= %s")
+        args.append(params['to_ts'])
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = f"SELECT * FROM `{database}`.`{table_name}`{where} ORDER BY ID ASC LIMIT %s"
+    args.append(params['limit'] + 1)
+    return sql, args
+
+
+class HistoryWriter:
+    """历史数据的分块编码（两种服务模式共用）
+
+    ndjson：每行一条记录 {"id", "data"}，最后一行为结束标记 {"end": true, "count", "next_after_id", "has_more", "success"}
+    json：单个 JSON 对象 {"data": [...], "count", "next_after_id", "has_more", "success"}，分块输出
+    """
+
+    def __init__(self, family, table_name, params):
+        self.family = family
+        self.table_name = table_name
+        self.limit = params['limit']
+        self.ndjson = params['format'] == 'ndjson'
+        self.mimetype = 'application/x-ndjson' if self.ndjson else 'application/json'
+        self.count = 0
+        self.has_more = False
+        if params['after_id'] is not None:
+            self.last_id = params['after_id']
+        elif params['from_id'] is not None:
+            self.last_id = params['from_id'] - 1
+        else:
+            self.last_id = None
+
+    def head(self):
+        return b'' if self.ndjson else b'{"data":['
+
+    def rows(self, rows):
+        """编码一批行；超过 limit 的那一行只用于标记 has_more，不输出"""
+        aggregate = self.family['aggregate']
+        parts = []
+        for row in rows:
+            if self.count >= self.limit:
+                self.has_more = True
+                break
+            keep_unmapped = self.family['keep_unmapped']
+            if aggregate:
+                data = aggregate(self.table_name, row, keep_unmapped)
+            else:
+                data = map_row(self.table_name, row, keep_unmapped)
+            line = dump_json({'id': row.get('ID'), 'data': data})
+            if not self.ndjson:
+                line = (b',' if self.count else b'') + line.rstrip(b'\n')
+            parts.append(line)
+            self.last_id = row.get('ID')
+            self.count += 1
+        return b''.join(parts)
+
+    def tail(self, error=None):
+        """结束标记；响应头已发出，查询中途出错时在此报告"""
+        trailer = {
+            'success': error is None,
+            'count': self.count,
+            'next_after_id': self.last_id,
+            'has_more': self.has_more
+        }
+        if error is not None:
+            trailer['error'] = str(error)
+        if self.ndjson:
+            return dump_json({'end': True, **trailer})
+        return b'],' + dump_json(trailer)[1:]
+
+
+# 历史数据（NDJSON / 分块 JSON）
+@app.route('/api/history', methods=['GET'])
+def history():
+    start_time = time.time()
+    family = TABLE_FAMILIES.get(request.args.get('family', ''))
+    code = request.args.get('code')
+
+    if family is None:
+        return jsonify({
+            'success': False,
+            'error': f"未知的表族: {request.args.get('family', '')}"
+        }), 400
+    if not code:
+        return jsonify({
+            'success': False,
+            'error': '缺少 code 参数'
+        }), 400
+
+    try:
+        params = parse_history_args(request.args)
+        table_name = resolve_table(family, code)
+        time_column = None
+        if params['from_ts'] is not None or params['to_ts'] is not None:
+            time_column = pick_time_column(table_schema(family['pool'], table_name))
+            if time_column is None:
+                raise ValueError(f"表没有时间字段，不支持按时间查询: {table_name}")
+    except (ValueError, TableNotFound) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404 if isinstance(e, TableNotFound) else 400
+
+    try:
+        connection = read_pool(family['pool']).connection()
+    except Exception as e:
+        reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    cursor = connection.cursor(metrics.metered_cursor(pymysql.cursors.SSDictCursor, family['pool']))
+    try:
+        cursor.execute(*history_query(family['pool'], table_name, params, time_column))
+    except Exception as e:
+        connection.close()
+        reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    writer = HistoryWriter(family, table_name, params)
+
+    def generate():
+        yield writer.head()
+        try:
+            while not writer.has_more:
+                rows = cursor.fetchmany(HISTORY_FETCH_SIZE)
+                if not rows:
+                    break
+                yield writer.rows(rows)
+        except Exception as e:
+            reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+            yield writer.tail(e)
+            return
+        yield writer.tail()
+
+    def close():
+        """响应结束（含客户端断开）时释放游标与连接"""
+        try:
+            cursor.close()
+        finally:
+            connection.close()
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = log_phases()
+        reqlog.info(f"[历史查询] family={family['name']}, code={code}, 行数={writer.count}, 耗时: {elapsed:.2f}ms{phases}", event='history', route='/api/history', family=family['name'], code=code, rows=writer.count, elapsed_ms=round(elapsed, 2), **phase_fields)
+
+    response = app.response_class(generate(), mimetype=writer.mimetype)
+    response.call_on_close(close)
+    return response
+
+
+# ========== 趋势聚合 ==========
+# 按时间分桶返回指定字段的统计值，用于趋势图：只传输约 TREND_POINTS 个点而不是原始行
+# method=sql：在 MySQL 中按桶 GROUP BY 计算 MIN/MAX/AVG/COUNT
+# method=lttb：逐行读取原始值，在本地用 LTTB（Largest-Triangle-Three-Buckets）降采样，保留曲线形状
+TREND_POINTS = int(os.getenv('TREND_POINTS', '1000'))                    # 未指定 bucket / points 时的目标点数
+TREND_MAX_POINTS = int(os.getenv('TREND_MAX_POINTS', '10000'))           # 单次最多返回的点数
+TREND_MAX_COLUMNS = int(os.getenv('TREND_MAX_COLUMNS', '20'))            # 单次最多查询的字段数
+TREND_LTTB_MAX_ROWS = int(os.getenv('TREND_LTTB_MAX_ROWS', '500000'))    # lttb 最多读取的原始行数
+NUMERIC_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint', 'decimal', 'float', 'double', 'real', 'integer')
+
+
+def parse_trend_args(args):
+    """解析趋势查询参数，参数非法抛出 ValueError"""
+    columns = normalize_codes(args.getlist('columns') + args.getlist('column'))
+    if not columns:
+        raise ValueError("缺少 columns 参数")
+    if len(columns) > TREND_MAX_COLUMNS:
+        raise ValueError(f"columns 数量超过上限 {TREND_MAX_COLUMNS}")
+
+    from_ts = time_arg(args, 'from_ts')
+    to_ts = time_arg(args, 'to_ts')
+    if from_ts is None or to_ts is None:
+        raise ValueError("缺少 from_ts / to_ts 参数")
+    if to_ts <= from_ts:
+        raise ValueError("to_ts 必须晚于 from_ts")
+    span = (to_ts - from_ts).total_seconds()
+
+    method = (args.get('method') or 'sql').lower()
+    if method not in ('sql', 'lttb'):
+        raise ValueError(f"method 只支持 sql 或 lttb: {method}")
+
+    bucket = int_arg(args, 'bucket')
+    points = int_arg(args, 'points')
+    if method == 'sql':
+        # 桶宽（秒）：未指定时按 TREND_POINTS 个桶均分时间范围
+        if bucket is None:
+            bucket = max(1, -(-int(span) // TREND_POINTS))
+        if bucket <= 0:
+            raise ValueError("bucket 必须大于 0")
+        if span / bucket > TREND_MAX_POINTS:
+            raise ValueError(f"桶数量超过上限 {TREND_MAX_POINTS}，请增大 bucket")
+    else:
+        if points is None:
+            points = TREND_POINTS
+        if not 3 <= points <= TREND_MAX_POINTS:
+            raise ValueError(f"points 取值范围为 3~{TREND_MAX_POINTS}")
+
+    return {
+        'columns': columns,
+        'from_ts': from_ts,
+        'to_ts': to_ts,
+        'method': method,
+        'bucket': bucket,
+        'points': points
+    }
+
+
+def resolve_trend_columns(table_name, column_rows, requested, time_column):
+    """将请求的字段（原字段名或显示名）解析为 [(字段名, 显示名)]，只允许数值字段"""
+    types = {row['column_name']: row['column_type'].lower() for row in column_rows}
+    plan = get_mapping_plan(table_name, tuple(types), keep_unmapped=True)
+    display = dict(plan)
+    by_display = {mapped: column for column, mapped in plan}
+
+    resolved = []
+    for name in requested:
+        column = name if name in types else by_display.get(name)
+        if column is None:
+            raise ValueError(f"字段不存在: {name}")
+        if column in ('ID', time_column) or not types[column].startswith(NUMERIC_TYPES):
+            raise ValueError(f"字段不是数值类型，不能聚合: {name}")
+        resolved.append((column, display[column]))
+    return resolved
+
+
+def trend_sql_query(pool, table_name, time_column, columns, params):
+    """method=sql 的 (sql, 参数)：按 FLOOR(UNIX_TIMESTAMP(时间) / 桶宽) 分组"""
+    database = POOL_CONFIGS[pool]['database']
+    stats = ', '.join(
+        f"MIN(`{column}`) AS min_{i}, MAX(`{column}`) AS max_{i}, AVG(`{column}`) AS avg_{i}, COUNT(`{column}`) AS count_{i}"
+        for i, (column, _) in enumerate(columns)
+    )
+    sql = (
+        f"SELECT FLOOR(UNIX_TIMESTAMP(`{time_column}`) / %s) AS bucket, {stats} "
+        f"FROM `{database}`.`{table_name}` "
+        f"WHERE `{time_column}` >= %s AND `{time_column}` <= %s "
+        "GROUP BY bucket ORDER BY bucket"
+    )
+    return sql, [params['bucket'], params['from_ts'], params['to_ts']]
+
+
+def _number(value):
+    """Decimal 等数值统一为 float，便于前端绘图"""
+    return None if value is None else float(value)
+
+
+def trend_sql_series(columns, rows, bucket):
+    """将分组结果整理为 {显示名: [{"t", "min", "max", "avg", "count"}]}，t 为桶起始的 Unix 时间戳"""
+    series = {display: [] for _, display in columns}
+    for row in rows:
+        t = int(row['bucket']) * bucket
+        for i, (_, display) in enumerate(columns):
+            if not row[f'count_{i}']:
+                continue
+            series[display].append({
+                't': t,
+                'min': _number(row[f'min_{i}']),
+                'max': _number(row[f'max_{i}']),
+                'avg': _number(row[f'avg_{i}']),
+                'count': int(row[f'count_{i}'])
+            })
+    return series
+
+
+def trend_raw_query(pool, table_name, time_column, columns, params):
+    """method=lttb 的 (sql, 参数)：只读取时间与所需字段"""
+    database = POOL_CONFIGS[pool]['database']
+    column_sql = ', '.join(f"`{column}`" for column, _ in columns)
+    sql = (
+        f"SELECT `{time_column}` AS __time, {column_sql} FROM `{database}`.`{table_name}` "
+        f"WHERE `{time_column}` >= %s AND `{time_column}` <= %s ORDER BY ID ASC"
+    )
+    return sql, [params['from_ts'], params['to_ts']]
+
+
+def lttb(times, values, threshold):
+    """Largest-Triangle-Three-Buckets 降采样：返回不超过 threshold 个 (t, v)，保留首尾点与曲线形状"""
+    n = len(times)
+    if threshold >= n:
+        return list(zip(times, values))
+
+    sampled = [(times[0], values[0])]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_t = sum(times[start:end]) / (end - start)
+        avg_v = sum(values[start:end]) / (end - start)
+
+        # 当前桶中与上一个选中点、下一个桶平均点构成最大三角形的点
+        ta, va = times[a], values[a]
+        best, best_area = start - 1, -1.0
+        for j in range(int(i * every) + 1, start):
+            area = abs((ta - avg_t) * (values[j] - va) - (ta - times[j]) * (avg_v - va))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append((times[best], values[best]))
+        a = best
+
+    sampled.append((times[-1], values[-1]))
+    return sampled
+
+
+class TrendSampler:
+    """method=lttb 的原始值收集（两种服务模式共用）：每个字段一组 array('d')，空值跳过"""
+
+    def __init__(self, columns, points):
+        self.columns = columns
+        self.points = points
+        self.rows = 0
+        self.times = [array('d') for _ in columns]
+        self.values = [array('d') for _ in columns]
+
+    def add(self, rows):
+        """加入一批原始行，超过 TREND_LTTB_MAX_ROWS 时抛出 ValueError"""
+        self.rows += len(rows)
+        if self.rows > TREND_LTTB_MAX_ROWS:
+            raise ValueError(f"原始行数超过上限 {TREND_LTTB_MAX_ROWS}，请缩小时间范围或使用 method=sql")
+        for row in rows:
+            t = row['__time'].timestamp()
+            for i, (column, _) in enumerate(self.columns):
+                value = row[column]
+                if value is not None:
+                    self.times[i].append(t)
+                    self.values[i].append(float(value))
+
+    def series(self):
+        """{显示名: [{"t", "v"}]}"""
+        return {
+            display: [{'t': round(t, 3), 'v': v} for t, v in lttb(self.times[i], self.values[i], self.points)]
+            for i, (_, display) in enumerate(self.columns)
+        }
+
+
+# 趋势聚合
+@app.route('/api/trend', methods=['GET'])
+def trend():
+    start_time = time.time()
+    family = TABLE_FAMILIES.get(request.args.get('family', ''))
+    code = request.args.get('code')
+
+    if family is None:
         return jsonify({
             'success': False,
-            'error': str(e),
-            'elapsed_ms': round(elapsed, 2)
-        }), 500
-    
-    finally:
-        # 归还连接到连接池
-        if connection:
-            connection.close()
+            'error': f"未知的表族: {request.args.get('family', '')}"
+        }), 400
+    if not code:
+        return jsonify({
+            'success': False,
+            'error': '缺少 code 参数'
+        }), 400
 
-# 首页在线检验数据    
-@app.route('/api/home_online_inspection', methods=['GET','POST'])
-def home_online_inspection():
-    start_time = time.time()
-    connection = None
-    
     try:
-        # 获取 code 参数
-        if request.method == 'POST':
-            code = request.json.get('code')
-        else:
-            code = request.args.get('code')
-        
-        if not code:
-            elapsed = (time.time() - start_time) * 1000
-            print(f"[请求失败-225] 耗时: {elapsed:.2f}ms - 缺少 code 参数")
-            return jsonify({
-                'success': False,
-                'error': '缺少 code 参数'
-            }), 400
-        
-        # 从连接池获取连接
-        connection = db_pool_scada.connection()
-        
-        with connection.cursor() as cursor:
-            # 执行查询
-            table_name = f"dms_device_qualityparams_{code}"
-            sql = f"SELECT * FROM `{table_name}` ORDER BY ID DESC LIMIT 1"
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            
-            elapsed = (time.time() - start_time) * 1000
-            
-            if result:
-                # 尝试映射：优先用 Code，其次用 VariableName，都失败则保留原key
-                mapped = {}
-                for k, v in result.items():
-                    # 先尝试 Code 映射
-                    mapped_key = code_name_map.get(str(k))
-                    if mapped_key is None:
-                        # 再尝试 VariableName 映射
-                        mapped_key = variable_name_map.get(str(k))
-                    
-                    # 如果映射失败，保留原来的key
-                    if mapped_key is None:
-                        mapped_key = k
-                    mapped[mapped_key] = v
-
-                # 从 mapped 中提取所需字段
-                result_values = [
-                    v for k, v in mapped.items()
-                    if k.endswith("结果") and isinstance(v, str)
-                ]
-
-                sample_count = len(result_values)
-                qualified_count = sum(1 for v in result_values if v == "合格")
-                unqualified_count = sample_count - qualified_count
-
-                # 2. 直接读取的统计项（不存在则默认 0）
-                total_measure_count = mapped.get("内径测量总数量", 0)
-                total_qualified_count = mapped.get("内径合格总数量", 0)
-                inner_diameter_pass_rate = mapped.get("内径合格率", 0)
-
-                precheck_unqualified_count = mapped.get("预检不合格数量", 0)
-
-                dimension_scrap_total = mapped.get("尺寸报废总数量", 0)
-                dimension_rework_total = mapped.get("尺寸返工总数量", 0)
-                roundness_rework_total = mapped.get("圆度返工总数量", 0)
-                taper_rework_total = mapped.get("锥度返工总数量", 0)
-
-                # 3. 机检（示例：存在设备状态即可认为有机检）
-                # machine_inspection = 1 if "设备状态" in mapped else 0
-
-                # 4. 汇总结果
-                data = {
-                    "抽检数": sample_count,
-                    "合格数": qualified_count,
-                    "不合格数": unqualified_count,
-
-                    "测量总数量": total_measure_count,
-                    "合格总数量": total_qualified_count,
-                    "内径合格率": inner_diameter_pass_rate,
-
-                    "预检不合格数": precheck_unqualified_count,
-
-                    "尺寸报废总数量": dimension_scrap_total,
-                    "尺寸返工总数量": dimension_rework_total,
-                    "圆度返工总数量": roundness_rework_total,
-                    "锥度返工总数量": taper_rework_total,
-                }
-
-                print(f"[查询成功] code={code}, 耗时: {elapsed:.2f}ms, 原始字段数={len(result)}, 映射字段数={len(mapped)}")
-                return jsonify({
-                    'success': True,
-                    'data': data,
-                    'elapsed_ms': round(elapsed, 2)
-                })
+        params = parse_trend_args(request.args)
+        table_name = resolve_table(family, code)
+        column_rows = table_schema(family['pool'], table_name)
+        time_column = pick_time_column(column_rows)
+        if time_column is None:
+            raise ValueError(f"表没有时间字段，不支持趋势查询: {table_name}")
+        columns = resolve_trend_columns(table_name, column_rows, params['columns'], time_column)
+    except (ValueError, TableNotFound) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404 if isinstance(e, TableNotFound) else 400
+
+    try:
+        connection = read_pool(family['pool']).connection()
+        try:
+            if params['method'] == 'sql':
+                with connection.cursor() as cursor:
+                    cursor.execute(*trend_sql_query(family['pool'], table_name, time_column, columns, params))
+                    rows = cursor.fetchall()
+                data = trend_sql_series(columns, rows, params['bucket'])
+                raw_rows = sum(int(row['count_0'] or 0) for row in rows)
             else:
-                print(f"[无数据] code={code}, 耗时: {elapsed:.2f}ms")
-                return jsonify({
-                    'success': True,
-                    'data': None,
-                    'message': '未查询到数据',
-                    'elapsed_ms': round(elapsed, 2)
-                })
-                
+                sampler = TrendSampler(columns, params['points'])
+                cursor = connection.cursor(metrics.metered_cursor(pymysql.cursors.SSDictCursor, family['pool']))
+                try:
+                    cursor.execute(*trend_raw_query(family['pool'], table_name, time_column, columns, params))
+                    while True:
+                        rows = cursor.fetchmany(HISTORY_FETCH_SIZE)
+                        if not rows:
+                            break
+                        sampler.add(rows)
+                finally:
+                    cursor.close()
+                data = sampler.series()
+                raw_rows = sampler.rows
+        finally:
+            connection.close()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         elapsed = (time.time() - start_time) * 1000
-        print(f"[查询异常-home_online] 耗时: {elapsed:.2f}ms - 错误: {str(e)}")
+        phases, phase_fields = log_phases()
+        reqlog.error(f"[趋势查询异常] code={code}, 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='trend', route='/api/trend', family=family['name'], code=code, status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
         return jsonify({
             'success': False,
             'error': str(e),
             'elapsed_ms': round(elapsed, 2)
         }), 500
-    
+
+    elapsed = (time.time() - start_time) * 1000
+    points = sum(len(series) for series in data.values())
+    phases, phase_fields = log_phases()
+    reqlog.info(f"[趋势查询] family={family['name']}, code={code}, method={params['method']}, 原始行数={raw_rows}, 点数={points}, 耗时: {elapsed:.2f}ms{phases}", event='trend', route='/api/trend', family=family['name'], code=code, method=params['method'], rows=raw_rows, points=points, status=200, elapsed_ms=round(elapsed, 2), **phase_fields)
+    return jsonify({
+        'success': True,
+        'method': params['method'],
+        'bucket': params['bucket'],
+        'columns': {display: column for column, display in columns},
+        'data': data,
+        'elapsed_ms': round(elapsed, 2)
+    })
+
+
+# ========== 推送接口 ==========
+def subscribe_stream(keys, events):
+    """为每张表登记订阅队列（events 需提供 put_nowait，队列满时抛出 queue.Full）"""
+    with stream_lock:
+        for key in keys:
+            stream_subscribers.setdefault(key, set()).add(events)
+
+
+def unsubscribe_stream(keys, events):
+    """注销订阅队列"""
+    with stream_lock:
+        for key in keys:
+            subscribers = stream_subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del stream_subscribers[key]
+
+
+def stream_targets(names, codes):
+    """解析订阅目标：返回 ({(pool, table_name): [(family, code)]}, [被拒绝的订阅及原因])
+
+    同一张表被多个表族订阅时只登记一次；非法或不存在的 code 不订阅。
+    """
+    targets = {}
+    rejected = []
+    for name in names:
+        family = TABLE_FAMILIES[name]
+        for code in codes:
+            try:
+                key = (family['pool'], resolve_table(family, code))
+            except (ValueError, TableNotFound) as e:
+                rejected.append({'family': name, 'code': code, 'error': str(e)})
+                continue
+            targets.setdefault(key, []).append((family, code))
+    return targets, rejected
+
+
+def stream_event(event, payload):
+    """格式化一条 SSE 事件"""
+    return f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+
+
+def stream_payload(family, code, table_name, entry):
+    """按表族的映射策略与汇总函数生成推送内容"""
+    result, mapped, updated_at = _snapshot_result(table_name, entry, family['keep_unmapped'], family['aggregate'])
+    return {
+        'family': family['name'],
+        'code': code,
+        'id': result.get('ID') if result else None,
+        'data': mapped,
+        **snapshot_fields(updated_at)
+    }
+
+
+# 设备数据推送（Server-Sent Events）
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    global stream_clients
+    codes = get_batch_codes()
+    names = [n.strip() for n in request.args.get('families', '').split(',') if n.strip()] or list(TABLE_FAMILIES)
+
+    if not codes:
+        return jsonify({
+            'success': False,
+            'error': '缺少 codes 参数'
+        }), 400
+    unknown = [n for n in names if n not in TABLE_FAMILIES]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f'未知的表族: {",".join(unknown)}'
+        }), 400
+    if len(codes) * len(names) > BATCH_MAX_CODES:
+        return jsonify({
+            'success': False,
+            'error': f'订阅数量超过上限 {BATCH_MAX_CODES}'
+        }), 400
+    if not SNAPSHOT_ENABLED:
+        return jsonify({
+            'success': False,
+            'error': '快照未开启，推送不可用'
+        }), 503
+
+    # 非法或不存在的 code 不订阅，连接建立后以 error 事件报告
+    targets, rejected = stream_targets(names, codes)
+
+    with stream_lock:
+        if stream_clients >= STREAM_MAX_CLIENTS:
+            return jsonify({
+                'success': False,
+                'error': f'推送连接数已达上限 {STREAM_MAX_CLIENTS}'
+            }), 503
+        stream_clients += 1
+
+    events = queue.Queue(maxsize=256)
+    subscribe_stream(targets, events)
+    reqlog.info(f"[推送连接] families={','.join(names)}, code数={len(codes)}", event='stream_open', route='/api/stream', families=names, codes=len(codes))
+
+    def generate():
+        sent = {}  # (pool, table_name) → 已推送的行 ID，避免重复推送
+        for item in rejected:
+            yield stream_event('error', item)
+        # 先推送一次当前数据，并确保每张表都已登记到快照
+        for pool in {key[0] for key in targets}:
+            tables = [key[1] for key in targets if key[0] == pool]
+            for table_name, item in get_latest_mapped_many(tables, pool=pool).items():
+                for family, code in targets[(pool, table_name)]:
+                    if isinstance(item, Exception):
+                        yield stream_event('error', {'family': family['name'], 'code': code, 'error': str(item)})
+                        continue
+                    with snapshot_lock:
+                        entry = snapshot_store.get((pool, table_name))
+                    if entry is not None:
+                        sent[(pool, table_name)] = (entry['row'] or {}).get('ID')
+                        yield stream_event('data', stream_payload(family, code, table_name, entry))
+
+        while True:
+            try:
+                key, entry = events.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            row_id = (entry['row'] or {}).get('ID')
+            if key in sent and sent[key] == row_id:
+                continue
+            sent[key] = row_id
+            for family, code in targets.get(key, ()):
+                yield stream_event('data', stream_payload(family, code, key[1], entry))
+
+    def unsubscribe():
+        """连接关闭（含客户端断开）时注销订阅"""
+        global stream_clients
+        unsubscribe_stream(targets, events)
+        with stream_lock:
+            stream_clients -= 1
+        reqlog.info(f"[推送断开] families={','.join(names)}, code数={len(codes)}", event='stream_close', route='/api/stream', families=names, codes=len(codes))
+
+    response = app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(unsubscribe)
+    return response
+
+
+HOME_INSPECTION_SQL = "SELECT fqty_bad,fqty_good,type FROM t_qms_sj_taskiptitem ORDER BY id DESC LIMIT 3;"
+HOME_INSPECTION_PROBE_SQL = "SELECT MAX(id) AS max_id FROM t_qms_sj_taskiptitem"
+
+# 首巡检缓存：后台线程每 HOME_INSPECTION_INTERVAL 秒用 MAX(id) 探测，出现新记录时才重新查询，请求直接返回缓存
+# 通过环境变量 HOME_INSPECTION_CACHE 控制：'1'（默认）开启，'0' 每次请求直接查库
+HOME_INSPECTION_CACHE = os.getenv('HOME_INSPECTION_CACHE', '1') == '1'
+HOME_INSPECTION_INTERVAL = float(os.getenv('HOME_INSPECTION_INTERVAL', '2'))            # MAX(id) 探测间隔（秒）
+HOME_INSPECTION_FULL_INTERVAL = float(os.getenv('HOME_INSPECTION_FULL_INTERVAL', '60'))  # ID 未变化时也重新查询的间隔（秒），覆盖已有记录被修改的情况
+HOME_INSPECTION_MAX_STALE = float(os.getenv('HOME_INSPECTION_MAX_STALE', '30'))         # 缓存超过该时长未确认（后台线程未运行或探测失败）时请求直接查库（秒）
+
+home_inspection_state = None  # {'max_id', 'rows', 'data', 'queried_at', 'checked_at'}，整体替换
+home_inspection_read_at = 0.0  # 最近一次请求读取的时间，超过 SNAPSHOT_IDLE_TTL 无人读取时后台线程不再探测
+
+
+def summarize_home_inspection(rows):
+    """MES 首巡检记录：每条记录分别返回统计"""
+    data = []
+    for row in rows:
+        bad = row.get('fqty_bad', 0) or 0
+        good = row.get('fqty_good', 0) or 0
+        total = bad + good
+        data.append({
+            '不合格数': bad,         # 不良数
+            '合格数': good,       # 良品数
+            '抽检数': total,           # 总数
+            'type': row.get('type')   # 类型
+        })
+    return data
+
+
+def home_inspection_needs_query(max_id):
+    """是否需要重新查询：未开启缓存、尚无缓存、出现新记录，或距上次查询超过 HOME_INSPECTION_FULL_INTERVAL"""
+    state = home_inspection_state
+    return (not HOME_INSPECTION_CACHE or state is None or max_id is None or max_id != state['max_id']
+            or time.time() - state['queried_at'] >= HOME_INSPECTION_FULL_INTERVAL)
+
+
+def install_home_inspection(max_id, rows):
+    """写入查询结果，返回新的缓存状态"""
+    global home_inspection_state
+    now = time.time()
+    home_inspection_state = {
+        'max_id': max_id,
+        'rows': len(rows),
+        'data': summarize_home_inspection(rows) if rows else None,
+        'queried_at': now,
+        'checked_at': now
+    }
+    return home_inspection_state
+
+
+def confirm_home_inspection():
+    """MAX(id) 未变化：只更新确认时间"""
+    global home_inspection_state
+    home_inspection_state = dict(home_inspection_state, checked_at=time.time())
+    return home_inspection_state
+
+
+def cached_home_inspection():
+    """请求读取缓存：缓存有效时返回状态，否则返回 None（由请求查库）"""
+    global home_inspection_read_at
+    now = time.time()
+    home_inspection_read_at = now
+    state = home_inspection_state
+    if not HOME_INSPECTION_CACHE or state is None or now - state['checked_at'] > HOME_INSPECTION_MAX_STALE:
+        return None
+    return state
+
+
+def load_home_inspection():
+    """MAX(id) 探测，有新记录时重新查询首巡检记录，返回最新的缓存状态（未开启缓存时直接查询）"""
+    connection = read_pool('mes').connection()
+    try:
+        with connection.cursor() as cursor:
+            max_id = None
+            if HOME_INSPECTION_CACHE:
+                cursor.execute(HOME_INSPECTION_PROBE_SQL)
+                max_id = (cursor.fetchone() or {}).get('max_id')
+            if not home_inspection_needs_query(max_id):
+                return confirm_home_inspection()
+            cursor.execute(HOME_INSPECTION_SQL)
+            return install_home_inspection(max_id, cursor.fetchall())
     finally:
-        # 归还连接到连接池
-        if connection:
-            connection.close()
+        connection.close()
+
+
+def refresh_home_inspection():
+    """后台探测：最近有人读取时才探测（请求合并，与请求触发的查询不会重复执行）"""
+    if home_inspection_state is None or time.time() - home_inspection_read_at > SNAPSHOT_IDLE_TTL:
+        return
+    try:
+        single_flight('home_inspection', load_home_inspection)
+    except Exception as e:
+        reqlog.error(f"[首巡检刷新失败] 错误: {str(e)}", event='home_inspection_refresh', error=str(e))
+
+
+def start_home_inspection_worker():
+    """启动首巡检探测线程（HOME_INSPECTION_CACHE=1 时）"""
+    if not HOME_INSPECTION_CACHE:
+        return
+    start_periodic('home-inspection-worker', HOME_INSPECTION_INTERVAL, refresh_home_inspection)
+    print(f"首巡检探测线程已启动 [探测间隔: {HOME_INSPECTION_INTERVAL}s, 全量刷新间隔: {HOME_INSPECTION_FULL_INTERVAL}s]")
+
+
+def home_inspection_etag(state):
+    """首巡检 ETag：最大 ID 或重新查询时间变化时失效"""
+    return make_etag('home_inspection', state['max_id'], state['queried_at'])
+
+
+def home_inspection_body(state):
+    """首巡检响应体（不含 elapsed_ms）"""
+    if state['data']:
+        return {
+            'success': True,
+            'data': state['data'],
+            **snapshot_fields(state['checked_at'])
+        }
+    return {
+        'success': True,
+        'data': None,
+        'message': '未查询到数据',
+        **snapshot_fields(state['checked_at'])
+    }
 
 
 # 首页首巡检  MES系统数据
+POLL_RATES['/api/home_inspection'] = poll_rates.poll_rate('/api/home_inspection')
+
+
 @app.route('/api/home_inspection', methods=['GET','POST'])
 def home_inspection():
         start_time = time.time()
-        connection = None
         
         try:
+            # 优先读取缓存，缓存无效时查库（并发请求合并为一次）
+            state = cached_home_inspection() or single_flight('home_inspection', load_home_inspection)
+            etag = home_inspection_etag(state)
             
+            if request.if_none_match.contains_weak(etag):
+                elapsed = (time.time() - start_time) * 1000
+                phases, phase_fields = log_phases()
+                reqlog.info(f"[未变化-MES] , 耗时: {elapsed:.2f}ms{phases}", event='home_inspection', route='/api/home_inspection', status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+                return not_modified(etag, 1)
             
-            # 从连接池获取连接
-            connection = db_pool_mes.connection()
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = log_phases()
             
-            with connection.cursor() as cursor:
-                # 执行查询
-                sql = f"SELECT fqty_bad,fqty_good,type FROM t_qms_sj_taskiptitem ORDER BY id DESC LIMIT 3;"
-                cursor.execute(sql)
-                result = cursor.fetchall()
-                
-                elapsed = (time.time() - start_time) * 1000
-                
-                if result:
-                    # 每条记录分别返回统计
-                    data = []
-                    for row in result:
-                        bad = row.get('fqty_bad', 0) or 0
-                        good = row.get('fqty_good', 0) or 0
-                        total = bad + good
-                        data.append({
-                            '不合格数': bad,         # 不良数
-                            '合格数': good,       # 良品数
-                            '抽检数': total,           # 总数
-                            'type': row.get('type')   # 类型
-                        })
-                    
-                    print(f"[查询成功-MES] , 耗时: {elapsed:.2f}ms, 记录数={len(result)}")
-                    return jsonify({
-                        'success': True,
-                        'data': data,
-                        'elapsed_ms': round(elapsed, 2)
-                    })
-                else:
-                    print(f"[无数据] , 耗时: {elapsed:.2f}ms")
-                    return jsonify({
-                        'success': True,
-                        'data': None,
-                        'message': '未查询到数据',
-                        'elapsed_ms': round(elapsed, 2)
-                    })
+            if state['data']:
+                reqlog.info(f"[查询成功-MES] , 耗时: {elapsed:.2f}ms{phases}, 记录数={state['rows']}", event='home_inspection', route='/api/home_inspection', status=200, elapsed_ms=round(elapsed, 2), rows=state['rows'], **phase_fields)
+            else:
+                reqlog.info(f"[无数据] , 耗时: {elapsed:.2f}ms{phases}", event='home_inspection', route='/api/home_inspection', status=200, elapsed_ms=round(elapsed, 2), rows=0, **phase_fields)
+            response = jsonify({
+                **home_inspection_body(state),
+                'elapsed_ms': round(elapsed, 2)
+            })
+            return cache_headers(response, etag, 1)
                     
         except Exception as e:
             elapsed = (time.time() - start_time) * 1000
-            print(f"[查询异常] 耗时: {elapsed:.2f}ms - 错误: {str(e)}")
+            phases, phase_fields = log_phases()
+            reqlog.error(f"[查询异常] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='home_inspection', route='/api/home_inspection', status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
             return jsonify({
                 'success': False,
                 'error': str(e),
                 'elapsed_ms': round(elapsed, 2)
             }), 500
-        
-        finally:
-            # 归还连接到连接池
-            if connection:
-                connection.close()
+
+# 详情页首巡检模拟数据
+DETAILS_INSPECTION_DATA = {
+    "内径尺寸标准": "φ17(-0.0005~-0.0035)",
+    "内径尺寸结果": "合格",
+    "垂直差标准": "0.002",
+    "垂直差结果": "合格",
+    "壁厚差标准": "0.0015",
+    "壁厚差结果": "合格",
+    "椭圆标准": "0.001",
+    "椭圆结果": "合格",
+    "锥度标准": "0.001",
+    "锥度结果": "合格",
+    "粗糙度标准": "Ra 0.2μm",
+    "粗糙度结果": "合格",
+    "表面质量标准": "无缺陷",
+    "表面质量结果": "不合格",
+    "表面质量备注": "2个生锈"
+}
+
 
 # 详情页首巡检    模拟数据
 @app.route('/api/details_inspection', methods=['GET','POST'])
 def details_inspection():
         # 模拟数据返回
-        data = {
-            "内径尺寸标准": "φ17(-0.0005~-0.0035)",
-            "内径尺寸结果": "合格",
-            "垂直差标准": "0.002",
-            "垂直差结果": "合格",
-            "壁厚差标准": "0.0015",
-            "壁厚差结果": "合格",
-            "椭圆标准": "0.001",
-            "椭圆结果": "合格",
-            "锥度标准": "0.001",
-            "锥度结果": "合格",
-            "粗糙度标准": "Ra 0.2μm",
-            "粗糙度结果": "合格",
-            "表面质量标准": "无缺陷",
-            "表面质量结果": "不合格",
-            "表面质量备注": "2个生锈"
-        }
         return jsonify({
             'success': True,
-            'data': data
+            'data': DETAILS_INSPECTION_DATA
         })
 
+# ========== 运行指标 ==========
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_phases()
+
+
+PHASE_LABELS = {'pool_wait_ms': '取连接', 'query_ms': '查询', 'map_ms': '映射', 'serialize_ms': '序列化'}
+
+
+def log_phases():
+    """本次请求的分阶段耗时，返回 (日志文本, 结构化字段)：如 '（取连接 0.05ms / 查询 1.20ms）'，没有记录时为空"""
+    phases = metrics.request_phases()
+    if not phases:
+        return '', phases
+    return f"（{' / '.join(f'{PHASE_LABELS[name]} {ms:.2f}ms' for name, ms in phases.items())}）", phases
+
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板记录请求数、耗时与错误数（流式接口记录到开始输出为止）"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+# ========== 请求频率限制 ==========
+def poll_cache_key(route):
+    """缓存响应的 code：批量接口见 batch_poll_key，MES 接口为空"""
+    if route.endswith('/batch'):
+        return batch_poll_key(get_batch_codes())
+    if request.method == 'POST':
+        return (request.get_json(silent=True) or {}).get('code')
+    return request.args.get('code')
+
+
+@app.before_request
+def limit_poll_rate():
+    """超过请求频率时返回最近一次的成功响应（在计时钩子之后注册，缓存响应同样计入运行指标）"""
+    route = request.url_rule.rule if request.url_rule else None
+    if not RATE_LIMIT_ENABLED or route not in POLL_RATES or request.method == 'OPTIONS':
+        return None
+    try:
+        code = poll_cache_key(route)
+    except Exception:
+        return None  # 请求参数有误，交给接口返回错误
+    g.poll_key = (route, code)
+    if poll_limiter.allow(rate_limit_client(request.remote_addr, request.headers), route, code):
+        return None
+
+    entry = poll_limiter.cached(route, code)
+    if entry is None:
+        metrics.RATE_LIMITED.inc(route=route, outcome='passed')
+        return None
+    metrics.RATE_LIMITED.inc(route=route, outcome='cached')
+    g.poll_key = None
+    headers = rate_limited_headers(entry)
+    if entry[1] and request.if_none_match.contains_weak(entry[1]):
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(entry[0], mimetype='application/json', headers=headers)
+
+
+@app.after_request
+def store_poll_response(response):
+    """记录频率受限接口最近一次的成功响应"""
+    key = g.pop('poll_key', None)
+    if key and response.status_code == 200:
+        poll_limiter.store(*key, response.get_data(), response.get_etag()[0], response.headers.get('Cache-Control'))
+    return response
+
+
+def tunnel_status():
+    """SSH 隧道状态（抓取 /metrics 时读取；不使用隧道时不输出）"""
+    if not SSH_ENABLED:
+        return {}
+    return {
+        (name,): int(ssh_tunnel is not None and ssh_tunnel.forward_up(name))
+        for name in (ssh_tunnel.local_ports if ssh_tunnel is not None else DB_ENDPOINTS)
+    }
+
+
+def pool_connections():
+    """连接池连接数（抓取 /metrics 时读取）"""
+    values = {}
+    for name, pool in endpoint_pools():
+        stats = pool.stats()
+        for state in ('in_use', 'idle', 'waiting'):
+            values[(name, state)] = stats[state]
+    return values
+
+
+def endpoint_metrics():
+    """数据库端点是否在线（抓取 /metrics 时读取；健康检查线程未运行时不输出，如未配置副本或异步服务模式）"""
+    if 'endpoint-monitor' not in background_threads:
+        return {}
+    return {(endpoint, info['role']): int(bool(endpoint_state(endpoint)['up'])) for endpoint, info in DB_ENDPOINTS.items()}
+
+
+def replica_lag_metrics():
+    """副本的复制延迟（秒），无法确定时不输出"""
+    return {
+        (endpoint,): endpoint_state(endpoint)['lag_s']
+        for endpoint in DB_ENDPOINTS
+        if endpoint not in POOL_CONFIGS and endpoint_state(endpoint)['lag_s'] is not None
+    }
+
+
+def process_info():
+    """处理本次抓取的进程（多进程模式下每个工作进程的指标各自独立）"""
+    worker = '' if prefork.worker_index is None else str(prefork.worker_index)
+    return {(str(os.getpid()), prefork.role or 'single', worker): 1}
+
+
+metrics.TUNNEL_UP.register(tunnel_status)
+metrics.POOL_CONNECTIONS.register(pool_connections)
+metrics.DB_ENDPOINT_UP.register(endpoint_metrics)
+metrics.DB_REPLICA_LAG.register(replica_lag_metrics)
+metrics.PROCESS_INFO.register(process_info)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 指标"""
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
+    if prefork.role == 'worker':
+        return jsonify(prefork.health())
     return jsonify({'status': 'ok'})
 
+
+def merge_pool_stats(stats):
+    """汇总多个工作进程的连接池状态：连接数与计数相加，等待时间分位数取各进程的最大值"""
+    merged = {'wait_ms': None}
+    for item in stats:
+        for key, value in item.items():
+            if key == 'wait_ms':
+                if value:
+                    merged['wait_ms'] = {q: max((merged['wait_ms'] or {}).get(q, 0), ms) for q, ms in value.items()}
+            elif key == 'generation':
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def worker_status():
+    """工作进程写入状态目录的内容（多进程模式）"""
+    return {
+        'pools': {name: pool.stats() for name, pool in endpoint_pools()}
+    }
+
+
+def prefork_pool_status():
+    """多进程模式的 /pool/status：汇总所有存活工作进程的连接池，并列出每个进程的状态"""
+    master, workers = prefork.read_statuses()
+    status = {}
+    for name in DB_ENDPOINTS:
+        stats = [worker['pools'][name] for worker in workers if worker['pools'].get(name)]
+        status[f'pool_{name}'] = {'status': 'running', **merge_pool_stats(stats)} if stats else 'not_initialized'
+    status['ssh_tunnel'] = ssh_tunnel.status() if ssh_tunnel else ('not_initialized' if SSH_ENABLED else 'disabled')
+    status['workers'] = {
+        str(worker['index']): {'pid': worker['pid'], 'uptime_s': round(time.time() - worker['started_at'], 1), **worker['pools']}
+        for worker in workers
+    }
+    if any(REPLICAS_BY_POOL.values()):
+        status['replicas'] = endpoint_status()  # 处理本次请求的工作进程的检查结果
+    if shared_snapshots:
+        status['shared_snapshot'] = shared_snapshot_status(master)
+    expected = master['workers'] if master else 0
+    running = (expected and len(workers) >= expected and all(status[f'pool_{name}'] != 'not_initialized' for name in POOL_CONFIGS)
+               and (not SSH_ENABLED or ssh_tunnel and ssh_tunnel.is_active)
+               and (not shared_snapshots or status['shared_snapshot']['refresher'] != 'down'))
+    return jsonify({
+        'status': 'running' if running else 'partial',
+        'workers': {'expected': expected, 'alive': len(workers), 'restarts': master['restarts'] if master else 0},
+        'pool_info': status
+    }), 200 if running else 503
+
+
 @app.route('/pool/status', methods=['GET'])
 def pool_status():
-    """查看连接池状态"""
+    """查看连接池状态（使用中/空闲/等待中的连接数、新建与关闭次数、取连接等待时间分位数）、SSH 隧道与只读副本状态"""
+    if prefork.role == 'worker':
+        return prefork_pool_status()
     status = {
-        'pool_scada': 'running' if db_pool_scada else 'not_initialized',
-        'pool_mes': 'running' if db_pool_mes else 'not_initialized'
+        'pool_scada': {'status': 'running', **db_pool_scada.stats()} if db_pool_scada else 'not_initialized',
+        'pool_mes': {'status': 'running', **db_pool_mes.stats()} if db_pool_mes else 'not_initialized',
+        'ssh_tunnel': ssh_tunnel.status() if ssh_tunnel else ('not_initialized' if SSH_ENABLED else 'disabled')
     }
-    if db_pool_scada and db_pool_mes:
+    for endpoint, pool in replica_pools.items():
+        status[f'pool_{endpoint}'] = {'status': 'running', **pool.stats()}
+    if any(REPLICAS_BY_POOL.values()):
+        status['replicas'] = endpoint_status()
+    if db_pool_scada and db_pool_mes and (not SSH_ENABLED or ssh_tunnel and ssh_tunnel.is_active):
         return jsonify({
             'status': 'running',
             'pool_info': status
@@ -660,18 +2966,307 @@ def pool_status():
             'pool_info': status
         }), 503
 
-if __name__ == '__main__':
+
+def check_admin_token():
+    """校验管理接口令牌：未配置 ADMIN_TOKEN 时不校验"""
+    return not ADMIN_TOKEN or request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+@app.route('/admin/mapping', methods=['GET'])
+def mapping_status():
+    """查看参数映射版本"""
+    return jsonify({
+        'success': True,
+        'version': mapping_version,
+        'checksum': mapping_checksum,
+        'loaded_at': mapping_loaded_at,
+        'code_count': len(code_name_map),
+        'variable_count': len(variable_name_map)
+    })
+
+
+@app.route('/admin/mapping/reload', methods=['POST'])
+def mapping_reload():
+    """强制重新加载参数映射"""
+    if not check_admin_token():
+        return jsonify({
+            'success': False,
+            'error': '无权限'
+        }), 403
+    start_time = time.time()
+    reloaded = load_variable_name_map(force=True)
+    if reloaded and prefork.role == 'worker':
+        # 多进程模式：通知其他工作进程与刷新进程（共享快照的映射由刷新进程完成）也重新加载
+        prefork.signal_siblings(signal.SIGUSR2)
+    elapsed = (time.time() - start_time) * 1000
+    print(f"[映射重载] 版本: {mapping_version}, 耗时: {elapsed:.2f}ms")
+    return jsonify({
+        'success': reloaded,
+        'version': mapping_version,
+        'code_count': len(code_name_map),
+        'variable_count': len(variable_name_map),
+        'elapsed_ms': round(elapsed, 2)
+    }), 200 if reloaded else 500
+
+def start_service():
+    """初始化连接池、加载映射与表目录并启动后台线程（单进程模式与每个工作进程各执行一次）"""
     # 启动前初始化连接池
     init_connection_pool()
+    # 检查主库与副本（配置了副本时），之后的查询按检查结果选择端点
+    start_endpoint_monitor()
     # 从数据库加载映射（需要先初始化连接池）
     load_variable_name_map()
+    start_mapping_worker()
+    # 加载设备表目录（需要先注册表族）
+    load_table_catalog()
+    start_catalog_worker()
+    # 启动最新行快照线程
+    start_snapshot_worker()
+    # 启动首巡检探测线程
+    start_home_inspection_worker()
+    # 启动连接池调整线程（POOL_TUNE_ENABLED=1 时）
+    start_pool_tuner()
+
+
+# ========== 共享快照 ==========
+# 多进程模式下由一个刷新进程按 (表族, code) 刷新最新行，映射（或汇总）并序列化后写入共享内存（见 shmcache.py），
+# 工作进程不再各自轮询数据库，直接读取序列化好的响应体片段，拼接快照时间字段后返回
+SHARED_SNAPSHOT = os.getenv('SHARED_SNAPSHOT', '1') == '1'                       # 多进程模式下是否使用共享快照（需 SNAPSHOT_ENABLED=1）
+SHARED_SNAPSHOT_SLOTS = int(os.getenv('SHARED_SNAPSHOT_SLOTS', '2048'))          # 槽位数，即共享的 (表族, code) 数上限
+SHARED_SNAPSHOT_SLOT_SIZE = int(os.getenv('SHARED_SNAPSHOT_SLOT_SIZE', '16384'))  # 每个槽位的字节数，序列化后超过的行回退到进程内快照
+SHARED_PENDING_TIMEOUT = 30  # 登记后超过该时长（秒）仍未写入的槽位（登记的工作进程已退出）由刷新进程回收
+
+# 值的头部：行 ID、映射摘要、原始字段数、映射字段数；之后为只含 data、去掉结尾 } 的响应体片段
+SHARED_META = struct.Struct('<32s16sII')
+SharedLatest = namedtuple('SharedLatest', ['row_id', 'mapping', 'raw_fields', 'mapped_fields', 'fragment', 'updated_at'])
+
+shared_snapshots = None  # shmcache.SharedTable，主进程在 fork 前创建
+shared_versions = {}     # 刷新进程：key → 槽位中数据的 (行 ID, 映射摘要)，未变化时只更新写入时间
+shared_refresh = {'rounds': 0, 'last_at': None, 'last_ms': None, 'tables': 0, 'errors': 0}  # 刷新进程最近一轮的统计
+
+
+def shared_key(family, code):
+    return f"{family['name']}/{code}".encode('utf-8')
+
+
+def encode_shared(family, table_name, row):
+    """按表族的映射策略与汇总函数处理一行数据，序列化为共享快照的值"""
+    result, mapped, _ = _snapshot_result(table_name, _new_snapshot_entry(row, 0), family['keep_unmapped'], family['aggregate'])
+    row_id = str(result.get('ID') if result else None).encode('utf-8')[:32]
+    fragment = dump_json({'data': latest_data(result, mapped)['data']}).rstrip()[:-1]
+    return SHARED_META.pack(row_id, mapping_digest.encode('ascii'), len(result or ()), len(mapped or ())) + fragment
+
+
+def decode_shared(value, updated_at):
+    row_id, mapping, raw_fields, mapped_fields = SHARED_META.unpack_from(value)
+    return SharedLatest(row_id.rstrip(b'\0').decode('utf-8'), mapping.rstrip(b'\0').decode('ascii'), raw_fields, mapped_fields,
+                        value[SHARED_META.size:], updated_at)
+
+
+def splice_json(fragment, fields):
+    """在已序列化的 JSON 对象片段（去掉了结尾的 }）后追加字段，返回完整的 JSON（不含结尾换行）
+
+    fields 的键需都排在片段中的键之后，拼接结果才与 jsonify（键排序）的输出逐字节一致。
+    """
+    return fragment + b',' + dump_json(fields).rstrip()[1:]
+
+
+def shared_body(item, **fields):
+    """共享快照中的单设备响应体：片段只含 data，其余字段（键都排在 data 之后）读取时拼接"""
+    body = {key: value for key, value in latest_data(item.raw_fields, None).items() if key != 'data'}
+    return splice_json(item.fragment, {**body, **snapshot_fields(item.updated_at), **fields})
+
+
+def shared_latest_many(family, tables):
+    """从共享快照读取 {code: table_name}，返回 {code: SharedLatest | 异常}；未返回的 code 由调用方读取进程内快照
+
+    共享快照中还没有的 code 由本进程登记、查库并写入，之后由刷新进程刷新；
+    其他进程已登记但尚未写入、超过 SNAPSHOT_MAX_STALE 未刷新（刷新进程未运行或查询失败）、
+    超出槽位大小或没有空闲槽位的 code 不返回。
+    """
+    now = time.time()
+    items = {}
+    claimed = {}  # code → (key, 槽位)
+    for code, table_name in tables.items():
+        key = shared_key(family, code)
+        value = shared_snapshots.get(key)
+        if value is None:
+            slot = shared_snapshots.claim(key)
+            if slot is not None:
+                claimed[code] = (key, slot)
+        elif value.state == shmcache.READY and now - value.updated_at <= SNAPSHOT_MAX_STALE:
+            shared_snapshots.touch(value.slot)
+            items[code] = decode_shared(value.value, value.updated_at)
+    if not claimed:
+        return items
+
+    try:
+        rows = fetch_latest_rows([tables[code] for code in claimed], pool=family['pool'])
+    except BaseException:
+        for key, slot in claimed.values():
+            shared_snapshots.evict(slot, key)
+        raise
+    for code, (key, slot) in claimed.items():
+        row = rows.get(tables[code])
+        if isinstance(row, Exception):
+            shared_snapshots.evict(slot, key)
+            items[code] = row
+            continue
+        updated_at = time.time()
+        value = encode_shared(family, tables[code], row)
+        shared_snapshots.fill(slot, key, value, updated_at)
+        items[code] = decode_shared(value, updated_at)
+    return items
+
+
+def refresh_shared_snapshots():
+    """刷新进程：刷新一轮共享快照
+
+    淘汰长时间无人读取、以及登记后迟迟未写入的槽位，其余按连接池分组批量查询最新行；
+    行 ID 与映射内容都未变化时只更新写入时间，不重新映射与序列化。
+    """
+    started = time.time()
+    targets = {}  # pool → {table_name: [(family, key, 槽位)]}
+    for slot, state, key, updated_at, last_read in shared_snapshots.entries():
+        name, _, code = key.decode('utf-8').partition('/')
+        family = TABLE_FAMILIES.get(name)
+        ttl = SHARED_PENDING_TIMEOUT if state == shmcache.PENDING else SNAPSHOT_IDLE_TTL
+        if family is None or started - last_read > ttl:
+            shared_snapshots.evict(slot, key)
+            shared_versions.pop(key, None)
+        elif state == shmcache.READY:
+            targets.setdefault(family['pool'], {}).setdefault(table_name_for(family, code), []).append((family, key, slot))
+
+    refreshed = errors = 0
+    for pool, tables in targets.items():
+        for table_name, row in fetch_latest_rows(list(tables), pool=pool).items():
+            if isinstance(row, Exception):
+                # 保留旧数据（写入时间不变，超过 SNAPSHOT_MAX_STALE 后工作进程改为自行查库）
+                errors += 1
+                reqlog.error(f"[共享快照刷新失败] table={table_name} - 错误: {str(row)}", event='snapshot_refresh', pool=pool, table=table_name, error=str(row))
+                continue
+            refreshed += 1
+            version = ((row or {}).get('ID'), mapping_digest)
+            for family, key, slot in tables[table_name]:
+                if shared_versions.get(key) == version:
+                    shared_snapshots.touch_updated(slot, time.time())
+                else:
+                    shared_snapshots.update(slot, key, encode_shared(family, table_name, row), time.time())
+                    shared_versions[key] = version
+
+    shared_refresh.update(
+        rounds=shared_refresh['rounds'] + 1,
+        last_at=round(started, 3),
+        last_ms=round((time.time() - started) * 1000, 2),
+        tables=refreshed,
+        errors=errors
+    )
+
+
+def refresher_status():
+    """刷新进程写入状态目录的内容"""
+    return {**worker_status(), 'refresh': dict(shared_refresh)}
+
+
+def shared_snapshot_status(master):
+    """/pool/status 中的共享快照：槽位使用情况与刷新进程状态"""
+    refresher = prefork.read_alive(master, prefork.REFRESHER) if master else None
+    return {
+        **shared_snapshots.usage(),
+        'refresher': {'pid': refresher['pid'], **refresher['refresh'], **refresher['pools']} if refresher else 'down'
+    }
+
+
+# ========== 多进程模式 ==========
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '32'))  # 每个进程的 waitress 线程数
+
+
+def invalidate_on_signal(signum, frame):
+    """主进程的隧道重建后发送 SIGUSR1：在单独的线程中丢弃旧连接（信号处理函数中不能等待连接池的锁）"""
+    ssh_tunnel.generation += 1
+    threading.Thread(target=invalidate_pools, args=(ssh_tunnel.generation,), daemon=True).start()
+
+
+def reload_mapping_on_signal(signum, frame):
+    """其他进程处理了 /admin/mapping/reload 后发送 SIGUSR2：在单独的线程中强制重新加载映射"""
+    threading.Thread(target=load_variable_name_map, kwargs={'force': True}, daemon=True).start()
+
+
+def setup_child():
+    """子进程（工作进程与刷新进程）：改用主进程隧道的本地端口，登记主进程与其他子进程的通知信号
+
+    信号在 fork 前已屏蔽，调用方在连接池建立后调用 prefork.unblock_child_signals()，
+    屏蔽期间收到的通知（隧道重建、映射重载）此时再处理。
+    """
+    global ssh_tunnel
+    if ssh_tunnel is not None:
+        ssh_tunnel = prefork.TunnelView(ssh_tunnel.local_ports)
+        signal.signal(signal.SIGUSR1, invalidate_on_signal)
+    signal.signal(signal.SIGUSR2, reload_mapping_on_signal)
+
+
+def run_worker(sock, index):
+    """工作进程入口：经主进程的隧道建立自己的连接池，在共用的监听 socket 上提供服务"""
+    setup_child()
+    try:
+        start_service()
+        prefork.unblock_child_signals()
+        prefork.start_reporter(worker_status)
+        print(f"工作进程 {index} (pid {os.getpid()}) 开始处理请求")
+        serve(app, sockets=[sock], threads=SERVER_THREADS)
+    finally:
+        cleanup()
+
+
+def run_refresher():
+    """刷新进程入口：经主进程的隧道建立自己的连接池，每 SNAPSHOT_INTERVAL 秒刷新一轮共享快照（不处理请求）"""
+    setup_child()
+    try:
+        init_connection_pool()
+        start_endpoint_monitor()
+        load_variable_name_map()
+        start_mapping_worker()
+        prefork.unblock_child_signals()
+        prefork.start_reporter(refresher_status)
+        start_periodic('shared-snapshot-refresher', SNAPSHOT_INTERVAL, refresh_shared_snapshots)
+        print(f"刷新进程 (pid {os.getpid()}) 已启动 [刷新间隔: {SNAPSHOT_INTERVAL}s, 槽位: {SHARED_SNAPSHOT_SLOTS} × {SHARED_SNAPSHOT_SLOT_SIZE} 字节]")
+        background_stop.wait()
+    finally:
+        cleanup()
+
+
+def run_prefork():
+    """多进程模式：主进程建立 SSH 隧道与监听端口，预先 fork PREFORK_WORKERS 个工作进程"""
+    global ssh_tunnel, shared_snapshots
+    if SSH_ENABLED:
+        print(f"正在建立 SSH 隧道 → {SSH_CONFIG['host']}（转发 {DB_CONFIG_SCADA['host']}、{DB_CONFIG_SCADA_MES['host']}）...")
+        ssh_tunnel = open_ssh_tunnel()
+        print(f"SSH 隧道已建立，本地端口: SCADA {ssh_tunnel.port('scada')}, MES {ssh_tunnel.port('mes')}")
+    # 共享快照在 fork 前创建，工作进程与刷新进程继承同一块共享内存
+    if SHARED_SNAPSHOT and SNAPSHOT_ENABLED:
+        shared_snapshots = shmcache.SharedTable(SHARED_SNAPSHOT_SLOTS, SHARED_SNAPSHOT_SLOT_SIZE)
+    master = prefork.Master(prefork.PREFORK_WORKERS, ('0.0.0.0', 5000), run_worker, status=lambda: {
+        'ssh_tunnel': ssh_tunnel.status() if ssh_tunnel else ('not_initialized' if SSH_ENABLED else 'disabled')
+    }, refresher=run_refresher if shared_snapshots else None)
+    if ssh_tunnel:
+        ssh_tunnel.on_restart(lambda generation: master.signal_workers(signal.SIGUSR1))
+    try:
+        master.run()
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__' and prefork.PREFORK_WORKERS > 0:
+    run_prefork()
+elif __name__ == '__main__':
+    start_service()
     
     # 使用 Waitress 启动生产级服务器
     print("正在启动 Waitress 服务器...")
     print("服务地址: http://0.0.0.0:5000")
     print("按 Ctrl+C 停止服务")
     try:
-        serve(app, host='0.0.0.0', port=5000, threads=32)
+        serve(app, host='0.0.0.0', port=5000, threads=SERVER_THREADS)
     except KeyboardInterrupt:
         print("\n接收到终止信号...")
     finally:
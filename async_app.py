@@ -0,0 +1,1123 @@
+"""异步服务模式：Starlette + uvicorn + aiomysql
+
+与 app.py（Flask + waitress 线程模式）提供相同的接口与 JSON 格式，
+表族注册、SQL 构造、映射计划、快照存储与表目录都复用 app.py；
+查库改为 aiomysql 协程，单个事件循环即可承载大量并发轮询与 SSE 长连接。
+
+依赖：pip install starlette uvicorn aiomysql
+运行：python async_app.py
+"""
+import asyncio
+import contextlib
+import os
+import queue
+import time
+
+import aiomysql
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_etags, unquote_etag
+
+import app as core
+import metrics
+import reqlog
+
+# 连接池名称 → (初始连接数, 最大连接数)，与 waitress 模式的 PooledDB 一致（见 app.POOL_SIZES）
+POOL_SIZES = {
+    name: (sizes['mincached'], sizes['maxconnections'])
+    for name, sizes in core.POOL_SIZES.items()
+}
+
+# 事件循环中每个 SSE 连接只占一个协程，上限可远高于 waitress 模式
+ASYNC_STREAM_MAX_CLIENTS = int(os.getenv('ASYNC_STREAM_MAX_CLIENTS', '1000'))
+ASYNC_PORT = int(os.getenv('ASYNC_PORT', '5000'))
+
+pools = {}         # 连接池名称 → aiomysql 连接池
+tasks = []         # 后台协程（映射、表目录、快照刷新、首巡检探测）
+pending = set()    # 后台刷新等一次性协程，保留引用直到完成
+
+# 请求合并：与 app.py 相同的语义，改用事件循环中的 Future（只在事件循环线程中访问，无需加锁）
+inflight = {}         # key → asyncio.Future
+revalidating = set()  # 已提交后台刷新、尚未完成的 (pool, table_name)
+stream_clients = 0
+
+# 连接池运行统计：等待取连接的协程数与最近 N 次等待时间
+checkout_waiting = {name: 0 for name in core.POOL_CONFIGS}
+pool_waits = {name: core.WaitWindow() for name in core.POOL_CONFIGS}
+
+
+# ========== 连接池 ==========
+def ignored_replicas():
+    """已配置（SCADA_REPLICAS / MES_REPLICAS）但异步服务模式不使用的副本"""
+    return [endpoint for endpoints in core.REPLICAS_BY_POOL.values() for endpoint in endpoints]
+
+
+async def open_pools():
+    """建立 SSH 隧道（SSH_ENABLED 时）并创建 aiomysql 连接池"""
+    print("=" * 60)
+    if ignored_replicas():
+        print(f"[警告] 异步服务模式不支持只读副本，以下副本将被忽略（只连接主库）: {', '.join(ignored_replicas())}")
+    if core.SSH_ENABLED:
+        print(f"正在建立 SSH 隧道 → {core.SSH_CONFIG['host']}...")
+        # 隧道记录到 app.ssh_tunnel，/metrics 与 /pool/status 的隧道状态两种模式共用；只转发主库
+        core.ssh_tunnel = await asyncio.to_thread(core.open_ssh_tunnel, list(core.POOL_CONFIGS))
+        loop = asyncio.get_running_loop()
+        core.ssh_tunnel.on_restart(lambda generation: asyncio.run_coroutine_threadsafe(clear_pools(generation), loop))
+        print(f"SSH 隧道已建立，本地端口: {core.ssh_tunnel.local_ports}")
+    else:
+        print(f"不使用 SSH 隧道，直连数据库 (DB_TARGET={core.DB_TARGET})")
+
+    for pool, db_config in core.POOL_CONFIGS.items():
+        minsize, maxsize = POOL_SIZES[pool]
+        host, port = core.db_address(pool)
+        pools[pool] = await aiomysql.create_pool(
+            minsize=minsize,
+            maxsize=maxsize,
+            host=host,
+            port=port,
+            user=db_config['user'],
+            password=db_config['password'],
+            db=db_config['database'],
+            charset='utf8mb4',
+            autocommit=True,
+            cursorclass=metrics.metered_async_cursor(aiomysql.DictCursor, pool)
+        )
+        print(f"连接池已创建 ({pool}) [初始连接: {minsize}, 最大连接: {maxsize}]")
+    print("=" * 60)
+
+
+async def clear_pools(generation):
+    """SSH 隧道重建后关闭空闲连接（使用中的旧连接出错后由 aiomysql 丢弃）"""
+    for pool in pools.values():
+        await pool.clear()
+    print(f"[SSH 隧道] 第 {generation} 次重建，已丢弃旧的数据库连接")
+
+
+async def close_pools():
+    """停止后台协程，关闭连接池和 SSH 隧道"""
+    print("\n正在关闭连接池和 SSH 隧道...")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+
+    for pool in pools.values():
+        pool.close()
+        await pool.wait_closed()
+    pools.clear()
+
+    if core.ssh_tunnel:
+        core.ssh_tunnel.stop()
+        core.ssh_tunnel = None
+    print("资源已释放")
+
+
+@contextlib.asynccontextmanager
+async def acquire(pool):
+    """从连接池取连接，退出时归还"""
+    connection = await checkout(pool)
+    try:
+        yield connection
+    finally:
+        pools[pool].release(connection)
+
+
+async def checkout(pool):
+    """从连接池取连接并记录等待时间（调用方负责 release）"""
+    started = time.perf_counter()
+    checkout_waiting[pool] += 1
+    try:
+        return await pools[pool].acquire()
+    finally:
+        checkout_waiting[pool] -= 1
+        elapsed = time.perf_counter() - started
+        metrics.POOL_WAIT.observe(elapsed, pool=pool)
+        metrics.add_phase('pool_wait', elapsed)
+        pool_waits[pool].add(elapsed)
+
+
+async def fetch_all(pool, sql, args=None):
+    """执行一条查询并返回全部行"""
+    async with acquire(pool) as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql, args)
+            return await cursor.fetchall()
+
+
+async def fetch_latest_rows(pool, table_names):
+    """异步版 app.fetch_latest_rows：返回 {table_name: 行 | None | 异常}"""
+    table_names = list(dict.fromkeys(table_names))
+    if not table_names:
+        return {}
+
+    async with acquire(pool) as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(*core.table_columns_query(pool, table_names))
+            statements, results = core.plan_latest_union(pool, table_names, await cursor.fetchall())
+
+            for sql, tables in statements:
+                try:
+                    await cursor.execute(sql, tables)
+                    rows = await cursor.fetchall()
+                except Exception as e:
+                    results.update(dict.fromkeys(tables, e))
+                    continue
+                results.update(core.union_rows_by_table(tables, rows))
+    return results
+
+
+# ========== 请求合并与快照 ==========
+def spawn(coro):
+    """启动一次性后台协程"""
+    task = asyncio.ensure_future(coro)
+    pending.add(task)
+    task.add_done_callback(pending.discard)
+    return task
+
+
+def _settle(task, keys, futures):
+    """查库协程结束后把结果分发给所有等待者"""
+    for key in keys:
+        inflight.pop(key, None)
+        future = futures[key]
+        if future.done():
+            continue
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result().get(key))
+
+
+async def single_flight_many(keys, fn):
+    """异步版 app.single_flight_many：fn(keys) 为协程函数，返回 {key: 结果}
+
+    查库在独立的协程中执行，发起请求的客户端断开也不会取消其他等待者的查询。
+    """
+    loop = asyncio.get_running_loop()
+    futures = {}
+    leading = []
+    for key in dict.fromkeys(keys):
+        future = inflight.get(key)
+        if future is None:
+            future = loop.create_future()
+            inflight[key] = future
+            leading.append(key)
+        futures[key] = future
+
+    if leading:
+        task = spawn(fn(leading))
+        task.add_done_callback(lambda t: _settle(t, leading, futures))
+
+    return {key: await asyncio.shield(future) for key, future in futures.items()}
+
+
+async def load_snapshots(pool, table_names):
+    """批量查库刷新快照条目，返回 {table_name: 条目 | 异常}"""
+    async def load(keys):
+        results = {}
+        for table_name, row in (await fetch_latest_rows(pool, [key[1] for key in keys])).items():
+            if isinstance(row, Exception):
+                results[(pool, table_name)] = row
+            else:
+                results[(pool, table_name)] = core._store_snapshot(pool, table_name, row)
+        return results
+
+    loaded = await single_flight_many([(pool, table_name) for table_name in table_names], load)
+    return {key[1]: entry for key, entry in loaded.items()}
+
+
+def revalidate_async(pool, table_names):
+    """后台刷新陈旧快照，同一张表同时只提交一次"""
+    keys = [(pool, t) for t in table_names if (pool, t) not in revalidating]
+    if keys:
+        revalidating.update(keys)
+        spawn(_revalidate(pool, keys))
+
+
+async def _revalidate(pool, keys):
+    try:
+        for table_name, entry in (await load_snapshots(pool, [key[1] for key in keys])).items():
+            if isinstance(entry, Exception):
+                reqlog.error(f"[快照刷新失败] table={table_name} - 错误: {str(entry)}", event='snapshot_refresh', pool=pool, table=table_name, error=str(entry))
+    except Exception as e:
+        reqlog.error(f"[快照刷新异常] 错误: {str(e)}", event='snapshot_refresh', error=str(e))
+    finally:
+        revalidating.difference_update(keys)
+
+
+async def get_latest_mapped_many(table_names, keep_unmapped=False, pool='scada', aggregate=None):
+    """异步版 app.get_latest_mapped_many，返回 {table_name: (原始行, 映射结果, 快照时间) | 异常}"""
+    entries, missing, stale = core.snapshot_lookup(pool, table_names)
+    if missing:
+        entries.update(await load_snapshots(pool, missing))
+    if stale:
+        revalidate_async(pool, stale)
+
+    return {
+        table_name: entry if isinstance(entry, Exception) else core._snapshot_result(table_name, entry, keep_unmapped, aggregate)
+        for table_name, entry in entries.items()
+    }
+
+
+async def get_latest_mapped(table_name, keep_unmapped=False, pool='scada', aggregate=None):
+    """异步版 app.get_latest_mapped，返回 (原始行, 映射结果, 快照时间)，查库失败时抛出异常"""
+    item = (await get_latest_mapped_many([table_name], keep_unmapped, pool, aggregate))[table_name]
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+
+async def refresh_snapshots():
+    """刷新一轮快照（规则同 app.refresh_snapshots）"""
+    for pool, tables in core.snapshot_refresh_targets().items():
+        for table_name, row in (await fetch_latest_rows(pool, tables)).items():
+            if isinstance(row, Exception):
+                reqlog.error(f"[快照刷新失败] table={table_name} - 错误: {str(row)}", event='snapshot_refresh', pool=pool, table=table_name, error=str(row))
+                continue
+            core._store_snapshot(pool, table_name, row, insert=False)
+
+
+# ========== 映射与表目录 ==========
+async def load_variable_name_map(force=False):
+    """异步版 app.load_variable_name_map：表校验和未变化且非强制时跳过，返回是否重新加载"""
+    try:
+        async with acquire('scada') as connection:
+            async with connection.cursor() as cursor:
+                try:
+                    await cursor.execute(core.MAPPING_CHECKSUM_SQL)
+                    checksum = ((await cursor.fetchone()) or {}).get('Checksum')
+                except Exception:
+                    checksum = None
+                if not force and checksum is not None and checksum == core.mapping_checksum:
+                    return False
+
+                await cursor.execute(core.MAPPING_SQL)
+                rows = await cursor.fetchall()
+
+        core.install_name_maps(rows, checksum)
+        return True
+
+    except Exception as e:
+        print(f"加载映射失败: {str(e)}")
+        return False
+
+
+async def load_table_catalog():
+    """异步版 app.load_table_catalog"""
+    for pool in {family['pool'] for family in core.TABLE_FAMILIES.values()}:
+        try:
+            rows = await fetch_all(pool, *core.catalog_query(pool))
+        except Exception as e:
+            print(f"加载表目录失败: pool={pool} - {str(e)}")
+            continue
+        core.install_table_catalog(pool, [row['table_name'] for row in rows])
+
+
+async def table_exists(pool, table_name):
+    """异步版 app.table_exists"""
+    exists = core.catalog_lookup(pool, table_name)
+    if exists is None:
+        key = ('catalog', pool, table_name)
+
+        async def probe(keys):
+            return {key: bool(await fetch_all(pool, *core.probe_table_query(pool, table_name)))}
+
+        exists = (await single_flight_many([key], probe))[key]
+        core.record_table_probe(pool, table_name, exists)
+    return exists
+
+
+async def resolve_table(family, code):
+    """异步版 app.resolve_table：code 格式非法抛出 ValueError，表不存在抛出 TableNotFound"""
+    table_name = core.table_name_for(family, code)
+    if not await table_exists(family['pool'], table_name):
+        raise core.TableNotFound(f"表不存在: {table_name}")
+    return table_name
+
+
+def start_periodic(name, interval, fn):
+    """启动后台协程：每 interval 秒执行一次 fn（首次在一个间隔之后）"""
+    async def worker():
+        delay = interval
+        while True:
+            await asyncio.sleep(delay)
+            started = time.time()
+            try:
+                await fn()
+            except Exception as e:
+                print(f"[后台任务异常] {name} - 错误: {str(e)}")
+            delay = max(0.0, interval - (time.time() - started))
+
+    tasks.append(asyncio.create_task(worker(), name=name))
+
+
+# ========== 响应 ==========
+def json_response(payload, status=200, headers=None):
+    """JSON 响应，序列化方式与 Flask jsonify 一致"""
+    return Response(core.dump_json(payload), status_code=status, headers=headers, media_type='application/json')
+
+
+def cache_headers(etag, max_age):
+    """弱 ETag 与 Cache-Control，与 app.cache_headers 一致"""
+    return {'ETag': f'W/"{etag}"', 'Cache-Control': f'max-age={max_age}'}
+
+
+def etag_matches(request, etag):
+    """请求头 If-None-Match 是否包含该 ETag"""
+    return parse_etags(request.headers.get('if-none-match')).contains_weak(etag)
+
+
+async def request_json(request):
+    """POST 请求的 JSON 请求体"""
+    return await request.json() or {}
+
+
+async def get_code(request):
+    if request.method == 'POST':
+        return (await request_json(request)).get('code')
+    return request.query_params.get('code')
+
+
+async def get_batch_codes(request):
+    """获取批量请求的 code 列表，规则同 app.get_batch_codes"""
+    if request.method == 'POST':
+        codes = (await request_json(request)).get('codes') or []
+        return core.normalize_codes([codes] if isinstance(codes, str) else codes)
+    return core.normalize_codes(request.query_params.getlist('code') + request.query_params.getlist('codes'))
+
+
+def serve_latest(family):
+    """单设备接口（与 app.serve_latest 相同的返回格式）"""
+    tag = family['tag']
+
+    async def endpoint(request):
+        start_time = time.time()
+        try:
+            code = await get_code(request)
+            if not code:
+                elapsed = (time.time() - start_time) * 1000
+                reqlog.warning(f"[请求失败{tag}] 耗时: {elapsed:.2f}ms - 缺少 code 参数", event='latest', route=family['route'], status=400, elapsed_ms=round(elapsed, 2), error='缺少 code 参数')
+                return json_response({
+                    'success': False,
+                    'error': '缺少 code 参数'
+                }, 400)
+
+            try:
+                table_name = await resolve_table(family, code)
+            except (ValueError, core.TableNotFound) as e:
+                elapsed = (time.time() - start_time) * 1000
+                reqlog.warning(f"[请求失败{tag}] code={code}, 耗时: {elapsed:.2f}ms - {str(e)}", event='latest', route=family['route'], code=code, status=404 if isinstance(e, core.TableNotFound) else 400, elapsed_ms=round(elapsed, 2), error=str(e))
+                return json_response({
+                    'success': False,
+                    'error': str(e),
+                    'elapsed_ms': round(elapsed, 2)
+                }, 404 if isinstance(e, core.TableNotFound) else 400)
+
+            result, mapped, updated_at = await get_latest_mapped(table_name, family['keep_unmapped'], family['pool'], family['aggregate'])
+
+            etag = core.latest_etag(family, table_name, result)
+            if etag_matches(request, etag):
+                elapsed = (time.time() - start_time) * 1000
+                phases, phase_fields = core.log_phases()
+                reqlog.info(f"[未变化{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}", event='latest', route=family['route'], code=code, status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+                return Response(status_code=304, headers=cache_headers(etag, family['max_age']))
+
+            elapsed = (time.time() - start_time) * 1000
+            serialize_started = time.perf_counter()
+            response = json_response({
+                **core.latest_body(family, result, mapped, updated_at),
+                'elapsed_ms': round(elapsed, 2)
+            }, headers=cache_headers(etag, family['max_age']))
+            metrics.add_phase('serialize', time.perf_counter() - serialize_started)
+            phases, phase_fields = core.log_phases()
+            if result:
+                reqlog.info(f"[查询成功{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}, 原始字段数={len(result)}, 映射字段数={len(mapped)}", event='latest', route=family['route'], code=code, status=200, elapsed_ms=round(elapsed, 2), raw_fields=len(result), mapped_fields=len(mapped), **phase_fields)
+            else:
+                reqlog.info(f"[无数据{tag}] code={code}, 耗时: {elapsed:.2f}ms{phases}", event='latest', route=family['route'], code=code, status=200, elapsed_ms=round(elapsed, 2), raw_fields=0, **phase_fields)
+            return response
+
+        except Exception as e:
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = core.log_phases()
+            reqlog.error(f"[查询异常{tag}] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='latest', route=family['route'], status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+            return json_response({
+                'success': False,
+                'error': str(e),
+                'elapsed_ms': round(elapsed, 2)
+            }, 500)
+
+    return endpoint
+
+
+def batch_latest(family):
+    """批量接口（与 app.batch_latest 相同的返回格式）"""
+    tag = family['tag']
+
+    async def endpoint(request):
+        start_time = time.time()
+        try:
+            codes = await get_batch_codes(request)
+            if not codes:
+                elapsed = (time.time() - start_time) * 1000
+                reqlog.warning(f"[请求失败{tag}] 耗时: {elapsed:.2f}ms - 缺少 codes 参数", event='batch', route=f"{family['route']}/batch", status=400, elapsed_ms=round(elapsed, 2), error='缺少 codes 参数')
+                return json_response({
+                    'success': False,
+                    'error': '缺少 codes 参数'
+                }, 400)
+            if len(codes) > core.BATCH_MAX_CODES:
+                return json_response({
+                    'success': False,
+                    'error': f'codes 数量超过上限 {core.BATCH_MAX_CODES}'
+                }, 400)
+
+            tables = {}
+            items = {}  # code → (原始行, 映射结果, 快照时间) | 异常
+            for code in codes:
+                try:
+                    tables[code] = await resolve_table(family, code)
+                except (ValueError, core.TableNotFound) as e:
+                    items[code] = e
+            results = await get_latest_mapped_many(tables.values(), family['keep_unmapped'], family['pool'], family['aggregate'])
+            for code, table_name in tables.items():
+                items[code] = results[table_name]
+
+            etag = core.batch_etag(family, codes, items)
+            if etag_matches(request, etag):
+                elapsed = (time.time() - start_time) * 1000
+                phases, phase_fields = core.log_phases()
+                reqlog.info(f"[未变化{tag}] family={family['name']}, code数={len(codes)}, 耗时: {elapsed:.2f}ms{phases}", event='batch', route=f"{family['route']}/batch", codes=len(codes), status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+                return Response(status_code=304, headers=cache_headers(etag, family['max_age']))
+
+            serialize_started = time.perf_counter()
+            data, failed = core.batch_body(family, codes, items)
+
+            elapsed = (time.time() - start_time) * 1000
+            response = json_response({
+                'success': True,
+                'data': data,
+                'elapsed_ms': round(elapsed, 2)
+            }, headers=cache_headers(etag, family['max_age']))
+            metrics.add_phase('serialize', time.perf_counter() - serialize_started)
+            phases, phase_fields = core.log_phases()
+            reqlog.info(f"[批量查询{tag}] family={family['name']}, code数={len(codes)}, 失败数={failed}, 耗时: {elapsed:.2f}ms{phases}", event='batch', route=f"{family['route']}/batch", codes=len(codes), failed=failed, status=200, elapsed_ms=round(elapsed, 2), **phase_fields)
+            return response
+
+        except Exception as e:
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = core.log_phases()
+            reqlog.error(f"[批量查询异常{tag}] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='batch', route=f"{family['route']}/batch", status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+            return json_response({
+                'success': False,
+                'error': str(e),
+                'elapsed_ms': round(elapsed, 2)
+            }, 500)
+
+    return endpoint
+
+
+# ========== 推送接口 ==========
+class StreamQueue(asyncio.Queue):
+    """SSE 订阅队列：队列满时抛出 queue.Full，与 app.publish_snapshot 的约定一致"""
+
+    def put_nowait(self, item):
+        try:
+            super().put_nowait(item)
+        except asyncio.QueueFull:
+            raise queue.Full from None
+
+
+async def stream_targets(names, codes):
+    """异步版 app.stream_targets"""
+    targets = {}
+    rejected = []
+    for name in names:
+        family = core.TABLE_FAMILIES[name]
+        for code in codes:
+            try:
+                key = (family['pool'], await resolve_table(family, code))
+            except (ValueError, core.TableNotFound) as e:
+                rejected.append({'family': name, 'code': code, 'error': str(e)})
+                continue
+            targets.setdefault(key, []).append((family, code))
+    return targets, rejected
+
+
+async def stream(request):
+    """设备数据推送（与 app.stream 相同的参数与事件格式）"""
+    global stream_clients
+    codes = await get_batch_codes(request)
+    names = [n.strip() for n in request.query_params.get('families', '').split(',') if n.strip()] or list(core.TABLE_FAMILIES)
+
+    if not codes:
+        return json_response({
+            'success': False,
+            'error': '缺少 codes 参数'
+        }, 400)
+    unknown = [n for n in names if n not in core.TABLE_FAMILIES]
+    if unknown:
+        return json_response({
+            'success': False,
+            'error': f'未知的表族: {",".join(unknown)}'
+        }, 400)
+    if len(codes) * len(names) > core.BATCH_MAX_CODES:
+        return json_response({
+            'success': False,
+            'error': f'订阅数量超过上限 {core.BATCH_MAX_CODES}'
+        }, 400)
+    if not core.SNAPSHOT_ENABLED:
+        return json_response({
+            'success': False,
+            'error': '快照未开启，推送不可用'
+        }, 503)
+    if stream_clients >= ASYNC_STREAM_MAX_CLIENTS:
+        return json_response({
+            'success': False,
+            'error': f'推送连接数已达上限 {ASYNC_STREAM_MAX_CLIENTS}'
+        }, 503)
+
+    targets, rejected = await stream_targets(names, codes)
+
+    stream_clients += 1
+    events = StreamQueue(maxsize=256)
+    core.subscribe_stream(targets, events)
+    reqlog.info(f"[推送连接] families={','.join(names)}, code数={len(codes)}", event='stream_open', route='/api/stream', families=names, codes=len(codes))
+
+    async def generate():
+        global stream_clients
+        try:
+            sent = {}  # (pool, table_name) → 已推送的行 ID
+            for item in rejected:
+                yield core.stream_event('error', item)
+            for pool in {key[0] for key in targets}:
+                tables = [key[1] for key in targets if key[0] == pool]
+                for table_name, item in (await get_latest_mapped_many(tables, pool=pool)).items():
+                    for family, code in targets[(pool, table_name)]:
+                        if isinstance(item, Exception):
+                            yield core.stream_event('error', {'family': family['name'], 'code': code, 'error': str(item)})
+                            continue
+                        entry = core.snapshot_store.get((pool, table_name))
+                        if entry is not None:
+                            sent[(pool, table_name)] = (entry['row'] or {}).get('ID')
+                            yield core.stream_event('data', core.stream_payload(family, code, table_name, entry))
+
+            while True:
+                try:
+                    key, entry = await asyncio.wait_for(events.get(), core.STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                row_id = (entry['row'] or {}).get('ID')
+                if key in sent and sent[key] == row_id:
+                    continue
+                sent[key] = row_id
+                for family, code in targets.get(key, ()):
+                    yield core.stream_event('data', core.stream_payload(family, code, key[1], entry))
+        finally:
+            # 客户端断开时协程被取消，在此注销订阅
+            core.unsubscribe_stream(targets, events)
+            stream_clients -= 1
+            reqlog.info(f"[推送断开] families={','.join(names)}, code数={len(codes)}", event='stream_close', route='/api/stream', families=names, codes=len(codes))
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# ========== 历史数据 ==========
+async def table_schema(pool, table_name):
+    """异步版 app.table_schema（与线程模式共用缓存）"""
+    key = (pool, table_name)
+    column_rows = core.cached_table_schema(key)
+    if column_rows is None:
+        column_rows = list(await fetch_all(pool, *core.table_columns_query(pool, [table_name])))
+        core.store_table_schema(key, column_rows)
+    return column_rows
+
+
+async def history(request):
+    """历史数据（与 app.history 相同的参数与输出格式），使用 aiomysql 的服务端游标"""
+    start_time = time.time()
+    args = request.query_params
+    family = core.TABLE_FAMILIES.get(args.get('family', ''))
+    code = args.get('code')
+
+    if family is None:
+        return json_response({
+            'success': False,
+            'error': f"未知的表族: {args.get('family', '')}"
+        }, 400)
+    if not code:
+        return json_response({
+            'success': False,
+            'error': '缺少 code 参数'
+        }, 400)
+
+    try:
+        params = core.parse_history_args(args)
+        table_name = await resolve_table(family, code)
+        time_column = None
+        if params['from_ts'] is not None or params['to_ts'] is not None:
+            time_column = core.pick_time_column(await table_schema(family['pool'], table_name))
+            if time_column is None:
+                raise ValueError(f"表没有时间字段，不支持按时间查询: {table_name}")
+    except (ValueError, core.TableNotFound) as e:
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, 404 if isinstance(e, core.TableNotFound) else 400)
+
+    pool = pools[family['pool']]
+    try:
+        connection = await checkout(family['pool'])
+    except Exception as e:
+        reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, 500)
+    cursor = await connection.cursor(metrics.metered_async_cursor(aiomysql.SSDictCursor, family['pool']))
+    try:
+        await cursor.execute(*core.history_query(family['pool'], table_name, params, time_column))
+    except Exception as e:
+        await cursor.close()
+        pool.release(connection)
+        reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+    writer = core.HistoryWriter(family, table_name, params)
+
+    async def generate():
+        try:
+            yield writer.head()
+            try:
+                while not writer.has_more:
+                    rows = await cursor.fetchmany(core.HISTORY_FETCH_SIZE)
+                    if not rows:
+                        break
+                    yield writer.rows(rows)
+            except Exception as e:
+                reqlog.error(f"[历史查询异常] code={code} - 错误: {str(e)}", event='history', route='/api/history', family=family['name'], code=code, error=str(e))
+                yield writer.tail(e)
+                return
+            yield writer.tail()
+        finally:
+            # 响应结束（含客户端断开）时释放游标与连接
+            try:
+                await cursor.close()
+            finally:
+                pool.release(connection)
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = core.log_phases()
+            reqlog.info(f"[历史查询] family={family['name']}, code={code}, 行数={writer.count}, 耗时: {elapsed:.2f}ms{phases}", event='history', route='/api/history', family=family['name'], code=code, rows=writer.count, elapsed_ms=round(elapsed, 2), **phase_fields)
+
+    return StreamingResponse(generate(), media_type=writer.mimetype)
+
+
+# ========== 趋势聚合 ==========
+async def trend(request):
+    """趋势聚合（与 app.trend 相同的参数与返回格式）"""
+    start_time = time.time()
+    args = request.query_params
+    family = core.TABLE_FAMILIES.get(args.get('family', ''))
+    code = args.get('code')
+
+    if family is None:
+        return json_response({
+            'success': False,
+            'error': f"未知的表族: {args.get('family', '')}"
+        }, 400)
+    if not code:
+        return json_response({
+            'success': False,
+            'error': '缺少 code 参数'
+        }, 400)
+
+    try:
+        params = core.parse_trend_args(args)
+        table_name = await resolve_table(family, code)
+        column_rows = await table_schema(family['pool'], table_name)
+        time_column = core.pick_time_column(column_rows)
+        if time_column is None:
+            raise ValueError(f"表没有时间字段，不支持趋势查询: {table_name}")
+        columns = core.resolve_trend_columns(table_name, column_rows, params['columns'], time_column)
+    except (ValueError, core.TableNotFound) as e:
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, 404 if isinstance(e, core.TableNotFound) else 400)
+
+    try:
+        if params['method'] == 'sql':
+            rows = await fetch_all(family['pool'], *core.trend_sql_query(family['pool'], table_name, time_column, columns, params))
+            data = core.trend_sql_series(columns, rows, params['bucket'])
+            raw_rows = sum(int(row['count_0'] or 0) for row in rows)
+        else:
+            sampler = core.TrendSampler(columns, params['points'])
+            async with acquire(family['pool']) as connection:
+                cursor = await connection.cursor(metrics.metered_async_cursor(aiomysql.SSDictCursor, family['pool']))
+                try:
+                    await cursor.execute(*core.trend_raw_query(family['pool'], table_name, time_column, columns, params))
+                    while True:
+                        rows = await cursor.fetchmany(core.HISTORY_FETCH_SIZE)
+                        if not rows:
+                            break
+                        sampler.add(rows)
+                finally:
+                    await cursor.close()
+            data = sampler.series()
+            raw_rows = sampler.rows
+    except ValueError as e:
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, 400)
+    except Exception as e:
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = core.log_phases()
+        reqlog.error(f"[趋势查询异常] code={code}, 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='trend', route='/api/trend', family=family['name'], code=code, status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+        return json_response({
+            'success': False,
+            'error': str(e),
+            'elapsed_ms': round(elapsed, 2)
+        }, 500)
+
+    elapsed = (time.time() - start_time) * 1000
+    points = sum(len(series) for series in data.values())
+    phases, phase_fields = core.log_phases()
+    reqlog.info(f"[趋势查询] family={family['name']}, code={code}, method={params['method']}, 原始行数={raw_rows}, 点数={points}, 耗时: {elapsed:.2f}ms{phases}", event='trend', route='/api/trend', family=family['name'], code=code, method=params['method'], rows=raw_rows, points=points, status=200, elapsed_ms=round(elapsed, 2), **phase_fields)
+    return json_response({
+        'success': True,
+        'method': params['method'],
+        'bucket': params['bucket'],
+        'columns': {display: column for column, display in columns},
+        'data': data,
+        'elapsed_ms': round(elapsed, 2)
+    })
+
+
+# ========== 其他接口 ==========
+async def load_home_inspection():
+    """异步版 app.load_home_inspection"""
+    async with acquire('mes') as connection:
+        async with connection.cursor() as cursor:
+            max_id = None
+            if core.HOME_INSPECTION_CACHE:
+                await cursor.execute(core.HOME_INSPECTION_PROBE_SQL)
+                max_id = ((await cursor.fetchone()) or {}).get('max_id')
+            if not core.home_inspection_needs_query(max_id):
+                return core.confirm_home_inspection()
+            await cursor.execute(core.HOME_INSPECTION_SQL)
+            return core.install_home_inspection(max_id, await cursor.fetchall())
+
+
+async def single_flight_home_inspection():
+    """首巡检查询的请求合并"""
+    async def load(keys):
+        return {'home_inspection': await load_home_inspection()}
+    return (await single_flight_many(['home_inspection'], load))['home_inspection']
+
+
+async def refresh_home_inspection():
+    """异步版 app.refresh_home_inspection"""
+    if core.home_inspection_state is None or time.time() - core.home_inspection_read_at > core.SNAPSHOT_IDLE_TTL:
+        return
+    try:
+        await single_flight_home_inspection()
+    except Exception as e:
+        reqlog.error(f"[首巡检刷新失败] 错误: {str(e)}", event='home_inspection_refresh', error=str(e))
+
+
+async def home_inspection(request):
+    """首页首巡检 MES系统数据（优先读取缓存，与 app.home_inspection 相同的返回格式）"""
+    start_time = time.time()
+    try:
+        state = core.cached_home_inspection() or await single_flight_home_inspection()
+        etag = core.home_inspection_etag(state)
+        if etag_matches(request, etag):
+            elapsed = (time.time() - start_time) * 1000
+            phases, phase_fields = core.log_phases()
+            reqlog.info(f"[未变化-MES] , 耗时: {elapsed:.2f}ms{phases}", event='home_inspection', route='/api/home_inspection', status=304, elapsed_ms=round(elapsed, 2), **phase_fields)
+            return Response(status_code=304, headers=cache_headers(etag, 1))
+
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = core.log_phases()
+        if state['data']:
+            reqlog.info(f"[查询成功-MES] , 耗时: {elapsed:.2f}ms{phases}, 记录数={state['rows']}", event='home_inspection', route='/api/home_inspection', status=200, elapsed_ms=round(elapsed, 2), rows=state['rows'], **phase_fields)
+        else:
+            reqlog.info(f"[无数据] , 耗时: {elapsed:.2f}ms{phases}", event='home_inspection', route='/api/home_inspection', status=200, elapsed_ms=round(elapsed, 2), rows=0, **phase_fields)
+        return json_response({
+            **core.home_inspection_body(state),
+            'elapsed_ms': round(elapsed, 2)
+        }, headers=cache_headers(etag, 1))
+
+    except Exception as e:
+        elapsed = (time.time() - start_time) * 1000
+        phases, phase_fields = core.log_phases()
+        reqlog.error(f"[查询异常] 耗时: {elapsed:.2f}ms{phases} - 错误: {str(e)}", event='home_inspection', route='/api/home_inspection', status=500, elapsed_ms=round(elapsed, 2), error=str(e), **phase_fields)
+        return json_response({
+            'success': False,
+            'error': str(e),
+            'elapsed_ms': round(elapsed, 2)
+        }, 500)
+
+
+async def details_inspection(request):
+    """详情页首巡检 模拟数据"""
+    return json_response({
+        'success': True,
+        'data': core.DETAILS_INSPECTION_DATA
+    })
+
+
+async def health_check(request):
+    return json_response({'status': 'ok'})
+
+
+async def pool_status(request):
+    """查看连接池状态（使用中/空闲/等待中的连接数与取连接等待时间分位数）"""
+    status = {}
+    for name in core.POOL_CONFIGS:
+        pool = pools.get(name)
+        status[f'pool_{name}'] = {
+            'status': 'running',
+            'in_use': pool.size - pool.freesize,
+            'idle': pool.freesize,
+            'waiting': checkout_waiting[name],
+            'size': pool.size,
+            'maxsize': pool.maxsize,
+            'wait_ms': pool_waits[name].percentiles()
+        } if pool else 'not_initialized'
+    status['ssh_tunnel'] = core.ssh_tunnel.status() if core.ssh_tunnel else ('not_initialized' if core.SSH_ENABLED else 'disabled')
+    if ignored_replicas():
+        status['replicas'] = {'supported': False, 'ignored': ignored_replicas()}
+    running = all(pools.get(name) for name in core.POOL_CONFIGS) and (
+        not core.SSH_ENABLED or core.ssh_tunnel and core.ssh_tunnel.is_active)
+    return json_response({
+        'status': 'running' if running else 'partial',
+        'pool_info': status
+    }, 200 if running else 503)
+
+
+async def mapping_status(request):
+    """查看参数映射版本"""
+    return json_response({
+        'success': True,
+        'version': core.mapping_version,
+        'checksum': core.mapping_checksum,
+        'loaded_at': core.mapping_loaded_at,
+        'code_count': len(core.code_name_map),
+        'variable_count': len(core.variable_name_map)
+    })
+
+
+async def mapping_reload(request):
+    """强制重新加载参数映射"""
+    if core.ADMIN_TOKEN and request.headers.get('X-Admin-Token') != core.ADMIN_TOKEN:
+        return json_response({
+            'success': False,
+            'error': '无权限'
+        }, 403)
+    start_time = time.time()
+    reloaded = await load_variable_name_map(force=True)
+    elapsed = (time.time() - start_time) * 1000
+    print(f"[映射重载] 版本: {core.mapping_version}, 耗时: {elapsed:.2f}ms")
+    return json_response({
+        'success': reloaded,
+        'version': core.mapping_version,
+        'code_count': len(core.code_name_map),
+        'variable_count': len(core.variable_name_map),
+        'elapsed_ms': round(elapsed, 2)
+    }, 200 if reloaded else 500)
+
+
+def pool_connections():
+    """连接池连接数（抓取 /metrics 时读取）"""
+    values = {}
+    for name, pool in pools.items():
+        values[(name, 'in_use')] = pool.size - pool.freesize
+        values[(name, 'idle')] = pool.freesize
+        values[(name, 'waiting')] = checkout_waiting[name]
+    return values
+
+
+metrics.POOL_CONNECTIONS.register(pool_connections)
+
+
+async def metrics_endpoint(request):
+    """Prometheus 指标"""
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+class MetricsMiddleware:
+    """按路由模板记录请求数、耗时与错误数（流式接口记录到开始输出为止）"""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.labels = {route.endpoint: route.path for route in routes}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        recorded = False
+        metrics.start_phases()
+
+        def record(status):
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                route = self.labels.get(scope.get('endpoint'), 'unmatched')
+                metrics.observe_request(route, scope['method'], status, time.perf_counter() - started)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                record(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            record(500)
+            raise
+
+
+class PollLimitMiddleware:
+    """请求频率限制，规则与 app.limit_poll_rate 相同：超限时返回 app.poll_limiter 中最近一次的成功响应"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = scope.get('path')
+        if (scope['type'] != 'http' or not core.RATE_LIMIT_ENABLED or route not in core.POLL_RATES
+                or scope['method'] == 'OPTIONS'):
+            await self.app(scope, receive, send)
+            return
+
+        # 先读出请求体取 code，再原样交给接口
+        request = Request(scope, receive)
+        body = await request.body()
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        try:
+            code = core.batch_poll_key(await get_batch_codes(request)) if route.endswith('/batch') else await get_code(request)
+        except Exception:
+            await self.app(scope, replay, send)  # 请求参数有误，交给接口返回错误
+            return
+
+        client = core.rate_limit_client(scope['client'][0] if scope.get('client') else None, request.headers)
+        entry = None
+        if not core.poll_limiter.allow(client, route, code):
+            entry = core.poll_limiter.cached(route, code)
+            metrics.RATE_LIMITED.inc(route=route, outcome='cached' if entry else 'passed')
+        if entry:
+            headers = core.rate_limited_headers(entry)
+            if entry[1] and etag_matches(request, entry[1]):
+                response = Response(status_code=304, headers=headers)
+            else:
+                response = Response(entry[0], headers=headers, media_type='application/json')
+            await response(scope, receive, send)
+            return
+
+        # 记录成功响应
+        status = None
+        chunks = []
+        headers = {}
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers.update((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in message.get('headers', []))
+            elif message['type'] == 'http.response.body' and status == 200:
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    etag = unquote_etag(headers['etag'])[0] if 'etag' in headers else None
+                    core.poll_limiter.store(route, code, b''.join(chunks), etag, headers.get('cache-control'))
+            await send(message)
+
+        await self.app(scope, replay, send_wrapper)
+
+
+def build_routes():
+    """按 app.TABLE_FAMILIES 生成表族接口，其余接口与 app.py 一一对应"""
+    routes = []
+    for family in core.TABLE_FAMILIES.values():
+        routes.append(Route(family['route'], serve_latest(family), methods=['GET', 'POST']))
+        routes.append(Route(f"{family['route']}/batch", batch_latest(family), methods=['GET', 'POST']))
+    routes += [
+        Route('/api/stream', stream, methods=['GET']),
+        Route('/api/history', history, methods=['GET']),
+        Route('/api/trend', trend, methods=['GET']),
+        Route('/api/home_inspection', home_inspection, methods=['GET', 'POST']),
+        Route('/api/details_inspection', details_inspection, methods=['GET', 'POST']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/pool/status', pool_status, methods=['GET']),
+        Route('/admin/mapping', mapping_status, methods=['GET']),
+        Route('/admin/mapping/reload', mapping_reload, methods=['POST'])
+    ]
+    return routes
+
+
+def build_middleware(routes):
+    """运行指标、跨域配置与请求频率限制；跨域与 app.py 一致：CORS_MODE='all' 允许所有来源，否则仅允许私有网段与本机"""
+    if core.CORS_MODE == 'all':
+        cors = {'allow_origins': ['*']}
+    else:
+        cors = {'allow_origin_regex': '|'.join(f'(?:{origin})' for origin in core.PRIVATE_ORIGINS)}
+    return [
+        Middleware(MetricsMiddleware, routes=routes),
+        Middleware(CORSMiddleware, allow_methods=['GET', 'POST', 'OPTIONS'], allow_headers=['*'], **cors),
+        Middleware(PollLimitMiddleware)
+    ]
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    """启动时建立连接池、加载映射与表目录并启动后台协程，退出时释放资源"""
+    await open_pools()
+    try:
+        await load_variable_name_map()
+        await load_table_catalog()
+        start_periodic('mapping-worker', core.MAPPING_REFRESH_INTERVAL, load_variable_name_map)
+        start_periodic('catalog-worker', core.CATALOG_REFRESH_INTERVAL, load_table_catalog)
+        if core.SNAPSHOT_ENABLED:
+            start_periodic('snapshot-worker', core.SNAPSHOT_INTERVAL, refresh_snapshots)
+            print(f"快照协程已启动 [刷新间隔: {core.SNAPSHOT_INTERVAL}s, 闲置淘汰: {core.SNAPSHOT_IDLE_TTL}s]")
+        if core.HOME_INSPECTION_CACHE:
+            start_periodic('home-inspection-worker', core.HOME_INSPECTION_INTERVAL, refresh_home_inspection)
+        yield
+    finally:
+        await close_pools()
+
+
+routes = build_routes()
+asgi_app = Starlette(routes=routes, middleware=build_middleware(routes), lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    print("正在启动 uvicorn 服务器（异步模式）...")
+    print(f"服务地址: http://0.0.0.0:{ASYNC_PORT}")
+    print("按 Ctrl+C 停止服务")
+    uvicorn.run(asgi_app, host='0.0.0.0', port=ASYNC_PORT, log_level='warning')
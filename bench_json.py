@@ -0,0 +1,89 @@
+import time
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import app, OrjsonProvider, orjson
+
+# JSON 序列化对比：Flask 默认 jsonify 与 orjson
+# 用法：python bench_json.py（BENCH_COLUMNS 为每行字段数，BENCH_BATCH 为批量接口的 code 数）
+COLUMNS = int(os.getenv('BENCH_COLUMNS', '200'))
+BATCH = int(os.getenv('BENCH_BATCH', '50'))
+ITERATIONS = int(os.getenv('BENCH_ITERATIONS', '2000'))
+
+
+def quality_row(seed):
+    """模拟 dms_device_qualityparams_* 的宽行（映射后）：数值、Decimal、检验结果与时间字段混合"""
+    row = {}
+    for i in range(COLUMNS):
+        kind = i % 5
+        if kind == 0:
+            row[f"内径测量值{i}"] = Decimal(f"{17 + seed % 7 * 0.0001:.4f}")
+        elif kind == 1:
+            row[f"圆度{i}"] = 0.0012 + i * 1e-6
+        elif kind == 2:
+            row[f"检验{i}结果"] = "合格" if (i + seed) % 7 else "不合格"
+        elif kind == 3:
+            row[f"累计数量{i}"] = seed * 10 + i
+        else:
+            row[f"采集时间{i}"] = datetime(2024, 1, 1, 8, 0, seed % 60)
+    return row
+
+
+def single_payload():
+    return {
+        'success': True,
+        'data': quality_row(1),
+        'snapshot_at': 1704096000.123,
+        'snapshot_age_ms': 12.5,
+        'elapsed_ms': 0.42
+    }
+
+
+def batch_payload():
+    return {
+        'success': True,
+        'data': {f"code{n}": {'success': True, 'data': quality_row(n)} for n in range(BATCH)},
+        'elapsed_ms': 1.5
+    }
+
+
+def measure(provider, payload):
+    """返回 (每次耗时 μs, 响应体字节数)"""
+    with app.app_context():
+        body = provider.response(payload).get_data()
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            provider.response(payload).get_data()
+        elapsed = time.perf_counter() - start
+    return elapsed / ITERATIONS * 1e6, len(body), body
+
+
+def main():
+    if orjson is None:
+        print("未安装 orjson：pip install orjson")
+        return
+
+    providers = {
+        'jsonify': DefaultJSONProvider(app),
+        'orjson': OrjsonProvider(app)
+    }
+    print("=" * 80)
+    print(f"JSON 序列化对比  字段数: {COLUMNS}, 批量 code 数: {BATCH}, 迭代次数: {ITERATIONS}")
+    print("=" * 80)
+    print(f"{'场景':<10}{'序列化':<10}{'耗时(μs)':>12}{'字节数':>10}{'加速比':>8}")
+    for name, payload in (('单设备', single_payload()), ('批量', batch_payload())):
+        results = {key: measure(provider, payload) for key, provider in providers.items()}
+        # 两种序列化的解析结果必须一致
+        assert json.loads(results['jsonify'][2]) == json.loads(results['orjson'][2])
+        base = results['jsonify'][0]
+        for key, (per_call, size, _) in results.items():
+            print(f"{name:<10}{key:<10}{per_call:>12.1f}{size:>10}{base / per_call:>8.2f}")
+    print("=" * 80)
+
+
+if __name__ == '__main__':
+    main()
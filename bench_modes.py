@@ -0,0 +1,95 @@
+import requests
+import time
+import os
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 对比 waitress 线程模式（python app.py）与异步模式（python async_app.py）
+# 两种模式需启动在不同端口，例如：
+#   python app.py                       # 5000
+#   ASYNC_PORT=5001 python async_app.py  # 5001
+#   python bench_modes.py
+# 地址可通过 WAITRESS_URL / ASYNC_URL 修改
+MODES = {
+    'waitress': os.getenv('WAITRESS_URL', 'http://localhost:5000'),
+    'async': os.getenv('ASYNC_URL', 'http://localhost:5001')
+}
+CODE = os.getenv('BENCH_CODE', '07_4_3mz2010')
+PATHS = ['/api/process_data', '/api/efficiency_data']
+REQUESTS_PER_MODE = int(os.getenv('BENCH_REQUESTS', '2000'))
+CONCURRENCY = [int(c) for c in os.getenv('BENCH_CONCURRENCY', '16,64,256').split(',')]
+
+
+def timed_get(session, url):
+    """发送单个请求，返回 (耗时秒数, 是否成功)"""
+    start = time.time()
+    try:
+        response = session.get(url, params={'code': CODE}, timeout=30)
+        return time.time() - start, response.status_code == 200
+    except Exception:
+        return time.time() - start, False
+
+
+def percentile(values, p):
+    """values 已排序"""
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(base_url, concurrency):
+    """以 concurrency 个并发连接发送 REQUESTS_PER_MODE 个请求"""
+    urls = [f"{base_url}{PATHS[i % len(PATHS)]}" for i in range(REQUESTS_PER_MODE)]
+    # 每个工作线程一个 Session，复用 keep-alive 连接
+    local = threading.local()
+
+    def task(url):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return timed_get(local.session, url)
+
+    total_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(task, urls))
+    total = time.time() - total_start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    return {
+        'qps': len(results) / total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'mean': statistics.mean(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+
+def main():
+    print("=" * 80)
+    print("服务模式对比测试")
+    print("=" * 80)
+    for mode, url in MODES.items():
+        print(f"{mode:<10} {url}")
+    print(f"Code: {CODE}, 每轮请求数: {REQUESTS_PER_MODE}, 并发数: {CONCURRENCY}")
+    print("=" * 80)
+    print(f"{'模式':<10}{'并发':>6}{'QPS':>10}{'错误':>6}{'平均(ms)':>10}{'P50':>9}{'P95':>9}{'P99':>9}")
+
+    for concurrency in CONCURRENCY:
+        for mode, url in MODES.items():
+            try:
+                requests.get(f"{url}/health", timeout=5)
+            except Exception as e:
+                print(f"{mode:<10}{concurrency:>6}  服务不可用: {str(e)}")
+                continue
+            # 预热：让快照登记该 code
+            session = requests.Session()
+            for path in PATHS:
+                timed_get(session, f"{url}{path}")
+            r = run(url, concurrency)
+            print(f"{mode:<10}{concurrency:>6}{r['qps']:>10.1f}{r['errors']:>6}"
+                  f"{r['mean']:>10.2f}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['p99']:>9.2f}")
+    print("=" * 80)
+
+
+if __name__ == '__main__':
+    main()
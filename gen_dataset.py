@@ -0,0 +1,260 @@
+import pymysql
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# 模拟数据生成：在本机 MySQL 中建立与生产库结构一致的 SCADA（iplantute）与 MES（ute_mes_qms_new）库，
+# 用于离线压测（app.py / async_app.py 以 DB_TARGET=local 直连，无需 SSH）
+#   python gen_dataset.py --devices 45 --rows 100000                  # 直接写入本机 MySQL
+#   python gen_dataset.py --devices 45 --rows 1000000 --output ute.sql  # 只生成 SQL 文件：mysql -uroot < ute.sql
+# 同一 --seed / --end 生成的数据完全相同，便于前后对比（时间戳以 --end 为终点，默认固定值，不随运行时间变化）
+SCADA_DATABASE = 'iplantute'
+MES_DATABASE = 'ute_mes_qms_new'
+MODELS = ['3mz2010', 'lxng_da30', '3mk2110', 'mz208', '3mz1420']
+
+RESULTS = ['合格'] * 17 + ['返工'] * 2 + ['报废']
+
+DEFAULT_END = '2024-08-01 00:00:00'  # 设备表与 MES 表最后一行的时间；now 表示当前时间（数据随运行时间变化）
+
+
+def end_time(value):
+    """解析 --end：固定时间（YYYY-MM-DD HH:MM:SS）或 now"""
+    if value == 'now':
+        return datetime.now().replace(microsecond=0)
+    try:
+        return datetime.fromisoformat(value).replace(microsecond=0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}（格式 YYYY-MM-DD HH:MM:SS 或 now）")
+
+
+def drift(base, spread):
+    """围绕 base 小幅波动的数值"""
+    return lambda rng, i: round(base + rng.uniform(-spread, spread), 4)
+
+
+def constant(value):
+    return lambda rng, i: value
+
+
+def counter(start, step):
+    """随行号递增的累计值"""
+    return lambda rng, i: start + i * step + rng.randint(0, step)
+
+
+def result(rng, i):
+    return rng.choice(RESULTS)
+
+
+# 参数定义：(显示名, SQL 类型, 取值函数)；显示名与文档返回示例一致
+TECHNOLOGY_PARAMS = [
+    ('加工方式', 'INT', constant(101)), ('砂轮序号', 'INT', constant(51)), ('砂轮线速度', 'DOUBLE', constant(30.0)),
+    ('砂轮轴转速', 'DOUBLE', drift(23885, 50)), ('新砂轮直径', 'DOUBLE', constant(28.0)), ('砂轮最小直径', 'DOUBLE', constant(20.0)),
+    ('砂轮修整宽度', 'DOUBLE', constant(25.0)), ('修整速度', 'DOUBLE', constant(500.0)), ('修整间隔', 'DOUBLE', constant(4.0)),
+    ('新砂轮修整量', 'DOUBLE', constant(1.3)), ('X轴新砂轮修整量', 'DOUBLE', constant(0.005)), ('X轴修整跳进量', 'DOUBLE', drift(18.937, 0.01)),
+    ('新砂轮X轴起始加工位', 'DOUBLE', constant(0.0)), ('磨架原位', 'DOUBLE', constant(0.0)), ('磨架中位', 'DOUBLE', constant(0.0)),
+    ('磨架到位', 'DOUBLE', constant(145.45)), ('工件轴转速', 'DOUBLE', constant(350.0)), ('进给轮倍率', 'DOUBLE', constant(1.0)),
+    ('进给补偿', 'DOUBLE', constant(0.001)), ('粗磨1速度', 'DOUBLE', constant(0.07)), ('粗磨1量', 'DOUBLE', constant(0.05)),
+    ('粗磨2速度', 'DOUBLE', constant(0.05)), ('粗磨2量', 'DOUBLE', constant(0.03)), ('精磨速度', 'DOUBLE', constant(0.03)),
+    ('精磨量', 'DOUBLE', constant(0.01)), ('粗回跳量', 'DOUBLE', constant(0.0)), ('精回跳量', 'DOUBLE', constant(0.0)),
+    ('光磨速度', 'DOUBLE', constant(0.01)), ('光磨量', 'DOUBLE', constant(0.005)), ('光磨延时', 'DOUBLE', constant(0.5)),
+    ('快速速率', 'DOUBLE', constant(15.0)), ('快速量', 'DOUBLE', constant(0.21)), ('快速倍率', 'DOUBLE', constant(0.0)),
+    ('快进速度', 'DOUBLE', constant(350.0)), ('快进量', 'DOUBLE', constant(3.12)), ('振动速度', 'DOUBLE', constant(400.0)),
+    ('振动距离', 'DOUBLE', constant(1.3)), ('沟位补偿', 'DOUBLE', constant(0.001)), ('上下料位置', 'DOUBLE', constant(2.0)),
+]
+
+WORKPARAMS_PARAMS = [
+    ('RecordID', 'INT', counter(1, 1)), ('X轴起始加工位', 'DOUBLE', drift(2.005, 0.001)), ('Z轴起始修整位', 'DOUBLE', constant(25.0)),
+    ('上料等待时长', 'DOUBLE', drift(0.8, 0.1)), ('下料等待时长', 'DOUBLE', drift(0.7, 0.1)), ('修整耗时', 'DOUBLE', drift(0.9, 0.05)),
+    ('光磨时长', 'DOUBLE', drift(10, 0.5)), ('快速趋近时长', 'DOUBLE', drift(0.86, 0.05)), ('快进时长', 'DOUBLE', drift(2.8, 0.1)),
+    ('粗磨1时长', 'DOUBLE', drift(7.9, 0.3)), ('粗磨2时长', 'DOUBLE', drift(0.04, 0.01)), ('精磨时长', 'DOUBLE', drift(4.9, 0.2)),
+    ('退刀时长', 'DOUBLE', drift(2.37, 0.1)), ('有效磨削开始时间', 'DATETIME', None), ('有效磨削时长', 'DOUBLE', drift(23, 1)),
+    ('磨削总量', 'DOUBLE', drift(3.44, 0.2)), ('砂轮修整序号', 'INT', counter(1, 0)), ('砂轮现在直径', 'DOUBLE', drift(24, 2)),
+]
+
+QUALITY_PARAMS = [
+    ('上截面圆度', 'DOUBLE', drift(2, 1.5)), ('上截面圆度结果', 'VARCHAR(8)', result),
+    ('上截面尺寸', 'DOUBLE', drift(-14, 2)), ('上截面尺寸结果', 'VARCHAR(8)', result),
+    ('下截面圆度', 'DOUBLE', drift(4, 1.5)), ('下截面圆度结果', 'VARCHAR(8)', result),
+    ('下截面尺寸', 'DOUBLE', drift(-16, 2)), ('下截面尺寸结果', 'VARCHAR(8)', result),
+    ('内径测量总数量', 'INT', counter(100000, 3)), ('内径合格总数量', 'INT', counter(88000, 2)),
+    ('内径合格率', 'DOUBLE', drift(88, 2)), ('预检不合格数量', 'INT', counter(200, 0)),
+    ('尺寸返工总数量', 'INT', counter(7800, 0)), ('尺寸报废总数量', 'INT', counter(11600, 0)),
+    ('圆度返工总数量', 'INT', counter(0, 0)), ('锥度返工总数量', 'INT', counter(2500, 0)), ('设备状态', 'INT', constant(27)),
+]
+
+# 表族：(表名前缀, 参数前缀, 参数定义)
+FAMILIES = [
+    ('dms_device_technology_', 'T', TECHNOLOGY_PARAMS),
+    ('dms_device_workparams_', 'W', WORKPARAMS_PARAMS),
+    ('dms_device_qualityparams_', 'Q', QUALITY_PARAMS),
+]
+
+
+def device_codes(count):
+    """生成与生产环境格式一致的设备 code（如 07_4_3mz2010）"""
+    codes = []
+    for n in range(count):
+        codes.append(f"{n // 8 + 1:02d}_{n % 8 + 1}_{MODELS[n % len(MODELS)]}{'' if n < len(MODELS) else f'_{n}'}")
+    return codes
+
+
+def family_columns(prefix, params, extra_columns):
+    """返回 [(字段名, SQL 类型, 取值函数, Code, VariableName, 显示名)]
+    字段名交替使用 Code 与 VariableName，覆盖映射的两条路径；extra_columns 个字段不在参数表中（未映射字段）"""
+    columns = []
+    for i, (name, sql_type, value) in enumerate(params, 1):
+        code = f"{prefix}{i:03d}"
+        variable = f"{prefix}Var{i:03d}"
+        columns.append((code if i % 2 else variable, sql_type, value, code, variable, name))
+    for i in range(extra_columns):
+        columns.append((f"{prefix}Reserved{i + 1:03d}", 'DOUBLE', drift(0, 1), None, None, None))
+    return columns
+
+
+def create_table_sql(database, table_name, columns):
+    definitions = ['`ID` BIGINT NOT NULL AUTO_INCREMENT', '`RecordTime` DATETIME NOT NULL']
+    definitions.extend(f"`{column}` {sql_type} NULL" for column, sql_type, *_ in columns)
+    definitions.extend(['PRIMARY KEY (`ID`)', 'KEY `idx_record_time` (`RecordTime`)'])
+    return (f"CREATE TABLE `{database}`.`{table_name}` (\n  " + ',\n  '.join(definitions) +
+            "\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+
+
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        return f"'{value:%Y-%m-%d %H:%M:%S}'"
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+class Sink:
+    """写入目标：直接执行（pymysql）或写入 SQL 文件"""
+
+    def __init__(self, args):
+        self.output = open(args.output, 'w', encoding='utf-8') if args.output else None
+        self.connection = None
+        if not self.output:
+            self.connection = pymysql.connect(host=args.host, port=args.port, user=args.user,
+                                              password=args.password, charset='utf8mb4', autocommit=False)
+
+    def execute(self, sql):
+        if self.output:
+            self.output.write(sql + ';\n')
+        else:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql)
+
+    def commit(self):
+        if self.connection:
+            self.connection.commit()
+
+    def close(self):
+        if self.output:
+            self.output.close()
+        if self.connection:
+            self.connection.close()
+
+
+def insert_rows(sink, database, table_name, names, rows, batch_size):
+    """多行 INSERT，每 batch_size 行一条语句"""
+    head = f"INSERT INTO `{database}`.`{table_name}` (" + ', '.join(f"`{n}`" for n in names) + ") VALUES "
+    for i in range(0, len(rows), batch_size):
+        values = ','.join('(' + ','.join(sql_literal(v) for v in row) + ')' for row in rows[i:i + batch_size])
+        sink.execute(head + values)
+    sink.commit()
+
+
+def generate_scada(sink, args, rng, codes):
+    sink.execute(f"CREATE DATABASE IF NOT EXISTS `{SCADA_DATABASE}` DEFAULT CHARSET utf8mb4")
+
+    # 参数映射表
+    sink.execute(f"DROP TABLE IF EXISTS `{SCADA_DATABASE}`.`dms_device_parameter`")
+    sink.execute(
+        f"CREATE TABLE `{SCADA_DATABASE}`.`dms_device_parameter` (\n"
+        "  `ID` INT NOT NULL AUTO_INCREMENT,\n  `Code` VARCHAR(64) NULL,\n  `VariableName` VARCHAR(64) NULL,\n"
+        "  `Name` VARCHAR(64) NULL,\n  PRIMARY KEY (`ID`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    )
+    families = [(table_prefix, family_columns(prefix, params, args.extra_columns)) for table_prefix, prefix, params in FAMILIES]
+    parameter_rows = [(code, variable, name) for _, columns in families for *_, code, variable, name in columns if name]
+    insert_rows(sink, SCADA_DATABASE, 'dms_device_parameter', ['Code', 'VariableName', 'Name'], parameter_rows, args.batch_size)
+
+    start = args.end - timedelta(seconds=args.interval * (args.rows - 1))
+    for index, device in enumerate(codes):
+        started = time.time()
+        for table_prefix, columns in families:
+            table_name = f"{table_prefix}{device}"
+            sink.execute(f"DROP TABLE IF EXISTS `{SCADA_DATABASE}`.`{table_name}`")
+            sink.execute(create_table_sql(SCADA_DATABASE, table_name, columns))
+            names = ['RecordTime'] + [column for column, *_ in columns]
+            for offset in range(0, args.rows, args.chunk_rows):
+                rows = []
+                for i in range(offset, min(args.rows, offset + args.chunk_rows)):
+                    recorded = start + timedelta(seconds=args.interval * i)
+                    rows.append([recorded] + [value(rng, i) if value else recorded - timedelta(seconds=23)
+                                              for _, _, value, *_ in columns])
+                insert_rows(sink, SCADA_DATABASE, table_name, names, rows, args.batch_size)
+        elapsed = time.time() - started
+        print(f"[{index + 1}/{len(codes)}] {device}: {len(families)} 张表 × {args.rows} 行, 耗时: {elapsed:.1f}s")
+
+
+def generate_mes(sink, args, rng):
+    sink.execute(f"CREATE DATABASE IF NOT EXISTS `{MES_DATABASE}` DEFAULT CHARSET utf8mb4")
+    sink.execute(f"DROP TABLE IF EXISTS `{MES_DATABASE}`.`t_qms_sj_taskiptitem`")
+    sink.execute(
+        f"CREATE TABLE `{MES_DATABASE}`.`t_qms_sj_taskiptitem` (\n"
+        "  `id` BIGINT NOT NULL AUTO_INCREMENT,\n  `ftaskid` BIGINT NULL,\n  `fitemname` VARCHAR(64) NULL,\n"
+        "  `fqty_bad` INT NULL,\n  `fqty_good` INT NULL,\n  `type` VARCHAR(16) NULL,\n  `fcreatetime` DATETIME NULL,\n"
+        "  PRIMARY KEY (`id`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    )
+    rows = []
+    for i in range(args.mes_rows):
+        bad = rng.choice([0] * 8 + [1, 2])
+        rows.append([i // 3 + 1, rng.choice(['内径', '圆度', '锥度', '外观']), bad, rng.randint(3, 5) - bad,
+                     rng.choice(['首检', '巡检', '末检']), args.end - timedelta(minutes=10 * (args.mes_rows - i))])
+    insert_rows(sink, MES_DATABASE, 't_qms_sj_taskiptitem',
+                ['ftaskid', 'fitemname', 'fqty_bad', 'fqty_good', 'type', 'fcreatetime'], rows, args.batch_size)
+    print(f"MES: t_qms_sj_taskiptitem {args.mes_rows} 行")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成与生产库结构一致的模拟数据')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--output', help='只生成 SQL 文件，不连接数据库')
+    parser.add_argument('--devices', type=int, default=45, help='设备数（每台设备 3 张表）')
+    parser.add_argument('--rows', type=int, default=100000, help='每张设备表的行数')
+    parser.add_argument('--interval', type=float, default=10, help='相邻两行的时间间隔（秒）')
+    parser.add_argument('--extra-columns', type=int, default=0, help='每张设备表额外增加的未映射字段数（模拟宽表）')
+    parser.add_argument('--mes-rows', type=int, default=10000, help='t_qms_sj_taskiptitem 行数')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每条 INSERT 的行数')
+    parser.add_argument('--chunk-rows', type=int, default=50000, help='每次在内存中生成的行数')
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--end', type=end_time, default=DEFAULT_END, help=f'最后一行的时间（默认 {DEFAULT_END}；now 为当前时间）')
+    parser.add_argument('--codes-out', default='codes.txt', help='设备 code 列表输出文件（供 test_api.py --codes-file 使用）')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    codes = device_codes(args.devices)
+    sink = Sink(args)
+    started = time.time()
+    try:
+        generate_scada(sink, args, rng, codes)
+        generate_mes(sink, args, rng)
+    finally:
+        sink.close()
+    with open(args.codes_out, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(codes) + '\n')
+    print("=" * 60)
+    print(f"完成：{args.devices} 台设备，{args.devices * len(FAMILIES)} 张设备表，每张 {args.rows} 行，耗时: {time.time() - started:.1f}s")
+    print(f"设备 code 已写入 {args.codes_out}")
+    print("启动服务：DB_TARGET=local python app.py")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""运行指标：以 Prometheus 文本格式在 /metrics 输出（不依赖 prometheus_client）
+
+两种服务模式（app.py / async_app.py）共用同一组指标：
+* 接口：请求数、耗时直方图、错误数（按路由模板统计，避免按 code 产生大量标签）
+* 数据库：语句执行耗时、从连接池取连接的等待时间、返回的行数与字段数
+* SSH 隧道：是否连通（抓取时由服务注册的回调读取）
+* 单次请求的分阶段耗时（取连接等待、SQL 执行、映射、序列化）：与上述指标在同一处测量，按请求累计后写入请求日志
+
+多进程模式（prefork.py）下指标按进程统计，/metrics 返回处理该请求的工作进程的指标（带 pid 标签的 ute_process_info 标明进程）
+"""
+import contextvars
+import os
+import threading
+import time
+from functools import lru_cache
+
+# 默认耗时分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """指标基类：labels 为标签名元组，同一组标签值对应一个时间序列"""
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """瞬时值：可直接 set，也可注册回调在抓取时读取（回调返回 {标签值元组: 数值}）
+
+    每次抓取先清除上次由回调得到的序列再重新填充，已消失的标签（如移除的副本、关闭的转发）不再输出。
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._callbacks = []
+        self._callback_keys = set()  # 上次抓取时由回调得到的标签值元组
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def register(self, callback):
+        self._callbacks.append(callback)
+
+    def render(self):
+        if self._callbacks:
+            values = {}
+            for callback in self._callbacks:
+                try:
+                    values.update(callback())
+                except Exception:
+                    continue
+            with self._lock:
+                for key in self._callback_keys:
+                    self._values.pop(key, None)
+                self._values.update(values)
+                self._callback_keys = set(values)
+        return super().render()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [各桶计数（非累计）..., +Inf 桶计数, 总和]
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), series):
+            cumulative += count
+            labels = _format_labels(self.labels, key, (('le', _format_value(float(bound))),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render():
+    """全部指标的 Prometheus 文本"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _after_fork():
+    """fork 出的子进程（多进程模式的工作进程）：重建各指标的锁，fork 时其他线程可能正持有"""
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# ========== 指标定义 ==========
+REQUESTS = Counter('ute_http_requests_total', '接口请求数', ('route', 'method', 'status'))
+REQUEST_ERRORS = Counter('ute_http_request_errors_total', '接口错误数（状态码 >= 500）', ('route',))
+REQUEST_LATENCY = Histogram('ute_http_request_duration_seconds', '接口耗时（秒，流式接口为开始输出前的耗时）', ('route',))
+
+DB_EXECUTE = Histogram('ute_db_execute_duration_seconds', 'SQL 语句执行耗时（秒）', ('pool',))
+DB_ERRORS = Counter('ute_db_execute_errors_total', 'SQL 语句执行失败数', ('pool',))
+DB_ROWS = Counter('ute_db_rows_total', '查询返回的行数', ('pool',))
+DB_FIELDS = Counter('ute_db_fields_total', '查询返回的字段数（行数 × 每行字段数）', ('pool',))
+POOL_WAIT = Histogram('ute_db_pool_wait_seconds', '从连接池取得连接的等待时间（秒）', ('pool',))
+POOL_CONNECTIONS = Gauge('ute_db_pool_connections', '连接池连接数（state: in_use 使用中, idle 空闲, waiting 等待中）', ('pool', 'state'))
+
+TUNNEL_UP = Gauge('ute_ssh_tunnel_up', 'SSH 隧道是否连通（1 连通，0 断开）', ('tunnel',))
+DB_ENDPOINT_UP = Gauge('ute_db_endpoint_up', '数据库端点是否在线（1 在线，0 故障或尚未检查；role: primary 主库, replica 副本）', ('endpoint', 'role'))
+DB_REPLICA_LAG = Gauge('ute_db_replica_lag_seconds', '副本的复制延迟（秒）', ('endpoint',))
+
+RATE_LIMITED = Counter('ute_rate_limited_total', '超过请求频率的请求数（outcome: cached 返回缓存的响应, passed 尚无缓存、照常处理）', ('route', 'outcome'))
+PROCESS_INFO = Gauge('ute_process_info', '处理本次抓取的进程（role: single 单进程, worker 工作进程；worker 为工作进程序号）', ('pid', 'role', 'worker'))
+
+
+# 本次请求的分阶段耗时 {阶段: 秒}：处理请求的线程（或协程）内累计，后台线程与其他请求的查库不计入
+_phases = contextvars.ContextVar('ute_request_phases', default=None)
+PHASES = ('pool_wait', 'query', 'map', 'serialize')
+
+
+def start_phases():
+    """开始记录本次请求的分阶段耗时（请求开始时调用）"""
+    _phases.set({})
+
+
+def add_phase(name, seconds):
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+def request_phases():
+    """本次请求已记录的分阶段耗时 {阶段_ms: 毫秒}，按 PHASES 顺序"""
+    phases = _phases.get() or {}
+    return {f"{name}_ms": round(phases[name] * 1000, 2) for name in PHASES if name in phases}
+
+
+def observe_request(route, method, status, seconds):
+    """记录一次接口请求"""
+    REQUESTS.inc(route=route, method=method, status=str(status))
+    REQUEST_LATENCY.observe(seconds, route=route)
+    if status >= 500:
+        REQUEST_ERRORS.inc(route=route)
+
+
+class CursorMetrics:
+    """游标计数：逐行累计在游标上，关闭游标时一次性写入指标，避免每行加锁"""
+    pool = None
+    _metrics_rows = 0
+    _metrics_fields = 0
+
+    def _conv_row(self, row):
+        row = super()._conv_row(row)
+        if row is not None:
+            self._metrics_rows += 1
+            self._metrics_fields += len(row)
+        return row
+
+    def _metrics_flush(self):
+        if self._metrics_rows:
+            DB_ROWS.inc(self._metrics_rows, pool=self.pool)
+            DB_FIELDS.inc(self._metrics_fields, pool=self.pool)
+        self._metrics_rows = 0
+        self._metrics_fields = 0
+
+
+@lru_cache(maxsize=None)
+def metered_cursor(base, pool):
+    """为 pymysql 游标类（DictCursor / SSDictCursor）生成带计时与计数的子类"""
+    class MeteredCursor(CursorMetrics, base):
+        def execute(self, query, args=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, args)
+            except Exception:
+                DB_ERRORS.inc(pool=self.pool)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                DB_EXECUTE.observe(elapsed, pool=self.pool)
+                add_phase('query', elapsed)
+
+        def close(self):
+            try:
+                super().close()
+            finally:
+                self._metrics_flush()
+
+    MeteredCursor.pool = pool
+    MeteredCursor.__name__ = f"Metered{base.__name__}"
+    return MeteredCursor
+
+
+@lru_cache(maxsize=None)
+def metered_async_cursor(base, pool):
+    """为 aiomysql 游标类生成带计时与计数的子类"""
+    class MeteredCursor(CursorMetrics, base):
+        async def execute(self, query, args=None):
+            started = time.perf_counter()
+            try:
+                return await super().execute(query, args)
+            except Exception:
+                DB_ERRORS.inc(pool=self.pool)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                DB_EXECUTE.observe(elapsed, pool=self.pool)
+                add_phase('query', elapsed)
+
+        async def close(self):
+            try:
+                await super().close()
+            finally:
+                self._metrics_flush()
+
+    MeteredCursor.pool = pool
+    MeteredCursor.__name__ = f"Metered{base.__name__}"
+    return MeteredCursor
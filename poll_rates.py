@@ -0,0 +1,15 @@
+# 文档约定的各接口请求频率（每个客户端每个 code，次/秒）
+# 服务端（app.py 的频率限制与 Cache-Control max-age）与压测客户端（test_api.py）共用；
+# 本模块不依赖服务端代码与第三方库，压测机只需 test_api.py 与本文件
+POLL_RATES = {
+    '/api/process_data': 1,
+    '/api/efficiency_data': 1,
+    '/api/detailed_online_inspection': 0.1,
+    '/api/home_online_inspection': 0.1,
+    '/api/home_inspection': 1,
+}
+
+
+def poll_rate(route):
+    """接口的约定频率，批量接口（{route}/batch）与对应单设备接口相同；未登记的接口返回 None"""
+    return POLL_RATES.get(route[:-len('/batch')] if route.endswith('/batch') else route)
@@ -0,0 +1,316 @@
+"""多进程模式：主进程预先 fork 多个工作进程，共用同一个监听端口
+
+* 单进程 + 32 线程时，JSON 序列化、字段映射与汇总都在争抢 GIL，只能用到一个 CPU 核
+* 主进程建立监听 socket（SSH 隧道也只在主进程建立一次，见 app.run_prefork），fork PREFORK_WORKERS 个工作进程；
+  工作进程异常退出后按指数退避重新 fork，收到 SIGTERM / SIGINT 时通知工作进程退出，超时后强制结束
+* 工作进程各自建立连接池、快照与后台线程，经主进程的隧道转发端口访问数据库
+* 可选的刷新进程（refresher）：不处理请求，由主进程与工作进程一样监控、重启，见 app.run_refresher
+* 各进程每 PREFORK_STATUS_INTERVAL 秒把状态写入状态目录（一个进程一个 JSON 文件），
+  任一工作进程处理 /health 与 /pool/status 时读取并汇总所有进程的状态
+"""
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+PREFORK_WORKERS = os.getenv('PREFORK_WORKERS', '0')                      # 工作进程数：0 单进程（默认），'auto' 为 CPU 核数
+PREFORK_WORKERS = (os.cpu_count() or 1) if PREFORK_WORKERS == 'auto' else int(PREFORK_WORKERS)
+PREFORK_STATUS_INTERVAL = float(os.getenv('PREFORK_STATUS_INTERVAL', '1'))      # 状态写入间隔（秒）
+PREFORK_RESTART_MAX_DELAY = float(os.getenv('PREFORK_RESTART_MAX_DELAY', '30'))  # 连续崩溃时重启退避上限（秒）
+PREFORK_GRACEFUL_TIMEOUT = float(os.getenv('PREFORK_GRACEFUL_TIMEOUT', '10'))    # 退出时等待工作进程的时长（秒）
+PREFORK_STABLE_UPTIME = 60  # 运行超过该时长（秒）后退出视为偶发，退避重新从 1 秒开始
+REFRESHER = 'refresher'     # 刷新进程的序号（同时是其状态文件名）
+CHILD_SIGNALS = (signal.SIGUSR1, signal.SIGUSR2)  # 发给子进程的通知信号：fork 前屏蔽，子进程登记处理函数并完成初始化后解除
+
+role = None          # None 单进程，'master' 主进程，'worker' 工作进程，'refresher' 刷新进程
+worker_index = None  # 工作进程序号（重启后不变），刷新进程为 REFRESHER
+status_dir = None
+master_pid = None
+
+
+def write_status(name, payload):
+    """原子地写入一个进程的状态文件"""
+    path = os.path.join(status_dir, f"{name}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({**payload, 'pid': os.getpid(), 'updated_at': time.time()}, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def status_name(index):
+    return REFRESHER if index == REFRESHER else f"worker-{index}"
+
+
+def read_status(name):
+    if status_dir is None:
+        return None
+    try:
+        with open(os.path.join(status_dir, f"{name}.json"), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_alive(master, index):
+    """读取子进程状态：只返回主进程登记过、且最近写过状态的进程，否则返回 None"""
+    status = read_status(status_name(index))
+    if status and str(status['pid']) in master['children'] and status['updated_at'] >= time.time() - PREFORK_STATUS_INTERVAL * 3:
+        return status
+    return None
+
+
+def read_statuses():
+    """返回 (主进程状态, [存活工作进程状态])"""
+    master = read_status('master')
+    if master is None:
+        return None, []
+    workers = [read_alive(master, index) for index in range(master['workers'])]
+    return master, [status for status in workers if status]
+
+
+def signal_siblings(signum):
+    """向主进程的其他子进程（工作进程与刷新进程）发送信号"""
+    master = read_status('master')
+    for pid in (master or {}).get('children', ()):
+        if int(pid) != os.getpid():
+            try:
+                os.kill(int(pid), signum)
+            except ProcessLookupError:
+                pass
+
+
+def health():
+    """汇总的健康状态：所有工作进程（与刷新进程）都在正常上报时为 ok，否则为 degraded"""
+    master, workers = read_statuses()
+    expected = master['workers'] if master else 0
+    refresher = master.get('refresher') if master else False
+    refresher_alive = bool(refresher and read_alive(master, REFRESHER))
+    status = {
+        'status': 'ok' if master and len(workers) >= expected and (not refresher or refresher_alive) else 'degraded',
+        'workers': {
+            'expected': expected,
+            'alive': len(workers),
+            'restarts': master['restarts'] if master else 0
+        },
+        'pid': os.getpid()
+    }
+    if refresher:
+        status['refresher'] = 'ok' if refresher_alive else 'down'
+    return status
+
+
+class TunnelView:
+    """工作进程中的 SSH 隧道：与 TunnelSupervisor 接口一致，端口为主进程隧道的本地端口，状态读取主进程的状态文件
+
+    隧道只由主进程维护；工作进程不能操作 fork 继承来的 SSH 连接（会与主进程同时读写同一个 socket）。
+    """
+
+    def __init__(self, local_ports):
+        self.local_ports = dict(local_ports)
+        self.generation = 0  # 收到主进程隧道重建通知的次数
+
+    def port(self, name):
+        return self.local_ports[name]
+
+    def on_restart(self, callback):
+        pass  # 主进程的隧道重建后以 SIGUSR1 通知工作进程，见 app.run_worker
+
+    def stop(self):
+        pass
+
+    def status(self):
+        master = read_status('master')
+        tunnel = master.get('ssh_tunnel') if master else None
+        return tunnel if isinstance(tunnel, dict) else 'unknown'
+
+    @property
+    def is_active(self):
+        status = self.status()
+        return isinstance(status, dict) and status['active']
+
+    def forward_up(self, name):
+        status = self.status()
+        return isinstance(status, dict) and status['forwards'].get(name, {}).get('up', False)
+
+
+def start_reporter(status):
+    """工作进程：每 PREFORK_STATUS_INTERVAL 秒写入 status() 的结果；主进程已退出时结束本进程"""
+    def report():
+        started_at = time.time()
+        while True:
+            if os.getppid() != master_pid:
+                print(f"[多进程] 主进程已退出，工作进程 {worker_index} (pid {os.getpid()}) 退出")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+            try:
+                write_status(status_name(worker_index), {'index': worker_index, 'started_at': started_at, **status()})
+            except Exception as e:
+                print(f"[多进程] 状态写入失败 - 错误: {str(e)}")
+            time.sleep(PREFORK_STATUS_INTERVAL)
+
+    threading.Thread(target=report, name='prefork-reporter', daemon=True).start()
+
+
+def unblock_child_signals():
+    """子进程：登记 CHILD_SIGNALS 的处理函数后解除屏蔽（屏蔽期间收到的信号此时送达）"""
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, CHILD_SIGNALS)
+
+
+def _exit_worker(signum, frame):
+    raise SystemExit(0)
+
+
+class Master:
+    """主进程：监听端口、fork 工作进程并在其异常退出后重新 fork
+
+    target(sock, index) 为工作进程入口（在子进程中调用，返回即退出）；
+    refresher() 为可选的刷新进程入口（不继承监听 socket），异常退出后同样重新 fork；
+    两个入口开始时 CHILD_SIGNALS 处于屏蔽状态（fork 后、登记处理函数前收到的信号不会按默认动作结束进程），
+    登记处理函数后需调用 unblock_child_signals()；
+    status() 返回主进程附加的状态（如 SSH 隧道），与工作进程列表一起写入状态目录。
+    """
+
+    def __init__(self, workers, address, target, status=None, refresher=None):
+        self.workers = workers
+        self.address = address
+        self.target = target
+        self.status = status
+        self.refresher = refresher
+        self.sock = None
+        self.children = {}  # pid → 工作进程序号
+        self.started = {}   # 序号 → 启动时间
+        self.failures = {}  # 序号 → 连续崩溃次数
+        self.pending = {}   # 序号 → 计划重新 fork 的时间
+        self.restarts = 0
+        self.stopping = False
+
+    def listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self.address)
+        sock.listen(1024)
+        sock.setblocking(False)
+        return sock
+
+    def spawn(self, index):
+        global role, worker_index
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, CHILD_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                role, worker_index = REFRESHER if index == REFRESHER else 'worker', index
+                signal.signal(signal.SIGTERM, _exit_worker)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由主进程统一处理
+                if index == REFRESHER:
+                    self.sock.close()
+                    self.refresher()
+                else:
+                    self.target(self.sock, index)
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        self.children[pid] = index
+        self.started[index] = time.time()
+        print(f"[多进程] {'刷新进程' if index == REFRESHER else f'工作进程 {index} '}已启动 (pid {pid})")
+
+    def signal_workers(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _write_status(self):
+        write_status('master', {
+            'workers': self.workers,
+            'children': {pid: {'index': index, 'started_at': self.started[index]} for pid, index in self.children.items()},
+            'restarts': self.restarts,
+            'refresher': self.refresher is not None,
+            **(self.status() if self.status else {})
+        })
+
+    def _reap(self):
+        """回收已退出的工作进程，安排按退避间隔重新 fork"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            uptime = time.time() - self.started[index]
+            failures = 1 if uptime >= PREFORK_STABLE_UPTIME else self.failures.get(index, 0) + 1
+            self.failures[index] = failures
+            delay = min(2 ** (failures - 1), PREFORK_RESTART_MAX_DELAY)
+            self.pending[index] = time.time() + delay
+            self.restarts += 1
+            print(f"[多进程] 工作进程 {index} (pid {pid}) 退出，状态: {status}，运行 {uptime:.1f}s，{delay:.0f}s 后重新启动")
+
+    def run(self):
+        """启动工作进程并持续监控，直到收到 SIGTERM / SIGINT"""
+        global role, status_dir, master_pid
+        role, master_pid = 'master', os.getpid()
+        status_dir = tempfile.mkdtemp(prefix='ute-prefork-')
+        self.sock = self.listen()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print(f"[多进程] 监听 {self.address[0]}:{self.address[1]}，工作进程数: {self.workers}，状态目录: {status_dir}")
+        try:
+            for index in range(self.workers):
+                self.spawn(index)
+            if self.refresher:
+                self.spawn(REFRESHER)
+            while not self.stopping:
+                self._reap()
+                now = time.time()
+                for index, due in list(self.pending.items()):
+                    if due <= now and not self.stopping:
+                        del self.pending[index]
+                        self.spawn(index)
+                self._write_status()
+                time.sleep(min(0.5, PREFORK_STATUS_INTERVAL))
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """通知工作进程退出，超过 PREFORK_GRACEFUL_TIMEOUT 仍未退出的强制结束"""
+        print("[多进程] 正在停止工作进程...")
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.time() + PREFORK_GRACEFUL_TIMEOUT
+        while self.children and time.time() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        if self.children:
+            print(f"[多进程] 强制结束未退出的工作进程: {list(self.children)}")
+            self.signal_workers(signal.SIGKILL)
+            for pid in list(self.children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.children.clear()
+        self.sock.close()
+        shutil.rmtree(status_dir, ignore_errors=True)
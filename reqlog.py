@@ -0,0 +1,197 @@
+"""请求日志：处理线程只把结构化记录放入队列，由后台线程批量写到标准输出
+
+* 32 个 waitress 线程直接 print 会在标准输出的锁上排队，输出被管道接到较慢的日志采集时会拖慢请求
+* 记录为 (时间, 级别, 文本, 字段)：LOG_FORMAT=text 输出原有的文本行，json 输出一行一个 JSON 对象
+* 成功请求（info）可按 LOG_SAMPLE_RATE 采样；info / warning 按 LOG_RATE_LIMITS 限流，队列满时丢弃并计数
+* error 不采样、不限流，队列满时等待写出，保证不丢
+"""
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import metrics
+
+LEVELS = ('info', 'warning', 'error')
+
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()              # 'text'（默认）或 'json'
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))         # 成功请求的记录比例（0~1）
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))         # 队列长度上限
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '256'))           # 每次最多写出的记录数
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '0.2'))  # 队列为空时的等待间隔（秒）
+
+
+def parse_rate_limits(value):
+    """解析 'info=1000,warning=200' 为 {级别: 每秒条数}，error 不限流"""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        level, rate = item.split('=', 1)
+        level = level.strip().lower()
+        if level in ('info', 'warning') and float(rate) > 0:
+            limits[level] = float(rate)
+    return limits
+
+
+LOG_RATE_LIMITS = parse_rate_limits(os.getenv('LOG_RATE_LIMITS', 'info=1000,warning=200'))
+
+LOG_DROPPED = metrics.Counter('ute_log_dropped_total', '丢弃的日志记录数（reason: rate_limit 限流, queue_full 队列已满）', ('level', 'reason'))
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个，最多积累 burst 个（默认为 rate，即允许 1 秒的突发）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+buckets = {level: TokenBucket(rate) for level, rate in LOG_RATE_LIMITS.items()}
+records = queue.Queue(LOG_QUEUE_SIZE)
+dropped = {}  # (level, reason) → 自上次写出以来丢弃的条数，由写出线程汇报
+dropped_lock = threading.Lock()
+writer_thread = None
+writer_lock = threading.Lock()
+writer_stop = threading.Event()
+
+
+def _drop(level, reason):
+    with dropped_lock:
+        dropped[(level, reason)] = dropped.get((level, reason), 0) + 1
+    LOG_DROPPED.inc(level=level, reason=reason)
+
+
+def log(level, message, **fields):
+    """记录一条日志：message 为文本格式的整行内容，fields 为结构化字段（route、code、status、elapsed_ms 等）"""
+    if level == 'info' and LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    bucket = buckets.get(level)
+    if bucket and not bucket.take():
+        _drop(level, 'rate_limit')
+        return
+
+    if writer_thread is None:
+        start_writer()
+    record = (time.time(), level, message, fields)
+    if level == 'error':
+        records.put(record)
+        return
+    try:
+        records.put_nowait(record)
+    except queue.Full:
+        _drop(level, 'queue_full')
+
+
+def info(message, **fields):
+    log('info', message, **fields)
+
+
+def warning(message, **fields):
+    log('warning', message, **fields)
+
+
+def error(message, **fields):
+    log('error', message, **fields)
+
+
+def format_record(record):
+    timestamp, level, message, fields = record
+    if LOG_FORMAT != 'json':
+        return f"{message}\n"
+    return json.dumps({
+        'ts': round(timestamp, 3),
+        'level': level,
+        **fields,
+        'msg': message
+    }, ensure_ascii=False, default=str) + '\n'
+
+
+def _dropped_record():
+    """汇总上次写出以来被丢弃的记录数（作为 warning 写出，本身不受限流）"""
+    with dropped_lock:
+        counts = dict(dropped)
+        dropped.clear()
+    if not counts:
+        return None
+    summary = ', '.join(f"{level}/{reason}={count}" for (level, reason), count in sorted(counts.items()))
+    return (time.time(), 'warning', f"[日志丢弃] {summary}", {'event': 'log_dropped', 'dropped': summary})
+
+
+def _write(batch):
+    stream = sys.stdout
+    try:
+        stream.write(''.join(format_record(record) for record in batch))
+        stream.flush()
+    except Exception:
+        pass
+
+
+def _writer():
+    while True:
+        try:
+            batch = [records.get(timeout=LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            batch = []
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(records.get_nowait())
+            except queue.Empty:
+                break
+        summary = _dropped_record()
+        if summary:
+            batch.append(summary)
+        if batch:
+            _write(batch)
+        elif writer_stop.is_set():
+            return
+
+
+def start_writer():
+    """启动后台写出线程（首次记录日志时自动启动）"""
+    global writer_thread
+    with writer_lock:
+        if writer_thread is None:
+            writer_thread = threading.Thread(target=_writer, name='log-writer', daemon=True)
+            writer_thread.start()
+
+
+def close(timeout=5):
+    """写出队列中剩余的记录并停止写出线程（进程退出时自动调用）"""
+    writer_stop.set()
+    if writer_thread is not None:
+        writer_thread.join(timeout)
+
+
+def _after_fork():
+    """fork 出的子进程（多进程模式的工作进程）：写出线程没有被复制，重建队列与锁，首次记录日志时重新启动写出线程"""
+    global records, dropped_lock, writer_thread, writer_lock, writer_stop
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    dropped.clear()
+    dropped_lock = threading.Lock()
+    writer_thread = None
+    writer_lock = threading.Lock()
+    writer_stop = threading.Event()
+    for bucket in buckets.values():
+        bucket.lock = threading.Lock()
+
+
+atexit.register(close)
+os.register_at_fork(after_in_child=_after_fork)
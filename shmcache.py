@@ -0,0 +1,196 @@
+"""共享快照表：多进程模式下所有进程共用的一块共享内存（mmap），按 key 存放已序列化的值
+
+* 主进程在 fork 前创建匿名共享映射，工作进程与刷新进程继承同一块内存，不经过任何 IPC
+* 固定数量、固定大小的槽位，按 key 的 crc32 开放寻址（线性探测，最多 PROBE_LIMIT 个槽位）
+* 读取不加锁（seqlock）：写入前后序号各加一（写入期间为奇数），读取前后序号相同且为偶数才采用，否则重试；
+  依赖 x86 的写入顺序（存储不会被重排），Python 中无法显式插入内存屏障
+* 登记新 key（claim）、首次写入（fill）与淘汰（evict）在跨进程锁下进行；
+  已就绪槽位的刷新（update / touch_updated）只由刷新进程执行，不加锁
+"""
+import mmap
+import multiprocessing
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+EMPTY, PENDING, READY, OVERSIZE, DELETED = range(5)  # 槽位状态：空、已登记待写入、已就绪、值超过槽位大小、已淘汰
+
+# 槽位头部：序号、状态、key 长度、值长度、写入时间、最后读取时间；之后依次为 key 区与值区
+SLOT_HEADER = struct.Struct('<QBxHIdd')
+SEQ = struct.Struct('<Q')
+TIMESTAMP = struct.Struct('<d')
+UPDATED_AT_OFFSET = 16
+LAST_READ_OFFSET = 24
+KEY_MAX = 128        # key 最大字节数
+PROBE_LIMIT = 64     # 探测的槽位数上限，超过则视为没有空闲槽位
+READ_RETRIES = 16    # 读取时遇到写入中的重试次数
+LOCK_TIMEOUT = 1.0   # 跨进程锁的等待上限（秒），超时按未登记处理（持锁进程可能已被强制结束）
+
+SharedValue = namedtuple('SharedValue', ['slot', 'state', 'value', 'updated_at'])
+
+
+class SharedTable:
+    """固定槽位的共享内存表（需在 fork 前创建）"""
+
+    def __init__(self, slots, slot_size):
+        if slot_size <= SLOT_HEADER.size + KEY_MAX:
+            raise ValueError(f"槽位大小至少为 {SLOT_HEADER.size + KEY_MAX + 1} 字节")
+        self.slots = slots
+        self.slot_size = slot_size
+        self.value_max = slot_size - SLOT_HEADER.size - KEY_MAX
+        self.buf = mmap.mmap(-1, slots * slot_size)  # 匿名共享映射（MAP_SHARED），fork 后父子进程共用
+        self.lock = multiprocessing.Lock()
+        self.local_slots = {}  # 本进程记住的 key → 槽位，命中时省去探测
+
+    def _probe(self, key):
+        start = zlib.crc32(key) % self.slots
+        for i in range(min(PROBE_LIMIT, self.slots)):
+            yield (start + i) % self.slots
+
+    def _read(self, slot, key=None, with_value=True):
+        """无锁读取槽位，返回 (状态, key, 值, 写入时间, 最后读取时间)；key 不一致时不复制值，持续写入中返回 None"""
+        buf = self.buf
+        offset = slot * self.slot_size
+        key_start = offset + SLOT_HEADER.size
+        value_start = key_start + KEY_MAX
+        for _ in range(READ_RETRIES):
+            seq, state, key_len, value_len, updated_at, last_read = SLOT_HEADER.unpack_from(buf, offset)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            slot_key = buf[key_start:key_start + min(key_len, KEY_MAX)]
+            value = None
+            if with_value and state == READY and (key is None or slot_key == key):
+                value = buf[value_start:value_start + min(value_len, self.value_max)]
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return state, slot_key, value, updated_at, last_read
+        return None
+
+    def _write(self, slot, state, key, value=b'', updated_at=0.0):
+        """写入整个槽位（调用方保证同一槽位同时只有一个写入者）"""
+        buf = self.buf
+        offset = slot * self.slot_size
+        seq = SEQ.unpack_from(buf, offset)[0]
+        SEQ.pack_into(buf, offset, seq + 1)
+        last_read = TIMESTAMP.unpack_from(buf, offset + LAST_READ_OFFSET)[0]
+        SLOT_HEADER.pack_into(buf, offset, seq + 1, state, len(key), len(value), updated_at, last_read)
+        key_start = offset + SLOT_HEADER.size
+        buf[key_start:key_start + len(key)] = key
+        buf[key_start + KEY_MAX:key_start + KEY_MAX + len(value)] = value
+        SEQ.pack_into(buf, offset, seq + 2)
+
+    def _owner(self, slot):
+        """持锁时读取槽位的 (状态, key)：这两项只在锁内修改（刷新进程只会把 READY 改为 OVERSIZE，不影响登记与淘汰的判断）"""
+        offset = slot * self.slot_size
+        _, state, key_len, *_ = SLOT_HEADER.unpack_from(self.buf, offset)
+        key_start = offset + SLOT_HEADER.size
+        return state, self.buf[key_start:key_start + min(key_len, KEY_MAX)]
+
+    def get(self, key):
+        """读取 key，返回 SharedValue（值只在 READY 状态时有）；不存在或持续写入中返回 None"""
+        slot = self.local_slots.get(key)
+        if slot is not None:
+            found = self._read(slot, key)
+            if found is not None and found[1] == key:
+                return SharedValue(slot, found[0], found[2], found[3])
+            self.local_slots.pop(key, None)  # 已被淘汰或重新分配
+
+        for slot in self._probe(key):
+            found = self._read(slot, key)
+            if found is None or found[0] == EMPTY:
+                return None
+            if found[1] == key:
+                self.local_slots[key] = slot
+                return SharedValue(slot, found[0], found[2], found[3])
+        return None
+
+    def touch(self, slot):
+        """记录最后读取时间（不经过 seqlock：只有刷新进程据此淘汰，读到旧值无妨）"""
+        TIMESTAMP.pack_into(self.buf, slot * self.slot_size + LAST_READ_OFFSET, time.time())
+
+    def claim(self, key):
+        """登记新 key（PENDING），返回槽位，由登记者负责首次写入；key 已存在、没有空闲槽位或取锁超时返回 None"""
+        if len(key) > KEY_MAX or not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            return None
+        try:
+            free = None
+            for slot in self._probe(key):
+                state, slot_key = self._owner(slot)
+                if state == EMPTY:
+                    free = slot if free is None else free
+                    break
+                if state == DELETED:
+                    free = slot if free is None else free
+                elif slot_key == key:
+                    return None
+            if free is None:
+                return None
+            TIMESTAMP.pack_into(self.buf, free * self.slot_size + LAST_READ_OFFSET, time.time())
+            self._write(free, PENDING, key)
+            self.local_slots[key] = free
+            return free
+        finally:
+            self.lock.release()
+
+    def fill(self, slot, key, value, updated_at):
+        """登记者的首次写入：槽位仍为该 key 的 PENDING 时写入并置为 READY，值超过槽位大小时置为 OVERSIZE"""
+        if not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            return False
+        try:
+            state, slot_key = self._owner(slot)
+            if state != PENDING or slot_key != key:
+                return False
+            if len(value) > self.value_max:
+                self._write(slot, OVERSIZE, key, updated_at=updated_at)
+                return False
+            self._write(slot, READY, key, value, updated_at)
+            return True
+        finally:
+            self.lock.release()
+
+    def update(self, slot, key, value, updated_at):
+        """刷新进程更新已就绪的槽位；值超过槽位大小时置为 OVERSIZE"""
+        if len(value) > self.value_max:
+            self._write(slot, OVERSIZE, key, updated_at=updated_at)
+            return False
+        self._write(slot, READY, key, value, updated_at)
+        return True
+
+    def touch_updated(self, slot, updated_at):
+        """刷新进程确认数据未变化：只更新写入时间"""
+        buf = self.buf
+        offset = slot * self.slot_size
+        seq = SEQ.unpack_from(buf, offset)[0]
+        SEQ.pack_into(buf, offset, seq + 1)
+        TIMESTAMP.pack_into(buf, offset + UPDATED_AT_OFFSET, updated_at)
+        SEQ.pack_into(buf, offset, seq + 2)
+
+    def evict(self, slot, key):
+        """淘汰槽位（置为 DELETED，探测时跳过，可被重新登记）"""
+        if not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            return
+        try:
+            if self._owner(slot)[1] == key:
+                self._write(slot, DELETED, b'')
+        finally:
+            self.lock.release()
+        self.local_slots.pop(key, None)
+
+    def entries(self):
+        """遍历所有已登记的槽位，返回 [(槽位, 状态, key, 写入时间, 最后读取时间)]（不复制值）"""
+        entries = []
+        for slot in range(self.slots):
+            found = self._read(slot, with_value=False)
+            if found is not None and found[0] in (PENDING, READY, OVERSIZE):
+                state, key, _, updated_at, last_read = found
+                entries.append((slot, state, key, updated_at, last_read))
+        return entries
+
+    def usage(self):
+        """各状态的槽位数"""
+        counts = {'slots': self.slots, 'slot_size': self.slot_size, 'pending': 0, 'ready': 0, 'oversize': 0}
+        names = {PENDING: 'pending', READY: 'ready', OVERSIZE: 'oversize'}
+        for _, state, *_ in self.entries():
+            counts[names[state]] += 1
+        return counts
@@ -0,0 +1,165 @@
+"""SSH 隧道：一条 SSH 连接同时转发所有数据库端口，后台线程监控并自动重连
+
+* 原来 SCADA 与 MES 各建一个 SSHTunnelForwarder，到同一跳板机要两次握手、两份加密开销，且断开后不会恢复
+* 现在一个 TunnelSupervisor 管理一条 SSH 连接，按名称转发多个远端地址，开启 keepalive
+* 连接断开后按指数退避重连，重连时复用原来的本地端口，连接池配置无需变化；
+  重连成功后通知回调（连接池据此丢弃隧道重建前建立的连接）
+* 加密算法（SSH_CIPHERS）与压缩（SSH_COMPRESSION）可配置：局域网内 aes128-gcm / aes128-ctr 开销最低，
+  跨慢速链路传输大量字段时可开启压缩
+"""
+import os
+import threading
+import time
+
+from sshtunnel import SSHTunnelForwarder
+
+import metrics
+import reqlog
+
+SSH_KEEPALIVE = float(os.getenv('SSH_KEEPALIVE', '15'))               # keepalive 间隔（秒），0 关闭
+SSH_COMPRESSION = os.getenv('SSH_COMPRESSION', '0') == '1'            # '1' 开启 zlib 压缩
+SSH_CIPHERS = [c.strip() for c in os.getenv('SSH_CIPHERS', '').split(',') if c.strip()]  # 优先使用的加密算法
+SSH_CHECK_INTERVAL = float(os.getenv('SSH_CHECK_INTERVAL', '5'))      # 连接检查间隔（秒）
+SSH_RECONNECT_MAX_DELAY = float(os.getenv('SSH_RECONNECT_MAX_DELAY', '30'))  # 重连退避上限（秒）
+
+SSH_RECONNECTS = metrics.Counter('ute_ssh_reconnects_total', 'SSH 隧道重连成功次数')
+SSH_RECONNECT_FAILURES = metrics.Counter('ute_ssh_reconnect_failures_total', 'SSH 隧道重连失败次数')
+
+
+class Forwarder(SSHTunnelForwarder):
+    """按 SSH_CIPHERS 调整加密算法的优先顺序（只保留 paramiko 支持的算法，其余按默认顺序排在后面）"""
+
+    def _get_transport(self):
+        transport = super()._get_transport()
+        if SSH_CIPHERS:
+            options = transport.get_security_options()
+            supported = tuple(options.ciphers)
+            preferred = tuple(c for c in SSH_CIPHERS if c in supported)
+            options.ciphers = preferred + tuple(c for c in supported if c not in preferred)
+        return transport
+
+
+class TunnelSupervisor:
+    """一条 SSH 连接转发多个数据库：remotes 为 {名称: (远端地址, 端口)}，本地端口通过 port(名称) 获取"""
+
+    def __init__(self, ssh_config, remotes):
+        self.ssh_config = ssh_config
+        self.remotes = dict(remotes)
+        self.local_ports = {}  # 名称 → 本地端口，重连后保持不变
+        self.forwarder = None
+        self.generation = 0    # 每次重连成功后递增
+        self.restarts = 0
+        self.started_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self.listeners = []    # 重连成功后的回调，参数为 generation
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _open(self):
+        names = list(self.remotes)
+        forwarder = Forwarder(
+            (self.ssh_config['host'], self.ssh_config['port']),
+            ssh_username=self.ssh_config['user'],
+            ssh_password=self.ssh_config['password'],
+            remote_bind_addresses=[self.remotes[name] for name in names],
+            local_bind_addresses=[('127.0.0.1', self.local_ports.get(name, 0)) for name in names],
+            set_keepalive=SSH_KEEPALIVE,
+            compression=SSH_COMPRESSION
+        )
+        forwarder.start()
+        self.local_ports = dict(zip(names, forwarder.local_bind_ports))
+        return forwarder
+
+    def start(self):
+        """建立 SSH 连接并启动监控线程"""
+        self.forwarder = self._open()
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._supervise, name='ssh-supervisor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.forwarder:
+            self.forwarder.stop(force=True)
+
+    def port(self, name):
+        """数据库 name 在本机的转发端口"""
+        return self.local_ports[name]
+
+    def on_restart(self, callback):
+        self.listeners.append(callback)
+
+    @property
+    def is_active(self):
+        forwarder = self.forwarder
+        return forwarder is not None and forwarder.is_active
+
+    def forward_up(self, name):
+        """某个数据库的转发是否可用（SSH 连接存活且本地端口在监听）"""
+        forwarder = self.forwarder
+        if forwarder is None or not forwarder.is_active:
+            return False
+        return bool(forwarder.tunnel_is_up.get(('127.0.0.1', self.local_ports.get(name)), True))
+
+    def restart(self):
+        """关闭旧连接并在原本地端口上重建，成功后通知回调"""
+        old = self.forwarder
+        if old is not None:
+            try:
+                old.stop(force=True)
+            except Exception:
+                pass
+        self.forwarder = self._open()
+        self.generation += 1
+        self.restarts += 1
+        self.started_at = time.time()
+        SSH_RECONNECTS.inc()
+        for callback in self.listeners:
+            try:
+                callback(self.generation)
+            except Exception as e:
+                reqlog.error(f"[SSH 隧道] 重连回调失败 - 错误: {str(e)}", event='ssh_reconnect', error=str(e))
+
+    def _supervise(self):
+        delay = SSH_CHECK_INTERVAL
+        backoff = 1.0
+        while not self.stop_event.wait(delay):
+            if self.is_active:
+                delay = SSH_CHECK_INTERVAL
+                backoff = 1.0
+                continue
+            started = time.time()
+            try:
+                self.restart()
+            except Exception as e:
+                self.last_error = str(e)
+                self.last_error_at = time.time()
+                SSH_RECONNECT_FAILURES.inc()
+                reqlog.error(f"[SSH 隧道] 重连失败，{backoff:.0f}s 后重试 - 错误: {str(e)}", event='ssh_reconnect', error=str(e))
+                delay = backoff
+                backoff = min(backoff * 2, SSH_RECONNECT_MAX_DELAY)
+                continue
+            elapsed = (time.time() - started) * 1000
+            reqlog.warning(f"[SSH 隧道] 已重连（第 {self.restarts} 次），耗时: {elapsed:.2f}ms, 本地端口: {self.local_ports}",
+                           event='ssh_reconnect', restarts=self.restarts, elapsed_ms=round(elapsed, 2))
+            delay = SSH_CHECK_INTERVAL
+            backoff = 1.0
+
+    def status(self):
+        """隧道状态（/pool/status 使用）"""
+        return {
+            'active': self.is_active,
+            'forwards': {
+                name: {'remote': f"{host}:{port}", 'local_port': self.local_ports.get(name), 'up': self.forward_up(name)}
+                for name, (host, port) in self.remotes.items()
+            },
+            'generation': self.generation,
+            'restarts': self.restarts,
+            'uptime_s': round(time.time() - self.started_at, 1) if self.started_at and self.is_active else 0,
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at,
+            'keepalive_s': SSH_KEEPALIVE,
+            'compression': SSH_COMPRESSION,
+            'ciphers': SSH_CIPHERS or None
+        }
@@ -1,163 +1,462 @@
 import requests
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import sys
+import json
+import math
+import heapq
+import random
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-# 配置
-BASE_URL = "http://localhost:5000"
-CODE = "07_4_3mz2010"
-REQUESTS_PER_API = 10
+from poll_rates import poll_rate
 
-# 测试数据
-test_data = {
-    'code': CODE
+# 接口压测与基准测试
+#   python test_api.py run --mode closed --concurrency 32 --duration 30 --json base.json
+#   python test_api.py run --mode open --rate 200 --duration 60
+#   python test_api.py run --mode profile --codes-file codes.txt --duration 300   # 按文档约定的请求频率模拟全部设备
+#   python test_api.py run --routes history,trend,stream --trend-columns 砂轮线速度 --duration 60
+#   python test_api.py compare base.json new.json --threshold 10                  # 对比两次结果，退化时返回码为 1
+BASE_URL = os.getenv('BENCH_URL', 'http://localhost:5000')
+CODE = os.getenv('BENCH_CODE', '07_4_3mz2010')
+
+# 接口目录：名称 → (地址, 参数类型, 每设备请求频率 QPS)
+# 参数类型：'code' 单设备，'codes' 批量，None 无参数（全局接口）
+# 频率为 None 的接口取文档约定频率（poll_rates.py，与服务端频率限制共用，不导入服务端代码）；其余接口不受服务端频率限制，
+# 按详细页打开、拖动时间范围或建立推送连接的频率估计
+ROUTES = {
+    'process_data': ('/api/process_data', 'code', None),
+    'efficiency_data': ('/api/efficiency_data', 'code', None),
+    'home_online_inspection': ('/api/home_online_inspection', 'code', None),
+    'detailed_online_inspection': ('/api/detailed_online_inspection', 'code', None),
+    'home_inspection': ('/api/home_inspection', None, None),
+    'details_inspection': ('/api/details_inspection', None, 1),
+    'process_data_batch': ('/api/process_data/batch', 'codes', None),
+    'efficiency_data_batch': ('/api/efficiency_data/batch', 'codes', None),
+    'home_online_inspection_batch': ('/api/home_online_inspection/batch', 'codes', None),
+    'detailed_online_inspection_batch': ('/api/detailed_online_inspection/batch', 'codes', None),
+    'history': ('/api/history', 'code', 0.1),
+    'trend': ('/api/trend', 'code', 0.1),
+    'stream': ('/api/stream', 'codes', 0.01),
 }
+DEFAULT_ROUTES = ['process_data', 'efficiency_data', 'home_online_inspection', 'detailed_online_inspection',
+                  'home_inspection', 'details_inspection']
 
-def test_api(api_name, url, request_num):
-    """发送单个请求"""
-    try:
-        start = time.time()
-        response = requests.post(url, json=test_data, timeout=30)
-        elapsed = time.time() - start
-        
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                'api': api_name,
-                'request_num': request_num,
-                'status': 'success',
-                'status_code': response.status_code,
-                'elapsed': elapsed,
-                'data_fields': len(data.get('data', {})) if data.get('data') else 0,
-                'api_elapsed_ms': data.get('elapsed_ms', 'N/A')
-            }
-        else:
-            return {
-                'api': api_name,
-                'request_num': request_num,
-                'status': 'error',
-                'status_code': response.status_code,
-                'elapsed': elapsed,
-                'error': response.text
-            }
-    except Exception as e:
+# 对比时检查的指标：名称 → 数值越大越差（True）或越小越差（False）
+COMPARE_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput': False,
+    'error_rate': True,
+}
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（HdrHistogram 的思路）：单位微秒，每个 2 的幂区间分 128 个子桶，相对误差 < 1%，
+    内存与样本数无关，长时间压测也能给出准确的 P99 / P99.9"""
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts = {}  # 子桶下界（微秒） → 计数
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _shift(self, value):
+        return max(0, value.bit_length() - self.SUB_BUCKET_BITS - 1)
+
+    def record(self, seconds):
+        value = max(1, int(seconds * 1e6))
+        shift = self._shift(value)
+        key = (value >> shift) << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        if other.count:
+            self.count += other.count
+            self.total += other.total
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """第 p 百分位（微秒），取所在子桶的上界"""
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= target:
+                return min(self.max, key + (1 << self._shift(key)) - 1)
+        return self.max
+
+    def summary(self):
+        """毫秒为单位的统计"""
+        if not self.count:
+            return {'count': 0}
         return {
-            'api': api_name,
-            'request_num': request_num,
-            'status': 'exception',
-            'elapsed': time.time() - start,
-            'error': str(e)
+            'count': self.count,
+            'mean_ms': round(self.total / self.count / 1000, 3),
+            'min_ms': round(self.min / 1000, 3),
+            'p50_ms': round(self.percentile(50) / 1000, 3),
+            'p90_ms': round(self.percentile(90) / 1000, 3),
+            'p95_ms': round(self.percentile(95) / 1000, 3),
+            'p99_ms': round(self.percentile(99) / 1000, 3),
+            'p999_ms': round(self.percentile(99.9) / 1000, 3),
+            'max_ms': round(self.max / 1000, 3),
         }
 
-def main():
-    """并发测试"""
-    print("=" * 80)
-    print("API 压力测试")
-    print("=" * 80)
-    print(f"目标 URL: {BASE_URL}")
-    print(f"Code: {CODE}")
-    print(f"每个接口请求数: {REQUESTS_PER_API}")
-    print(f"总请求数: {REQUESTS_PER_API * 2}")
-    print("=" * 80)
-    print()
-    
-    # 构建请求列表
-    tasks = []
-    
-    # /api/process_data 接口
-    for i in range(1, REQUESTS_PER_API + 1):
-        tasks.append(('process_data', f"{BASE_URL}/api/process_data", i))
-    
-    # /api/efficiency_data 接口
-    for i in range(1, REQUESTS_PER_API + 1):
-        tasks.append(('efficiency_data', f"{BASE_URL}/api/efficiency_data", i))
-    
-    # 并发执行
-    results = []
-    total_start = time.time()
-    
-    print(f"开始发送 {len(tasks)} 个请求...\n")
-    
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        futures = {
-            executor.submit(test_api, api_name, url, req_num): (api_name, req_num)
-            for api_name, url, req_num in tasks
+
+class RouteStats:
+    """单个接口的结果：latency 为从计划发送时间起算的耗时（开环模式下包含排队，避免协同遗漏），
+    service 为实际发送到收到响应的耗时"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.status = {}
+        self.errors = 0
+        self.bytes = 0
+        self.api_elapsed = []  # 响应中的 elapsed_ms（服务端内部耗时）
+        self.lock = threading.Lock()
+
+    def record(self, latency, service, status, size, api_elapsed):
+        with self.lock:
+            self.latency.record(latency)
+            self.service.record(service)
+            self.status[status] = self.status.get(status, 0) + 1
+            if status == 'error' or (isinstance(status, int) and status >= 400):
+                self.errors += 1
+            self.bytes += size
+            if api_elapsed is not None:
+                self.api_elapsed.append(api_elapsed)
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.service.merge(other.service)
+        for status, count in other.status.items():
+            self.status[status] = self.status.get(status, 0) + count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.api_elapsed.extend(other.api_elapsed)
+
+    def report(self, duration):
+        requests_done = self.latency.count
+        return {
+            'requests': requests_done,
+            'errors': self.errors,
+            'error_rate': round(self.errors / requests_done, 4) if requests_done else 0,
+            'throughput': round(requests_done / duration, 2) if duration else 0,
+            'status': {str(k): v for k, v in sorted(self.status.items(), key=lambda item: str(item[0]))},
+            'bytes_per_request': round(self.bytes / requests_done) if requests_done else 0,
+            'api_elapsed_mean_ms': round(sum(self.api_elapsed) / len(self.api_elapsed), 3) if self.api_elapsed else None,
+            **self.latency.summary(),
+            'service': self.service.summary(),
         }
-        
-        completed = 0
-        for future in as_completed(futures):
-            completed += 1
-            api_name, req_num = futures[future]
+
+
+def load_codes(args):
+    codes = []
+    if args.codes:
+        codes.extend(c.strip() for c in args.codes.split(',') if c.strip())
+    if args.codes_file:
+        with open(args.codes_file, encoding='utf-8') as f:
+            codes.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return list(dict.fromkeys(codes)) or [CODE]
+
+
+def build_targets(routes, codes, batch_size):
+    """展开为 (接口名, 参数, 每设备频率)：单设备接口每个 code 一个目标，批量接口按 batch_size 分组"""
+    targets = []
+    for name in routes:
+        path, kind, rate = ROUTES[name]
+        rate = poll_rate(path) if rate is None else rate
+        if kind == 'code':
+            targets.extend((name, {'code': code}, rate) for code in codes)
+        elif kind == 'codes':
+            for i in range(0, len(codes), batch_size):
+                targets.append((name, {'codes': ','.join(codes[i:i + batch_size])}, rate))
+        else:
+            targets.append((name, {}, rate))
+    return targets
+
+
+def route_params(name, params, args):
+    """历史、趋势与推送接口的附加参数"""
+    if name == 'history':
+        return {**params, 'family': args.family, 'limit': args.history_limit}
+    if name == 'trend':
+        now = time.time()
+        return {**params, 'family': args.family, 'columns': args.trend_columns, 'method': args.trend_method,
+                'from_ts': round(now - args.trend_window), 'to_ts': round(now)}
+    if name == 'stream' and args.stream_families:
+        return {**params, 'families': args.stream_families}
+    return params
+
+
+def read_first_event(response):
+    """推送接口：读到第一个完整事件（空行结束）即断开，返回已读取的字节数"""
+    size = 0
+    buffer = b''
+    for chunk in response.iter_content(chunk_size=None):
+        size += len(chunk)
+        buffer += chunk
+        if b'\n\n' in buffer:
+            break
+    response.close()
+    return size
+
+
+def send(session, args, target):
+    """发送单个请求，返回 (状态码或 'error', 响应字节数, 服务端 elapsed_ms)"""
+    name, params, _ = target
+    path = ROUTES[name][0]
+    params = route_params(name, params, args)
+    try:
+        if name == 'stream':
+            response = session.get(f"{args.base_url}{path}", params=params, stream=True, timeout=30)
+            if response.status_code != 200:
+                return response.status_code, len(response.content), None
+            return response.status_code, read_first_event(response), None
+        if args.method == 'POST' and name not in ('history', 'trend'):
+            response = session.post(f"{args.base_url}{path}", json=params, timeout=30)
+        else:
+            response = session.get(f"{args.base_url}{path}", params=params, timeout=30)
+        api_elapsed = None
+        if response.headers.get('Content-Type', '').startswith('application/json'):
             try:
-                result = future.result()
-                results.append(result)
-                print(f"[{completed}/{len(tasks)}] {api_name} #{req_num}: {result['status']} ({result['elapsed']:.3f}s)")
-            except Exception as e:
-                print(f"[{completed}/{len(tasks)}] {api_name} #{req_num}: 执行失败 - {str(e)}")
-    
-    total_elapsed = time.time() - total_start
-    
-    # 统计结果
-    print("\n" + "=" * 80)
-    print("测试结果统计")
+                api_elapsed = response.json().get('elapsed_ms')
+            except ValueError:
+                pass
+        return response.status_code, len(response.content), api_elapsed
+    except Exception:
+        return 'error', 0, None
+
+
+def open_schedule(targets, rate, duration, start):
+    """开环固定速率：总速率 rate，按目标轮流发送"""
+    interval = 1 / rate
+    for i in range(int(rate * duration)):
+        yield start + i * interval, targets[i % len(targets)]
+
+
+def profile_schedule(targets, duration, start, speedup):
+    """按文档约定频率：每个目标以各自的周期发送（随机初始相位，避免所有设备同时请求）"""
+    heap = []
+    for index, target in enumerate(targets):
+        period = 1 / (target[2] * speedup)
+        heapq.heappush(heap, (start + random.uniform(0, period), index, period))
+    end = start + duration
+    while heap:
+        at, index, period = heapq.heappop(heap)
+        if at >= end:
+            break
+        yield at, targets[index]
+        heapq.heappush(heap, (at + period, index, period))
+
+
+def run(args):
+    routes = DEFAULT_ROUTES if args.routes == 'default' else list(ROUTES) if args.routes == 'all' else args.routes.split(',')
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        sys.exit(f"未知的接口: {', '.join(unknown)}（可选: {', '.join(ROUTES)}）")
+    if 'trend' in routes and not args.trend_columns:
+        if args.routes != 'all':
+            sys.exit("趋势接口需要 --trend-columns")
+        routes.remove('trend')
+        print("未指定 --trend-columns，跳过趋势接口")
+    codes = load_codes(args)
+    targets = build_targets(routes, codes, args.batch_size)
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def execute(target, scheduled):
+        started = time.perf_counter()
+        status, size, api_elapsed = send(session(), args, target)
+        done = time.perf_counter()
+        stats[target[0]].record(done - (scheduled or started), done - started, status, size, api_elapsed)
+
+    print("=" * 80)
+    print("API 基准测试")
     print("=" * 80)
-    
-    process_results = [r for r in results if r['api'] == 'process_data']
-    efficiency_results = [r for r in results if r['api'] == 'efficiency_data']
-    
-    successful = sum(1 for r in results if r['status'] == 'success')
-    failed = sum(1 for r in results if r['status'] != 'success')
-    
-    print(f"总请求数: {len(results)}")
-    print(f"成功: {successful}")
-    print(f"失败: {failed}")
-    print(f"总耗时: {total_elapsed:.3f}s")
-    print()
-    
-    if process_results:
-        print("process_data 接口结果:")
-        print(f"  请求数: {len(process_results)}")
-        process_success = [r for r in process_results if r['status'] == 'success']
-        if process_success:
-            process_elapsed = [r['elapsed'] for r in process_success]
-            process_api_elapsed = [float(r['api_elapsed_ms']) for r in process_success if isinstance(r.get('api_elapsed_ms'), (int, float)) or (isinstance(r.get('api_elapsed_ms'), str) and r.get('api_elapsed_ms') != 'N/A')]
-            print(f"  成功: {len(process_success)}")
-            print(f"  平均响应时间: {sum(process_elapsed) / len(process_elapsed):.3f}s")
-            print(f"  最快: {min(process_elapsed):.3f}s")
-            print(f"  最慢: {max(process_elapsed):.3f}s")
-            if process_api_elapsed:
-                print(f"  平均查询时间(API内部): {sum(process_api_elapsed) / len(process_api_elapsed):.2f}ms")
-            if process_success[0].get('data_fields'):
-                print(f"  返回字段数: {process_success[0]['data_fields']}")
-    
-    print()
-    
-    if efficiency_results:
-        print("efficiency_data 接口结果:")
-        print(f"  请求数: {len(efficiency_results)}")
-        efficiency_success = [r for r in efficiency_results if r['status'] == 'success']
-        if efficiency_success:
-            efficiency_elapsed = [r['elapsed'] for r in efficiency_success]
-            efficiency_api_elapsed = [float(r['api_elapsed_ms']) for r in efficiency_success if isinstance(r.get('api_elapsed_ms'), (int, float)) or (isinstance(r.get('api_elapsed_ms'), str) and r.get('api_elapsed_ms') != 'N/A')]
-            print(f"  成功: {len(efficiency_success)}")
-            print(f"  平均响应时间: {sum(efficiency_elapsed) / len(efficiency_elapsed):.3f}s")
-            print(f"  最快: {min(efficiency_elapsed):.3f}s")
-            print(f"  最慢: {max(efficiency_elapsed):.3f}s")
-            if efficiency_api_elapsed:
-                print(f"  平均查询时间(API内部): {sum(efficiency_api_elapsed) / len(efficiency_api_elapsed):.2f}ms")
-            if efficiency_success[0].get('data_fields'):
-                print(f"  返回字段数: {efficiency_success[0]['data_fields']}")
-    
-    print("\n" + "=" * 80)
-    
-    # 详细结果
-    print("\n详细请求结果:")
-    print("-" * 80)
-    for i, result in enumerate(sorted(results, key=lambda x: (x['api'], x['request_num'])), 1):
-        if result['status'] == 'success':
-            print(f"{i:2}. {result['api']:15} #{result['request_num']:2}: {result['elapsed']:.3f}s | "
-                  f"API耗时: {result['api_elapsed_ms']}ms | 字段数: {result['data_fields']}")
+    print(f"目标 URL: {args.base_url}, 模式: {args.mode}, 设备数: {len(codes)}, 接口: {', '.join(routes)}")
+
+    # 预热：每个目标请求一次，使快照登记全部表
+    with ThreadPoolExecutor(max_workers=min(args.concurrency, 32)) as executor:
+        for _ in range(args.warmup):
+            list(executor.map(lambda t: send(session(), args, t), targets))
+
+    stats = {name: RouteStats() for name in routes}
+    total_start = time.perf_counter()
+    if args.mode == 'closed':
+        print(f"闭环：{args.concurrency} 个并发，{'共 ' + str(args.requests) + ' 个请求' if args.requests else f'持续 {args.duration}s'}")
+        counter = iter(range(args.requests or sys.maxsize))
+        counter_lock = threading.Lock()
+        deadline = total_start + args.duration
+
+        def worker():
+            while time.perf_counter() < deadline or args.requests:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                execute(targets[i % len(targets)], None)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        if args.mode == 'open':
+            schedule = open_schedule(targets, args.rate, args.duration, total_start)
+            print(f"开环：固定 {args.rate} QPS，持续 {args.duration}s，最大并发 {args.concurrency}")
         else:
-            print(f"{i:2}. {result['api']:15} #{result['request_num']:2}: {result['status']:10} | {result.get('error', '')[:50]}")
+            offered = sum(t[2] for t in targets) * args.speedup
+            schedule = profile_schedule(targets, args.duration, total_start, args.speedup)
+            print(f"按约定频率：{len(targets)} 个目标，合计 {offered:.1f} QPS（×{args.speedup}），持续 {args.duration}s")
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for at, target in schedule:
+                delay = at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(execute, target, at)
+    duration = time.perf_counter() - total_start
+
+    total = RouteStats()
+    for route_stats in stats.values():
+        total.merge(route_stats)
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'base_url': args.base_url,
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'rate': args.rate if args.mode == 'open' else None,
+            'speedup': args.speedup if args.mode == 'profile' else None,
+            'duration': round(duration, 3),
+            'codes': len(codes),
+            'routes': routes,
+            'method': args.method,
+        },
+        'routes': {name: route_stats.report(duration) for name, route_stats in stats.items()},
+        'total': total.report(duration),
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+def print_report(report):
+    print("=" * 80)
+    print(f"{'接口':<34}{'请求':>7}{'错误':>6}{'QPS':>9}{'P50':>9}{'P95':>9}{'P99':>9}{'P99.9':>9}{'最大':>9}")
+    for name, r in (*report['routes'].items(), ('合计', report['total'])):
+        if not r['requests']:
+            print(f"{name:<34}{0:>7}")
+            continue
+        print(f"{name:<34}{r['requests']:>7}{r['errors']:>6}{r['throughput']:>9.1f}{r['p50_ms']:>9.2f}"
+              f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['p999_ms']:>9.2f}{r['max_ms']:>9.2f}")
+    print(f"耗时单位: ms，总时长: {report['meta']['duration']:.1f}s")
+    print("=" * 80)
+
+
+def compare(args):
+    """对比两次结果：延迟或错误率上升、吞吐下降超过阈值（%）记为退化"""
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    regressions = []
+    print("=" * 80)
+    print(f"对比: {args.base} → {args.new}（阈值 {args.threshold}%）")
+    print("=" * 80)
+    print(f"{'接口':<34}{'指标':<12}{'基线':>12}{'本次':>12}{'变化':>10}")
+    names = [n for n in base['routes'] if n in new['routes']] + ['total']
+    for name in names:
+        old_r = base['total'] if name == 'total' else base['routes'][name]
+        new_r = new['total'] if name == 'total' else new['routes'][name]
+        if not old_r.get('requests') or not new_r.get('requests'):
+            continue
+        for metric, higher_is_worse in COMPARE_METRICS.items():
+            old_v, new_v = old_r[metric], new_r[metric]
+            if metric == 'error_rate':
+                # 错误率按绝对值比较（百分点）
+                change = (new_v - old_v) * 100
+                worse = change > args.threshold / 10
+                text = f"{change:+.2f}pp"
+            else:
+                change = (new_v - old_v) / old_v * 100 if old_v else 0
+                worse = change > args.threshold if higher_is_worse else change < -args.threshold
+                text = f"{change:+.1f}%"
+            flag = '  ← 退化' if worse else ''
+            print(f"{name:<34}{metric:<12}{old_v:>12}{new_v:>12}{text:>10}{flag}")
+            if worse:
+                regressions.append((name, metric, old_v, new_v))
+    print("=" * 80)
+    if regressions:
+        print(f"发现 {len(regressions)} 项退化")
+        sys.exit(1)
+    print("未发现退化")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='接口压测与基准测试')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('run', help='执行压测')
+    p.add_argument('--base-url', default=BASE_URL)
+    p.add_argument('--mode', choices=['closed', 'open', 'profile'], default='closed',
+                   help='closed 闭环（固定并发）；open 开环（固定速率）；profile 按文档约定的每设备请求频率')
+    p.add_argument('--routes', default='default', help="逗号分隔的接口名，'default' 为全部单设备与全局接口，'all' 含批量、历史、趋势与推送接口（推送接口读到第一个事件即断开）")
+    p.add_argument('--codes', help='逗号分隔的 code 列表')
+    p.add_argument('--codes-file', help='每行一个 code 的文件')
+    p.add_argument('--concurrency', type=int, default=32, help='闭环为并发数，开环为最大并发数')
+    p.add_argument('--duration', type=float, default=30, help='持续时间（秒）')
+    p.add_argument('--requests', type=int, default=0, help='闭环模式下的总请求数（设置后忽略 --duration）')
+    p.add_argument('--rate', type=float, default=50, help='开环模式的总 QPS')
+    p.add_argument('--speedup', type=float, default=1, help='profile 模式的频率倍数（模拟更多看板）')
+    p.add_argument('--method', choices=['GET', 'POST'], default='POST')
+    p.add_argument('--batch-size', type=int, default=50, help='批量接口每次请求的 code 数')
+    p.add_argument('--family', default='technology', help='历史与趋势接口的表族')
+    p.add_argument('--history-limit', type=int, default=1000, help='历史接口每次请求的行数')
+    p.add_argument('--trend-columns', help='趋势接口的字段，逗号分隔（使用趋势接口时必填）')
+    p.add_argument('--trend-method', choices=['sql', 'lttb'], default='sql', help='趋势接口的聚合方式')
+    p.add_argument('--trend-window', type=float, default=3600, help='趋势接口的时间范围（秒，截至请求时刻）')
+    p.add_argument('--stream-families', help='推送接口订阅的表族，逗号分隔，默认全部')
+    p.add_argument('--warmup', type=int, default=1, help='正式计时前每个目标预热的轮数')
+    p.add_argument('--json', help='把结果写入 JSON 文件')
+
+    c = sub.add_parser('compare', help='对比两次结果')
+    c.add_argument('base')
+    c.add_argument('new')
+    c.add_argument('--threshold', type=float, default=10, help='退化阈值（%）')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        compare(args)
+    else:
+        if args.command is None:
+            args = parser.parse_args(['run'])
+        run(args)
+
 
 if __name__ == '__main__':
     main()